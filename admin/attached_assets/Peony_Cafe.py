@@ -1,15 +1,19 @@
-import math
-import shutil
 import sqlite3
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QPushButton, QLabel, QVBoxLayout,
     QWidget, QTableWidget, QTableWidgetItem, QLineEdit, QFormLayout,
     QDialog, QFileDialog, QMessageBox, QComboBox, QHBoxLayout, QSpinBox, QToolTip,
     QToolButton, QGridLayout, QFrame, QStyle, QCalendarWidget, QDateEdit,
-    QListWidget, QDialogButtonBox, QScrollArea
+    QListWidget, QListView, QDialogButtonBox, QScrollArea, QProgressBar, QStyledItemDelegate
+)
+from PySide6.QtCore import (
+    Qt, Signal, QTimer, QPropertyAnimation, QEasingCurve, QDate, QSizeF, QRect,
+    QSortFilterProxyModel, QRegularExpression, QThread, QObject, QFileSystemWatcher, QSize
+)
+from PySide6.QtGui import (
+    QIcon, QFont, QColor, QLinearGradient, QBrush, QPixmap, QPainter, QPen, QAction,
+    QStandardItem, QStandardItemModel, QPixmapCache, QImage
 )
-from PySide6.QtCore import Qt, Signal, QTimer, QPropertyAnimation, QEasingCurve, QDate, QSizeF, QRect
-from PySide6.QtGui import QIcon, QFont, QColor, QLinearGradient, QBrush, QPixmap, QPainter, QPen, QAction
 from PySide6.QtPrintSupport import QPrinter, QPrintDialog
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.pdfgen import canvas
@@ -19,11 +23,29 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from PIL import Image, ImageDraw, ImageFont
 import arabic_reshaper
 from bidi.algorithm import get_display
+import bisect
+import multiprocessing
 import os
-import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 import jdatetime  # برای کار با تاریخ شمسی
 from PySide6.QtPrintSupport import QPrinter, QPrintDialog
+import backups
+import catalog
+import catalog_import
+import db_schema
+import db_watch
+import exports
+import forecasting
+import jalali_calendar
+import margins
+import order_service
+import price_feed
+import reports
+import stock
+import thumbnails
+from order_journal import JournalInUse, OrderJournal
 
 
 # Modern color palette
@@ -63,6 +85,454 @@ button_style = f"""
     }}
 """
 
+# Data roles used by the order screen's menu model
+MENU_PRICE_ROLE = Qt.UserRole
+MENU_CATEGORY_ROLE = Qt.UserRole + 1
+MENU_RECIPE_ID_ROLE = Qt.UserRole + 2
+
+ALL_CATEGORIES = 'همه'
+
+LOGO_SIZE = QSize(80, 80)
+
+
+class MenuCache:
+    """Priced menu shared by the order screens.
+
+    The whole menu is priced with a single query and kept until the catalog
+    changes, so switching categories never touches the database.
+    """
+
+    def __init__(self):
+        self._items = None
+        self._categories = None
+
+    def invalidate(self):
+        """Drop the cached menu; it is reloaded on next access."""
+        self._items = None
+        self._categories = None
+
+    def items(self):
+        """Return (recipe_id, name, category, final_price) tuples ordered by name."""
+        if self._items is None:
+            self._load()
+        return self._items
+
+    def categories(self):
+        """Return category names in database order."""
+        if self._categories is None:
+            self._load()
+        return self._categories
+
+    def update_recipes(self, recipe_ids):
+        """Re-read only these recipes, dropping the ones deleted or no longer priced."""
+        if self._items is None or not recipe_ids:
+            return
+        conn = sqlite3.connect("coffee_shop.db")
+        changed = {item[0]: item for item in catalog.menu(conn.cursor(), recipe_ids)}
+        conn.close()
+        recipe_ids = set(recipe_ids)
+        items = [item for item in self._items if item[0] not in recipe_ids] + list(changed.values())
+        self._items = sorted(items, key=lambda item: item[1])
+
+    def on_materials_changed(self, material_ids):
+        if self._items is None:
+            return
+        conn = sqlite3.connect("coffee_shop.db")
+        recipe_ids = catalog.recipes_using(conn.cursor(), material_ids)
+        conn.close()
+        self.update_recipes(recipe_ids)
+
+    def _load(self):
+        conn = sqlite3.connect("coffee_shop.db")
+        cursor = conn.cursor()
+        self._items = catalog.menu(cursor)
+        self._categories = catalog.categories(cursor)
+        conn.close()
+
+
+menu_cache = MenuCache()
+
+
+class ImageAssets:
+    """Logo and background images, decoded once per file version.
+
+    Decoded originals and scaled variants are kept by (path, mtime, size),
+    least recently used first out; a file changed on disk has a new mtime
+    and is decoded again.
+    """
+    MAX_ORIGINALS = 4
+    MAX_VARIANTS = 16
+
+    def __init__(self):
+        self._originals = OrderedDict()
+        self._variants = OrderedDict()
+
+    @staticmethod
+    def _remember(cache, key, value, limit):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > limit:
+            cache.popitem(last=False)
+
+    def _original(self, path, mtime):
+        key = (path, mtime)
+        if key not in self._originals:
+            image = QImage(path)
+            self._remember(self._originals, key, None if image.isNull() else image, self.MAX_ORIGINALS)
+        self._originals.move_to_end(key)
+        return self._originals[key]
+
+    def pixmap(self, path, size, fill=False):
+        """path scaled to fit in size, or to fill exactly size when fill; None if it cannot be read."""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+        key = (path, mtime, size.width(), size.height(), fill)
+        if key in self._variants:
+            self._variants.move_to_end(key)
+            return self._variants[key]
+        original = self._original(path, mtime)
+        if original is None:
+            return None
+        if fill:
+            scaled = original.scaled(size, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+            visible = QRect(0, 0, size.width(), size.height())
+            visible.moveCenter(scaled.rect().center())
+            scaled = scaled.copy(visible)
+        else:
+            scaled = original.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        pixmap = QPixmap.fromImage(scaled)
+        self._remember(self._variants, key, pixmap, self.MAX_VARIANTS)
+        return pixmap
+
+
+image_assets = ImageAssets()
+
+
+class RecipeThumbnails(QObject):
+    """Recipe photo thumbnails for the order screen's menu grid.
+
+    Thumbnails are made by thumbnails.thumbnail() in a worker process, only
+    when a tile asks for one, and the decoded pixmaps are kept in the
+    bounded QPixmapCache.
+    """
+    SIZE = 112
+    CACHE_LIMIT_KB = 32 * 1024
+
+    ready = Signal(int)
+    _made = Signal(int, str, str)
+
+    def __init__(self):
+        super().__init__()
+        self.images = {}
+        self.pending = set()
+        self.executor = None
+        self._made.connect(self._on_made)
+
+    def scan(self):
+        """Re-read which recipes have a photo."""
+        self.images = thumbnails.recipe_images()
+
+    def pixmap(self, recipe_id):
+        """The cached thumbnail, or None while it is being made or when there is no photo."""
+        path = self.images.get(recipe_id)
+        if path is None:
+            return None
+        try:
+            key = self._key(path)
+        except OSError:
+            return None
+        pixmap = QPixmap()
+        if QPixmapCache.find(key, pixmap):
+            return pixmap
+        if recipe_id not in self.pending:
+            if self.executor is None:
+                QPixmapCache.setCacheLimit(self.CACHE_LIMIT_KB)
+                # spawn, not fork: the worker must not inherit the Qt application
+                self.executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+            self.pending.add(recipe_id)
+            future = self.executor.submit(thumbnails.thumbnail, path, self.SIZE)
+            future.add_done_callback(lambda done: self._made.emit(
+                recipe_id, key, "" if done.exception() else done.result()))
+        return None
+
+    @staticmethod
+    def _key(path):
+        # A photo replaced under the same name gets a new key, and so a new thumbnail
+        stat = os.stat(path)
+        return f"recipe-thumbnail:{path}:{stat.st_mtime_ns}:{stat.st_size}"
+
+    def _on_made(self, recipe_id, key, thumbnail_path):
+        self.pending.discard(recipe_id)
+        if not thumbnail_path or recipe_id not in self.images:
+            return
+        QPixmapCache.insert(key, QPixmap(thumbnail_path))
+        self.ready.emit(recipe_id)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+recipe_thumbnails = RecipeThumbnails()
+
+
+class RecipeTileDelegate(QStyledItemDelegate):
+    """Menu grid tile: photo, name and price."""
+
+    TILE_SIZE = QSize(130, 160)
+
+    def sizeHint(self, option, index):
+        return self.TILE_SIZE
+
+    def paint(self, painter, option, index):
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        rect = option.rect.adjusted(4, 4, -4, -4)
+        selected = option.state & QStyle.State_Selected
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor("#4a4a4a" if selected else "#353535"))
+        painter.drawRoundedRect(rect, 8, 8)
+
+        size = RecipeThumbnails.SIZE
+        image_rect = QRect(rect.center().x() - size // 2, rect.top() + 4, size, size)
+        pixmap = recipe_thumbnails.pixmap(index.data(MENU_RECIPE_ID_ROLE))
+        if pixmap is not None:
+            scaled_rect = QRect(0, 0, pixmap.width(), pixmap.height())
+            scaled_rect.moveCenter(image_rect.center())
+            painter.drawPixmap(scaled_rect, pixmap)
+        else:
+            painter.setBrush(QColor("#2b2b2b"))
+            painter.drawRoundedRect(image_rect, 6, 6)
+            painter.setPen(QColor("#777777"))
+            painter.drawText(image_rect, Qt.AlignCenter, "☕")
+
+        text_rect = QRect(rect.left() + 4, image_rect.bottom() + 2, rect.width() - 8, rect.bottom() - image_rect.bottom() - 2)
+        painter.setPen(QColor("#fcd40d" if selected else "white"))
+        name = painter.fontMetrics().elidedText(index.data(), Qt.ElideRight, text_rect.width())
+        painter.drawText(text_rect, Qt.AlignHCenter | Qt.AlignTop, name)
+        painter.setPen(QColor("#fcd40d"))
+        painter.drawText(text_rect, Qt.AlignHCenter | Qt.AlignBottom, f"{int(index.data(MENU_PRICE_ROLE)):,}")
+        painter.restore()
+
+
+class CatalogIdCache:
+    """In-process name → id lookup for recipes, materials and categories."""
+
+    TABLES = ("recipes", "materials", "categories")
+
+    def __init__(self):
+        self._ids = {}
+
+    def invalidate(self):
+        self._ids = {}
+
+    def get(self, table, name):
+        """Return the id of the named row, or None if it does not exist."""
+        # A miss may only mean the cache predates the row, so it reads the table again
+        if name not in self._ids.get(table, {}):
+            if table not in self.TABLES:
+                raise ValueError(f"Unknown catalog table: {table}")
+            conn = sqlite3.connect("coffee_shop.db")
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT name, id FROM {table}")
+            self._ids[table] = dict(cursor.fetchall())
+            conn.close()
+        return self._ids[table].get(name)
+
+
+catalog_ids = CatalogIdCache()
+
+
+order_journal = None
+
+
+def get_order_journal(conn):
+    """Return this till's order journal, replaying anything left from a crash."""
+    global order_journal
+    if order_journal is None:
+        journal = OrderJournal(order_service.default_journal_path())
+        order_service.recover_orders(conn, journal)
+        order_journal = journal
+    return order_journal
+
+
+def submit_order_record(record):
+    """Send an order record to the shared order service, or journal and apply it here."""
+    service_address = get_setting("order_service_address")
+    if service_address:
+        try:
+            return order_service.submit_order(service_address, record)
+        except order_service.ServiceUnreachable:
+            # Service is down; write directly and wait for the lock instead
+            pass
+        except OSError:
+            # Sent but never acknowledged; writing it here too could record the sale twice
+            return {"ok": False, "error": "سفارش به سرویس سفارش‌ها ارسال شد ولی پاسخی نیامد و معلوم نیست ثبت شده باشد. "
+                                          "پیش از ارسال دوباره، صف آشپزخانه یا گزارش سفارشات را بررسی کنید."}
+
+    conn = order_service.connect()
+    try:
+        journal = get_order_journal(conn)
+        result = order_service.accept_orders(conn, journal, [record])[0]
+        if result["ok"]:
+            try:
+                applied = order_service.apply_journal(conn, journal)
+            except sqlite3.Error:
+                # The record is safe in the journal and is applied on the next save or start
+                applied = []
+            if applied and applied[-1]["ok"]:
+                result.update(applied[-1])
+        return result
+    finally:
+        conn.close()
+
+
+def get_setting(key, default=None):
+    """Read a value from the settings table."""
+    conn = sqlite3.connect("coffee_shop.db")
+    cursor = conn.cursor()
+    cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
+    result = cursor.fetchone()
+    conn.close()
+    return result[0] if result and result[0] else default
+
+
+def set_setting(key, value):
+    """Store a value in the settings table; empty values remove the key."""
+    conn = db_watch.connect()
+    cursor = conn.cursor()
+    if value:
+        cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+    else:
+        cursor.execute("DELETE FROM settings WHERE key = ?", (key,))
+    conn.commit()
+    conn.close()
+
+
+def invalidate_catalog():
+    """Discard cached catalog data after materials, recipes or categories change."""
+    menu_cache.invalidate()
+    catalog_ids.invalidate()
+
+
+def changes_catalog(tables):
+    """Whether any of tables holds catalog data."""
+    return any(table in db_schema.CATALOG_TABLES for table in tables)
+
+
+class CatalogEvents(QObject):
+    """Application-wide catalog and order notifications.
+
+    Each change signal carries the IDs of the rows added, edited or deleted,
+    so open windows update just those rows instead of reloading everything.
+    """
+    materials_changed = Signal(list)
+    recipes_changed = Signal(list)
+    categories_changed = Signal(list)
+    orders_saved = Signal(list)
+    # Another process changed these tables (see db_watch); which rows is not
+    # known, so windows re-read whatever they show from them
+    tables_changed = Signal(list)
+    # The whole database was replaced, e.g. by a restore; open windows reload
+    reloaded = Signal()
+
+
+catalog_events = CatalogEvents()
+# Shared caches first, so windows notified after them read fresh data
+catalog_events.materials_changed.connect(lambda _: catalog_ids.invalidate())
+catalog_events.materials_changed.connect(menu_cache.on_materials_changed)
+catalog_events.recipes_changed.connect(lambda _: catalog_ids.invalidate())
+catalog_events.recipes_changed.connect(menu_cache.update_recipes)
+catalog_events.categories_changed.connect(lambda _: invalidate_catalog())
+catalog_events.tables_changed.connect(lambda tables: invalidate_catalog() if changes_catalog(tables) else None)
+
+
+def table_rows_by_id(table, row_ids):
+    """{id: row} of the QTableWidget rows whose column 0 keeps one of row_ids in Qt.UserRole."""
+    model = table.model()
+    rows = {}
+    for row_id in row_ids:
+        # Searched by the model, without wrapping every cell for Python
+        matches = model.match(model.index(0, 0), Qt.UserRole, row_id, 1, Qt.MatchExactly)
+        if matches:
+            rows[row_id] = matches[0].row()
+    return rows
+
+
+def update_table_rows(table, rows, set_row):
+    """Write rows ({id: row values}, None for gone) into a table keyed as in table_rows_by_id.
+
+    set_row(row, values) fills one row; rows not shown yet are appended and
+    rows that are gone are removed.
+    """
+    gone = [row_id for row_id, values in rows.items() if values is None]
+    for row in sorted(table_rows_by_id(table, gone).values(), reverse=True):
+        table.removeRow(row)
+    shown = table_rows_by_id(table, [row_id for row_id, values in rows.items() if values is not None])
+    for row_id, values in rows.items():
+        if values is None:
+            continue
+        row = shown.get(row_id)
+        if row is None:
+            row = table.rowCount()
+            table.insertRow(row)
+        set_row(row, values)
+
+
+def confirm_overwrite(parent, what):
+    """Ask whether to save over a row that someone else changed while it was being edited."""
+    return QMessageBox.question(
+        parent, "تغییر هم‌زمان",
+        f"{what} در این فاصله در جای دیگری تغییر کرده است.\nتغییرات شما جایگزین آن شود؟",
+        QMessageBox.Yes | QMessageBox.No
+    ) == QMessageBox.Yes
+
+
+def exec_and_delete(dialog):
+    """Run a modal dialog and delete it once it closes; returns the exec() result.
+
+    A dialog parented to a window otherwise lives, with its tables, timers and
+    row widgets, until that window is destroyed.
+    """
+    try:
+        return dialog.exec()
+    finally:
+        dialog.deleteLater()
+
+
+class DialogManager:
+    """Opens the main window's dialogs without piling them up over a shift.
+
+    Dialogs that only show database contents are built once and kept hidden
+    between uses; they follow catalog_events, or are refreshed before each
+    open. Dialogs holding per-use state, such as an order in progress and its
+    clock, are deleted on close.
+    """
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.warm = {}
+
+    def open(self, dialog_class, *args):
+        """Open a new dialog_class(parent, *args) and delete it once closed."""
+        return exec_and_delete(dialog_class(self.parent, *args))
+
+    def open_warm(self, dialog_class, refresh=None):
+        """Open the kept dialog_class instance, building it the first time.
+
+        refresh(dialog) reloads a reused instance; a new one loads itself.
+        Without refresh the dialog keeps itself current from catalog_events.
+        """
+        dialog = self.warm.get(dialog_class)
+        if dialog is None:
+            dialog = self.warm[dialog_class] = dialog_class(self.parent)
+        elif refresh:
+            refresh(dialog)
+        return dialog.exec()
+
 
 class ModernMainWindow(QMainWindow):
     def __init__(self):
@@ -125,7 +595,6 @@ class ModernMainWindow(QMainWindow):
         # Left logo label
         self.left_logo_label = QLabel()
         self.left_logo_label.setFixedSize(80, 80)  # Reduced from 100x100
-        self.load_logo(self.left_logo_label)
         self.left_logo_label.setAlignment(Qt.AlignCenter)
         title_layout.addWidget(self.left_logo_label)
         
@@ -159,9 +628,13 @@ class ModernMainWindow(QMainWindow):
         # Right logo label
         self.right_logo_label = QLabel()
         self.right_logo_label.setFixedSize(80, 80)  # Reduced from 100x100
-        self.load_logo(self.right_logo_label)
         self.right_logo_label.setAlignment(Qt.AlignCenter)
         title_layout.addWidget(self.right_logo_label)
+
+        # Background pre-scaled to the window size; repaints only draw it
+        self.background_path = None
+        self.background_pixmap = None
+        self.apply_branding()
         
         layout.addLayout(title_layout)
         
@@ -479,8 +952,9 @@ class ModernMainWindow(QMainWindow):
         layout.addLayout(tiles_layout)
 
         # Initialize dialogs
+        self.dialogs = DialogManager(self)
         self.materials_dialog = MaterialsDialog(self)
-        self.materials_dialog.material_updated.connect(self.refresh_prices)
+        catalog_events.reloaded.connect(self.on_catalog_reloaded)
 
         # اضافه کردن منوی گزارش‌گیری
         menu_bar = self.menuBar()
@@ -488,6 +962,58 @@ class ModernMainWindow(QMainWindow):
         order_report_action = QAction("گزارش سفارشات", self)
         order_report_action.triggered.connect(self.show_order_reports)
         report_menu.addAction(order_report_action)
+        margin_report_action = QAction("گزارش سود ناخالص", self)
+        margin_report_action.triggered.connect(self.show_margin_report)
+        report_menu.addAction(margin_report_action)
+        forecast_action = QAction("پیش‌بینی خرید مواد", self)
+        forecast_action.triggered.connect(self.show_forecast)
+        report_menu.addAction(forecast_action)
+        export_action = QAction("خروجی CSV / Excel", self)
+        export_action.triggered.connect(self.show_export)
+        report_menu.addAction(export_action)
+
+        orders_menu = menu_bar.addMenu("سفارشات")
+        kitchen_queue_action = QAction("صف آشپزخانه و بار", self)
+        kitchen_queue_action.triggered.connect(self.show_kitchen_queue)
+        orders_menu.addAction(kitchen_queue_action)
+
+        stock_menu = menu_bar.addMenu("انبار")
+        stock_action = QAction("موجودی مواد اولیه", self)
+        stock_action.triggered.connect(self.show_stock)
+        stock_menu.addAction(stock_action)
+
+        catalog_menu = menu_bar.addMenu("کاتالوگ")
+        import_action = QAction("ورود گروهی از CSV", self)
+        import_action.triggered.connect(self.show_catalog_import)
+        catalog_menu.addAction(import_action)
+
+        # Supplier price files dropped into the watched folder
+        self.price_feed_thread = None
+        self.price_feed_timer = QTimer(self)
+        self.price_feed_timer.setSingleShot(True)
+        self.price_feed_timer.setInterval(2000)  # let the file finish copying
+        self.price_feed_timer.timeout.connect(self.process_price_feed)
+        self.price_feed_watcher = QFileSystemWatcher(self)
+        self.price_feed_watcher.directoryChanged.connect(lambda _: self.price_feed_timer.start())
+        self.start_price_feed()
+
+        # Hourly incremental snapshots; a full copy is taken at closing
+        self.backup_thread = None
+        self.backup_notify = False
+        self.backup_timer = QTimer(self)
+        self.backup_timer.setInterval(60 * 60 * 1000)
+        self.backup_timer.timeout.connect(lambda: self.run_backup(
+            lambda progress: backups.snapshot("hourly", get_setting("backup_folder", backups.BACKUP_DIR),
+                                              progress=progress)))
+        self.backup_timer.start()
+
+        # Changes other tills and tools commit to the database
+        self.table_watcher = db_watch.TableWatcher(db_schema.WATCHED_TABLES)
+        self.table_watch_timer = QTimer(self)
+        self.table_watch_timer.setInterval(1000)
+        self.table_watch_timer.timeout.connect(self.poll_tables)
+        self.table_watch_timer.start()
+        catalog_events.tables_changed.connect(self.on_tables_changed)
 
     def create_styled_button(self, text):
         """Create a styled button with modern appearance."""
@@ -501,30 +1027,27 @@ class ModernMainWindow(QMainWindow):
 
     def manage_recipes(self):
         """Open the recipes management window."""
-        dialog = RecipesDialog(self)
-        dialog.exec()
+        self.dialogs.open_warm(RecipesDialog)
 
     def show_prices(self):
         """Open the prices display window."""
-        self.prices_dialog = PricesDialog(self)
-        self.prices_dialog.exec()
+        self.dialogs.open_warm(PricesDialog)
 
     def open_settings(self):
         """Open the settings dialog."""
-        dialog = SettingsDialog(self)
-        dialog.exec()
+        self.dialogs.open_warm(SettingsDialog, SettingsDialog.load_settings)
 
     def refresh_prices(self):
         """Refresh the prices display."""
-        if hasattr(self, 'prices_dialog'):
-            self.prices_dialog.refresh_prices()
+        prices_dialog = self.dialogs.warm.get(PricesDialog)
+        if prices_dialog is not None:
+            prices_dialog.refresh_prices()
 
     def show_search_results(self):
         """Show search results in a separate dialog."""
         search_text = self.search_box.text().strip()
         if search_text:
-            dialog = SearchResultsDialog(self, search_text)
-            dialog.exec()
+            self.dialogs.open(SearchResultsDialog, search_text)
 
     def start_tooltip_timer(self, widget, text):
         """Start the tooltip timer for the given widget."""
@@ -542,35 +1065,192 @@ class ModernMainWindow(QMainWindow):
         if self.tooltip_widget:
             QToolTip.showText(self.tooltip_widget.mapToGlobal(self.tooltip_widget.rect().bottomLeft()), self.tooltip_text)
 
-    def load_logo(self, label):
-        """Load logo from saved settings."""
-        conn = sqlite3.connect("coffee_shop.db")
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        """)
-        cursor.execute("SELECT value FROM settings WHERE key = 'logo_path'")
-        result = cursor.fetchone()
-        conn.close()
+    def apply_branding(self):
+        """Show the logo and background image chosen in settings."""
+        logo = image_assets.pixmap(get_setting("logo_path"), LOGO_SIZE)
+        for label in (self.left_logo_label, self.right_logo_label):
+            if logo is not None:
+                label.setPixmap(logo)
+            else:
+                label.clear()
+        self.background_path = get_setting("background_path")
+        self.update_background()
 
-        if result and result[0]:
-            logo_path = result[0]
-            if logo_path and QPixmap(logo_path).isNull() == False:
-                pixmap = QPixmap(logo_path)
-                scaled_pixmap = pixmap.scaled(80, 80, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                label.setPixmap(scaled_pixmap)
+    def update_background(self):
+        self.background_pixmap = image_assets.pixmap(self.background_path, self.size(), fill=True)
+        self.update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.background_path:
+            self.update_background()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.background_pixmap is not None:
+            QPainter(self).drawPixmap(0, 0, self.background_pixmap)
 
     def manage_orders(self):
         """Open the order management window."""
-        dialog = OrderDialog(self)
-        dialog.exec()
+        self.dialogs.open(OrderDialog)
 
     def show_order_reports(self):
-        dialog = OrderReportDialog(self)
-        dialog.exec()
+        self.dialogs.open_warm(OrderReportDialog, OrderReportDialog.load_orders)
+
+    def show_margin_report(self):
+        self.dialogs.open(MarginReportDialog)
+
+    def show_forecast(self):
+        self.dialogs.open(ForecastDialog)
+
+    def show_export(self):
+        self.dialogs.open(ExportDialog)
+
+    def show_kitchen_queue(self):
+        self.dialogs.open(KitchenQueueDialog)
+
+    def show_stock(self):
+        self.dialogs.open(StockDialog)
+
+    def show_catalog_import(self):
+        self.dialogs.open(CatalogImportDialog)
+
+    def run_backup(self, job, notify=False):
+        """Run job(progress) -> backup path on a worker thread so tills keep working"""
+        if self.backup_thread and self.backup_thread.isRunning():
+            if notify:
+                QMessageBox.warning(self, "هشدار", "یک پشتیبان‌گیری دیگر در حال انجام است.")
+            return
+        self.backup_thread = QThread(self)
+        self.backup_worker = BackupWorker(job)
+        self.backup_worker.moveToThread(self.backup_thread)
+        self.backup_thread.started.connect(self.backup_worker.run)
+        self.backup_notify = notify
+        self.backup_worker.progress.connect(self.on_backup_progress)
+        self.backup_worker.finished.connect(self.on_backup_done)
+        self.backup_worker.failed.connect(self.on_backup_failed)
+        self.backup_worker.finished.connect(self.backup_thread.quit)
+        self.backup_worker.failed.connect(self.backup_thread.quit)
+        self.backup_thread.finished.connect(self.backup_worker.deleteLater)
+        self.backup_thread.start()
+
+    def on_backup_progress(self, done, total):
+        self.statusBar().showMessage(f"پشتیبان‌گیری: {done * 100 // max(total, 1)}٪")
+
+    def on_backup_failed(self, error):
+        self.statusBar().showMessage(f"خطا در پشتیبان‌گیری: {error}")
+        if self.backup_notify:
+            QMessageBox.critical(self, "خطا", f"خطا در ایجاد نسخه پشتیبان:\n{error}")
+
+    def on_backup_done(self, path):
+        self.statusBar().showMessage(f"نسخه پشتیبان ذخیره شد: {path}", 15000)
+        if self.backup_notify:
+            QMessageBox.information(self, "موفقیت", f"نسخه پشتیبان با موفقیت در مسیر زیر ذخیره شد:\n{path}")
+
+    def wait_for_workers(self):
+        """Let running backup and price feed workers finish and release their connections"""
+        for thread in (self.backup_thread, self.price_feed_thread):
+            if thread and thread.isRunning():
+                # quit() is queued behind the job, so wait() does not block on it
+                thread.quit()
+                thread.wait()
+
+    def restore_database(self, backup_path):
+        """Replace the live database with a backup while the application keeps running.
+
+        Returns the path of the safety copy taken of the current database.
+        """
+        self.wait_for_workers()
+        # The watcher's connection is the only one kept open; restored tables are announced below
+        self.table_watch_timer.stop()
+        self.table_watcher.close()
+        current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+        auto_backup_path = os.path.join(os.path.dirname(__file__), f"coffee_shop_auto_backup_{current_time}.db")
+        try:
+            backups.backup_database(auto_backup_path)
+            backups.restore_database(backup_path)
+        finally:
+            self.table_watcher = db_watch.TableWatcher(db_schema.WATCHED_TABLES)
+            self.table_watch_timer.start()
+        if order_journal is not None:
+            # Everything journaled so far was just marked applied; nothing is left to replay
+            order_journal.applied(order_journal.size)
+
+        migration_conn = order_service.connect()
+        try:
+            db_schema.migrate(migration_conn)
+        finally:
+            migration_conn.close()
+        invalidate_catalog()
+        catalog_events.reloaded.emit()
+        catalog_events.tables_changed.emit(list(db_schema.WATCHED_TABLES))
+        return auto_backup_path
+
+    def on_catalog_reloaded(self):
+        """Refresh everything shown from the database after it was replaced"""
+        self.apply_branding()
+        self.materials_dialog.refresh_materials()
+        self.refresh_prices()
+        self.start_price_feed()
+
+    def poll_tables(self):
+        changed = self.table_watcher.poll()
+        if changed:
+            catalog_events.tables_changed.emit(changed)
+
+    def on_tables_changed(self, tables):
+        if "settings" in tables:
+            self.apply_branding()
+
+    def closeEvent(self, event):
+        """Take the closing backup before the application exits"""
+        self.table_watch_timer.stop()
+        self.table_watcher.close()
+        self.wait_for_workers()
+        recipe_thumbnails.shutdown()
+        try:
+            backups.scheduled_backup("closing", get_setting("backup_folder", backups.BACKUP_DIR))
+        except (OSError, sqlite3.Error, backups.BackupError) as e:
+            QMessageBox.warning(self, "خطا", f"نسخه پشتیبان پایان روز ایجاد نشد:\n{str(e)}")
+        super().closeEvent(event)
+
+    def start_price_feed(self):
+        """Watch the price feed folder from settings, picking up files already waiting there"""
+        if self.price_feed_watcher.directories():
+            self.price_feed_watcher.removePaths(self.price_feed_watcher.directories())
+        folder = get_setting("price_feed_folder")
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+            self.price_feed_watcher.addPath(folder)
+            self.price_feed_timer.start()
+
+    def process_price_feed(self):
+        folder = get_setting("price_feed_folder")
+        if not folder or not price_feed.pending_files(folder):
+            return
+        if self.price_feed_thread and self.price_feed_thread.isRunning():
+            self.price_feed_timer.start()
+            return
+
+        self.price_feed_thread = QThread(self)
+        self.price_feed_worker = PriceFeedWorker(folder)
+        self.price_feed_worker.moveToThread(self.price_feed_thread)
+        self.price_feed_thread.started.connect(self.price_feed_worker.run)
+        self.price_feed_worker.finished.connect(self.on_price_feed_done)
+        self.price_feed_worker.finished.connect(self.price_feed_thread.quit)
+        self.price_feed_thread.finished.connect(self.price_feed_worker.deleteLater)
+        self.price_feed_thread.start()
+
+    def on_price_feed_done(self, changes, recipe_ids, unmatched, failed):
+        """Reprice only the recipes that use materials whose price changed"""
+        if changes:
+            catalog_events.materials_changed.emit([change[0] for change in changes])
+        message = f"قیمت‌های تأمین‌کننده: {len(changes)} ماده تغییر کرد، {len(recipe_ids)} آیتم بازقیمت‌گذاری شد"
+        if unmatched:
+            message += f"، {len(unmatched)} ردیف بدون تطابق"
+        if failed:
+            message += f"، خطا در فایل: {'، '.join(failed)}"
+        self.statusBar().showMessage(message, 15000)
 
 
 class SearchResultsDialog(QDialog):
@@ -625,71 +1305,14 @@ class SearchResultsDialog(QDialog):
         if not search_text and self.initial_search:
             search_text = self.initial_search
 
-        # Search in materials
         conn = sqlite3.connect("coffee_shop.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, price_per_gram FROM materials WHERE name LIKE ?", (f"%{search_text}%",))
-        materials = cursor.fetchall()
+        materials, recipes = catalog.search(conn.cursor(), search_text)
+        conn.close()
         for name, price in materials:
             results.append(("مواد اولیه", name, "-", f"قیمت هر گرم: {price} تومان", "-"))
-
-        # Search in recipes and their categories
-        cursor.execute("""
-            SELECT r.id, r.name, 
-                   c.name as category_name,
-                   SUM(rd.quantity * m.price_per_gram) AS raw_price
-            FROM recipes r
-            LEFT JOIN categories c ON r.category_id = c.id
-            JOIN recipe_details rd ON r.id = rd.recipe_id
-            JOIN materials m ON rd.material_id = m.id
-            WHERE r.name LIKE ? OR c.name LIKE ?
-            GROUP BY r.id
-        """, (f"%{search_text}%", f"%{search_text}%"))
-        menu_items = cursor.fetchall()
-        
-        # Also search for exact category matches to show all items in that category
-        cursor.execute("""
-            SELECT r.id, r.name, 
-                   c.name as category_name,
-                   SUM(rd.quantity * m.price_per_gram) AS raw_price
-            FROM recipes r
-            JOIN categories c ON r.category_id = c.id
-            JOIN recipe_details rd ON r.id = rd.recipe_id
-            JOIN materials m ON rd.material_id = m.id
-            WHERE c.name = ?
-            GROUP BY r.id
-        """, (search_text,))
-        category_items = cursor.fetchall()
-        
-        # Combine and remove duplicates
-        all_items = set()
-        for recipe_id, name, category, raw_price in menu_items + category_items:
-            if raw_price is None:
-                continue
-                
-            # Get recipe ingredients
-            cursor.execute("""
-                SELECT m.name, rd.quantity
-                FROM recipe_details rd
-                JOIN materials m ON rd.material_id = m.id
-                WHERE rd.recipe_id = ?
-                ORDER BY m.name
-            """, (recipe_id,))
-            ingredients = cursor.fetchall()
-            
-            # Format ingredients list
-            ingredients_text = "\n".join([f"• {name}: {quantity} گرم" for name, quantity in ingredients])
-            
-            raw_price = round(raw_price)
-            secondary_price = round(raw_price * 3.3)
-            price_with_tax = round(secondary_price * 1.1)
-            final_price = math.ceil(price_with_tax)
-            item_tuple = ("قیمت‌ها", name, category or "بدون دسته‌بندی", 
-                         f"قیمت نهایی: {final_price} تومان", ingredients_text)
-            all_items.add(item_tuple)
-        
-        results.extend(all_items)
-        conn.close()
+        for name, category, final_price, ingredients in recipes:
+            ingredients_text = "\n".join([f"• {material}: {quantity} گرم" for material, quantity in ingredients])
+            results.append(("قیمت‌ها", name, category, f"قیمت نهایی: {final_price} تومان", ingredients_text))
 
         # Display results
         self.table.setRowCount(len(results))
@@ -747,9 +1370,6 @@ class SettingsDialog(QDialog):
         
         self.layout.addLayout(logo_layout)
 
-        # Load current logo if exists
-        self.load_current_logo()
-
         # Font size
         self.font_size_label = QLabel("سایز فونت:")
         self.layout.addWidget(self.font_size_label)
@@ -766,6 +1386,31 @@ class SettingsDialog(QDialog):
         self.select_background_button.clicked.connect(self.select_background_image)
         self.layout.addWidget(self.select_background_button)
 
+        # Shared order service for multiple tills
+        self.order_service_label = QLabel("آدرس سرویس سفارشات (اختیاری):")
+        self.layout.addWidget(self.order_service_label)
+
+        self.order_service_input = QLineEdit()
+        self.order_service_input.setPlaceholderText(f"127.0.0.1:{order_service.DEFAULT_PORT}")
+        self.order_service_input.setLayoutDirection(Qt.LeftToRight)
+        self.layout.addWidget(self.order_service_input)
+
+        # Folder watched for supplier price files
+        self.price_feed_label = QLabel("پوشه فایل‌های قیمت تأمین‌کننده (اختیاری):")
+        self.layout.addWidget(self.price_feed_label)
+
+        self.price_feed_input = QLineEdit()
+        self.price_feed_input.setLayoutDirection(Qt.LeftToRight)
+        self.layout.addWidget(self.price_feed_input)
+
+        # Folder for hourly and closing backups
+        self.backup_folder_label = QLabel("پوشه نسخه‌های پشتیبان خودکار:")
+        self.layout.addWidget(self.backup_folder_label)
+
+        self.backup_folder_input = QLineEdit()
+        self.backup_folder_input.setLayoutDirection(Qt.LeftToRight)
+        self.layout.addWidget(self.backup_folder_input)
+
         # Add separator
         separator = QFrame()
         separator.setFrameShape(QFrame.HLine)
@@ -819,8 +1464,16 @@ class SettingsDialog(QDialog):
         self.save_button.clicked.connect(self.save_settings)
         self.layout.addWidget(self.save_button)
 
-        self.background_image_path = ""
         self.font_size_spinbox.setValue(12)
+        self.load_settings()
+
+    def load_settings(self):
+        """Show the saved settings, dropping any unsaved edits."""
+        self.load_current_logo()
+        self.order_service_input.setText(get_setting("order_service_address", ""))
+        self.price_feed_input.setText(get_setting("price_feed_folder", ""))
+        self.backup_folder_input.setText(get_setting("backup_folder", backups.BACKUP_DIR))
+        self.background_image_path = get_setting("background_path", "")
 
     def create_backup(self):
         """Create a backup of the database file."""
@@ -836,16 +1489,9 @@ class SettingsDialog(QDialog):
             )
             
             if backup_path:
-                conn = sqlite3.connect("coffee_shop.db")
-                conn.close()
-                
-                shutil.copy2("coffee_shop.db", backup_path)
-                
-                QMessageBox.information(
-                    self,
-                    "موفقیت",
-                    f"نسخه پشتیبان با موفقیت در مسیر زیر ذخیره شد:\n{backup_path}"
-                )
+                # Copied online on the main window's worker thread; it reports when done
+                self.parent().run_backup(
+                    lambda progress: backups.backup_database(backup_path, progress=progress), notify=True)
         except Exception as e:
             QMessageBox.critical(
                 self,
@@ -860,9 +1506,18 @@ class SettingsDialog(QDialog):
                 self,
                 "انتخاب فایل پشتیبان",
                 "",
-                "Database Files (*.db)"
+                "Backup Files (*.db *.json)"
             )
             
+            if backup_path.endswith(".json"):
+                # Incremental snapshot: reassemble it into a database file first
+                try:
+                    backup_path = backups.restore_snapshot(
+                        backup_path, os.path.join(os.path.dirname(__file__), "coffee_shop_snapshot_restore.db"))
+                except (OSError, ValueError, KeyError, backups.BackupError) as e:
+                    QMessageBox.critical(self, "خطا", f"بازسازی نسخه پشتیبان ممکن نشد:\n{str(e)}")
+                    return
+
             if backup_path:
                 # Verify backup file
                 try:
@@ -902,25 +1557,13 @@ class SettingsDialog(QDialog):
                 )
                 
                 if confirm == QMessageBox.Yes:
-                    # Close any open database connections
-                    try:
-                        conn = sqlite3.connect("coffee_shop.db")
-                        conn.close()
-                    except:
-                        pass
-                    
-                    # Create a backup of current database before restore
-                    current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    auto_backup = f"coffee_shop_auto_backup_{current_time}.db"
-                    auto_backup_path = os.path.join(os.path.dirname(__file__), auto_backup)
-                    shutil.copy2("coffee_shop.db", auto_backup_path)
-                    
-                    # Restore from backup
-                    shutil.copy2(backup_path, "coffee_shop.db")
-                    
-                    # Initialize restored database
-                    init_db()
-                    
+                    # Restored in place; open windows reload through catalog_events
+                    auto_backup_path = self.parent().restore_database(backup_path)
+                    if backup_path.endswith("coffee_shop_snapshot_restore.db"):
+                        os.remove(backup_path)
+
+                    self.load_settings()
+
                     QMessageBox.information(
                         self,
                         "موفقیت",
@@ -928,18 +1571,6 @@ class SettingsDialog(QDialog):
                         f"یک نسخه پشتیبان خودکار از دیتابیس قبلی در مسیر زیر ایجاد شد:\n{auto_backup_path}"
                     )
                     
-                    # Restart application
-                    confirm_restart = QMessageBox.question(
-                        self,
-                        "راه‌اندازی مجدد",
-                        "برای اعمال تغییرات، برنامه باید مجدداً راه‌اندازی شود. آیا می‌خواهید برنامه را مجدداً راه‌اندازی کنید؟",
-                        QMessageBox.Yes | QMessageBox.No
-                    )
-                    
-                    if confirm_restart == QMessageBox.Yes:
-                        QApplication.quit()
-                        os.execl(sys.executable, sys.executable, *sys.argv)
-                    
         except Exception as e:
             QMessageBox.critical(
                 self,
@@ -949,22 +1580,13 @@ class SettingsDialog(QDialog):
 
     def load_current_logo(self):
         """Load the current logo from settings."""
-        conn = sqlite3.connect("coffee_shop.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT value FROM settings WHERE key = 'logo_path'")
-        result = cursor.fetchone()
-        conn.close()
-
-        if result and result[0]:
-            logo_path = result[0]
-            if logo_path and QPixmap(logo_path).isNull() == False:
-                pixmap = QPixmap(logo_path)
-                scaled_pixmap = pixmap.scaled(80, 80, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                self.logo_preview.setPixmap(scaled_pixmap)
-                self.current_logo_path = logo_path
-            else:
-                self.current_logo_path = None
+        logo_path = get_setting("logo_path")
+        pixmap = image_assets.pixmap(logo_path, LOGO_SIZE)
+        if pixmap is not None:
+            self.logo_preview.setPixmap(pixmap)
+            self.current_logo_path = logo_path
         else:
+            self.logo_preview.clear()
             self.current_logo_path = None
 
     def select_logo(self):
@@ -976,14 +1598,13 @@ class SettingsDialog(QDialog):
             "Image files (*.png *.jpg *.jpeg *.bmp *.gif)"
         )
         if file_path:
-            pixmap = QPixmap(file_path)
-            if not pixmap.isNull():
-                scaled_pixmap = pixmap.scaled(80, 80, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                self.logo_preview.setPixmap(scaled_pixmap)
+            pixmap = image_assets.pixmap(file_path, LOGO_SIZE)
+            if pixmap is not None:
+                self.logo_preview.setPixmap(pixmap)
                 self.current_logo_path = file_path
 
                 # Save to database
-                conn = sqlite3.connect("coffee_shop.db")
+                conn = db_watch.connect()
                 cursor = conn.cursor()
                 cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
                              ("logo_path", file_path))
@@ -992,8 +1613,7 @@ class SettingsDialog(QDialog):
 
                 # Update main window logos
                 if isinstance(self.parent(), ModernMainWindow):
-                    self.parent().load_logo(self.parent().right_logo_label)
-                    self.parent().load_logo(self.parent().left_logo_label)
+                    self.parent().apply_branding()
 
     def remove_logo(self):
         """Remove the current logo."""
@@ -1001,7 +1621,7 @@ class SettingsDialog(QDialog):
         self.current_logo_path = None
 
         # Remove from database
-        conn = sqlite3.connect("coffee_shop.db")
+        conn = db_watch.connect()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM settings WHERE key = 'logo_path'")
         conn.commit()
@@ -1021,28 +1641,23 @@ class SettingsDialog(QDialog):
     def save_settings(self):
         """Save the settings."""
         font_size = self.font_size_spinbox.value()
+        set_setting("order_service_address", self.order_service_input.text().strip())
+        set_setting("price_feed_folder", self.price_feed_input.text().strip())
+        set_setting("backup_folder", self.backup_folder_input.text().strip())
+        if hasattr(self.parent(), "start_price_feed"):
+            self.parent().start_price_feed()
 
-        if self.current_logo_path:
-            style_sheet = f"""
-                QMainWindow {{
-                    background-image: url('{self.background_image_path}');
-                    background-repeat: no-repeat;
-                    background-position: center;
-                }}
-                QLabel, QPushButton {{
-                    font-size: {font_size}px;
-                }}
-            """
-            self.parent().setStyleSheet(style_sheet)
-        else:
-            self.parent().setStyleSheet(f"QLabel, QPushButton {{ font-size: {font_size}px; }}")
+        set_setting("background_path", self.background_image_path)
+
+        # The background is painted by the main window, pre-scaled to its size
+        self.parent().setStyleSheet(f"QLabel, QPushButton {{ font-size: {font_size}px; }}")
+        if hasattr(self.parent(), "apply_branding"):
+            self.parent().apply_branding()
 
         self.accept()
 
 
 class MaterialsDialog(QDialog):
-    material_updated = Signal()  # Custom signal
-
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("مدیریت مواد اولیه")
@@ -1095,50 +1710,72 @@ class MaterialsDialog(QDialog):
 
         layout.addLayout(form_layout)
 
+        catalog_events.materials_changed.connect(self.update_materials)
+        catalog_events.tables_changed.connect(self.on_tables_changed)
+
     def refresh_materials(self):
         """Refresh the materials table."""
-        search_text = self.search_box.text().strip()
         conn = sqlite3.connect("coffee_shop.db")
-        cursor = conn.cursor()
-        if search_text:
-            cursor.execute("SELECT id, name, price_per_gram FROM materials WHERE name LIKE ?", (f"%{search_text}%",))
-        else:
-            cursor.execute("SELECT id, name, price_per_gram FROM materials")
-        materials = cursor.fetchall()
+        materials = catalog.materials(conn.cursor(), self.search_box.text().strip())
         conn.close()
 
         self.table.setRowCount(len(materials))
         for row, material in enumerate(materials):
-            material_id, name, price = material
-            self.table.setItem(row, 0, QTableWidgetItem(name))
-            self.table.setItem(row, 1, QTableWidgetItem(str(int(price))))  # Convert to integer
+            self.set_material_row(row, material)
 
-            # Add edit button
-            edit_button = QPushButton("ویرایش")
-            edit_button.setStyleSheet("""
-                QPushButton {
-                    background-color: #2196F3;
-                    color: white;
-                    border-radius: 5px;
-                    padding: 5px;
-                }
-                QPushButton:hover {
-                    background-color: #1976D2;
-                }
-            """)
-            edit_button.clicked.connect(lambda checked, r=row, n=name, p=price: self.edit_material(r, n, p))
-            self.table.setCellWidget(row, 2, edit_button)
+    def on_tables_changed(self, tables):
+        if "materials" in tables:
+            self.refresh_materials()
+
+    def update_materials(self, material_ids):
+        """Refresh only the rows of these materials."""
+        conn = sqlite3.connect("coffee_shop.db")
+        materials = {material[0]: material
+                     for material in catalog.materials(conn.cursor(), self.search_box.text().strip(), material_ids)}
+        conn.close()
+        update_table_rows(self.table, {material_id: materials.get(material_id) for material_id in material_ids},
+                          self.set_material_row)
+
+    def set_material_row(self, row, material):
+        material_id, name, price = material
+        name_item = QTableWidgetItem(name)
+        name_item.setData(Qt.UserRole, material_id)
+        self.table.setItem(row, 0, name_item)
+        self.table.setItem(row, 1, QTableWidgetItem(str(int(price))))  # Convert to integer
+
+        # Add edit button
+        edit_button = QPushButton("ویرایش")
+        edit_button.setStyleSheet("""
+            QPushButton {
+                background-color: #2196F3;
+                color: white;
+                border-radius: 5px;
+                padding: 5px;
+            }
+            QPushButton:hover {
+                background-color: #1976D2;
+            }
+        """)
+        edit_button.clicked.connect(lambda checked, m=material_id: self.edit_material(m))
+        self.table.setCellWidget(row, 2, edit_button)
 
-            # Add delete button
-            delete_button = QPushButton("حذف")
-            delete_button.setStyleSheet("background-color: #ff4444; color: white; border-radius: 5px; padding: 5px;")
-            delete_button.clicked.connect(lambda _, r=row: self.delete_material(r))
-            self.table.setCellWidget(row, 3, delete_button)
+        # Add delete button
+        delete_button = QPushButton("حذف")
+        delete_button.setStyleSheet("background-color: #ff4444; color: white; border-radius: 5px; padding: 5px;")
+        delete_button.clicked.connect(lambda _, m=material_id: self.delete_material(m))
+        self.table.setCellWidget(row, 3, delete_button)
 
-    def edit_material(self, row, name, price):
+    def edit_material(self, material_id):
         """Open dialog to edit a material."""
+        conn = sqlite3.connect("coffee_shop.db")
+        material = catalog.material(conn.cursor(), material_id)
+        conn.close()
+        if material is None:
+            self.update_materials([material_id])
+            return
+        name, price, version = material
         dialog = EditMaterialDialog(self, name, price)
-        if dialog.exec() == QDialog.Accepted:
+        if exec_and_delete(dialog) == QDialog.Accepted:
             new_name, new_price = dialog.get_values()
             
             if not new_name or not new_price:
@@ -1151,21 +1788,25 @@ class MaterialsDialog(QDialog):
                 QMessageBox.warning(self, "خطا", "قیمت باید عدد باشد.")
                 return
 
-            conn = sqlite3.connect("coffee_shop.db")
+            conn = db_watch.connect()
             cursor = conn.cursor()
             
             try:
-                # Get the material ID
-                cursor.execute("SELECT id FROM materials WHERE name = ?", (name,))
-                material_id = cursor.fetchone()[0]
-                
-                # Update the material
-                cursor.execute("UPDATE materials SET name = ?, price_per_gram = ? WHERE id = ?",
-                             (new_name, new_price, material_id))
-                
+                # Update the material unless someone else changed it since the dialog opened
+                while not catalog.update_material(cursor, material_id, new_name, new_price, version):
+                    # Nothing is locked while the question is up
+                    conn.rollback()
+                    version = catalog.row_version(cursor, "materials", material_id)
+                    if version is None:
+                        QMessageBox.warning(self, "خطا", "این ماده اولیه در این فاصله حذف شده است.")
+                        self.update_materials([material_id])
+                        return
+                    if not confirm_overwrite(self, f"ماده اولیه «{name}»"):
+                        self.update_materials([material_id])
+                        return
+
                 conn.commit()
-                self.refresh_materials()
-                self.material_updated.emit()  # Emit signal to update other parts
+                catalog_events.materials_changed.emit([material_id])
                 QMessageBox.information(self, "موفقیت", "ماده اولیه با موفقیت به‌روز شد.")
                 
             except sqlite3.IntegrityError:
@@ -1188,39 +1829,35 @@ class MaterialsDialog(QDialog):
             QMessageBox.warning(self, "خطا", "قیمت باید عدد باشد.")
             return
 
-        conn = sqlite3.connect("coffee_shop.db")
+        conn = db_watch.connect()
         cursor = conn.cursor()
         try:
-            cursor.execute("INSERT INTO materials (name, price_per_gram) VALUES (?, ?)", (name, price))
+            material_id = catalog.add_material(cursor, name, price)
             conn.commit()
+            catalog_events.materials_changed.emit([material_id])
         except sqlite3.IntegrityError:
             QMessageBox.warning(self, "خطا", "این ماده قبلاً ثبت شده است.")
         finally:
             conn.close()
 
-        self.refresh_materials()
         self.name_input.clear()
         self.price_input.clear()
-        self.material_updated.emit()  # Emit signal
 
-    def delete_material(self, row):
+    def delete_material(self, material_id):
         """Delete a material from the database."""
-        material_name = self.table.item(row, 0).text()
-        
         # Check if material is used in any recipes
         conn = sqlite3.connect("coffee_shop.db")
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT r.name 
-            FROM recipes r 
-            JOIN recipe_details rd ON r.id = rd.recipe_id 
-            JOIN materials m ON rd.material_id = m.id 
-            WHERE m.name = ?
-        """, (material_name,))
-        used_in_recipes = cursor.fetchall()
+        material = catalog.material(cursor, material_id)
+        used_in_recipes = catalog.recipes_with_material(cursor, material_id)
+        conn.close()
+        if material is None:
+            self.update_materials([material_id])
+            return
+        material_name = material[0]
         
         if used_in_recipes:
-            recipe_names = "\n".join([recipe[0] for recipe in used_in_recipes])
+            recipe_names = "\n".join(used_in_recipes)
             QMessageBox.warning(
                 self, 
                 "هشدار", 
@@ -1234,11 +1871,11 @@ class MaterialsDialog(QDialog):
         )
         
         if confirm == QMessageBox.Yes:
+            conn = db_watch.connect()
             try:
-                cursor.execute("DELETE FROM materials WHERE name = ?", (material_name,))
+                catalog.delete_material(conn.cursor(), material_id)
                 conn.commit()
-                self.refresh_materials()
-                self.material_updated.emit()  # Emit signal
+                catalog_events.materials_changed.emit([material_id])
                 QMessageBox.information(self, "موفقیت", "ماده اولیه با موفقیت حذف شد.")
             except Exception as e:
                 QMessageBox.critical(self, "خطا", f"خطا در حذف ماده اولیه:\n{str(e)}")
@@ -1355,6 +1992,9 @@ class RecipesDialog(QDialog):
         """)
         self.refresh_recipes()
         layout.addWidget(self.table)
+        catalog_events.recipes_changed.connect(self.update_recipes)
+        catalog_events.materials_changed.connect(self.on_materials_changed)
+        catalog_events.tables_changed.connect(self.on_tables_changed)
 
         # Buttons
         button_layout = QHBoxLayout()
@@ -1375,74 +2015,96 @@ class RecipesDialog(QDialog):
 
         layout.addLayout(button_layout)
 
+    def query_recipes(self, cursor, recipe_ids=None):
+        """(id, name, material_count, price_factor, [(material, grams)]) of the recipes matching the search box, or of only these."""
+        search_text = self.search_box.text().strip()
+        query = """
+            SELECT r.id, r.name, COUNT(rd.material_id), r.price_factor
+            FROM recipes r
+            LEFT JOIN recipe_details rd ON r.id = rd.recipe_id
+            WHERE r.name LIKE ?
+        """
+        params = [f"%{search_text}%"]
+        if recipe_ids is not None:
+            query += f" AND r.id IN ({','.join('?' * len(recipe_ids))})"
+            params += recipe_ids
+        recipes = cursor.execute(query + " GROUP BY r.id", params).fetchall()
+
+        # All ingredients in one query rather than one per recipe
+        ingredients = {}
+        placeholders = ",".join("?" * len(recipes))
+        for recipe_id, name, quantity in cursor.execute(f"""
+            SELECT rd.recipe_id, m.name, rd.quantity
+            FROM recipe_details rd
+            JOIN materials m ON rd.material_id = m.id
+            WHERE rd.recipe_id IN ({placeholders})
+            ORDER BY m.name
+        """, [recipe[0] for recipe in recipes]):
+            ingredients.setdefault(recipe_id, []).append((name, quantity))
+        return [(*recipe, ingredients.get(recipe[0], [])) for recipe in recipes]
+
     def refresh_recipes(self):
         """Fetch recipes and display them in the table."""
-        search_text = self.search_box.text().strip()
         conn = sqlite3.connect("coffee_shop.db")
-        cursor = conn.cursor()
-        if search_text:
-            cursor.execute("""
-                SELECT r.id, r.name, COUNT(rd.material_id), r.price_factor
-                FROM recipes r
-                LEFT JOIN recipe_details rd ON r.id = rd.recipe_id
-                WHERE r.name LIKE ?
-                GROUP BY r.id
-            """, (f"%{search_text}%",))
-        else:
-            cursor.execute("""
-                SELECT r.id, r.name, COUNT(rd.material_id), r.price_factor
-                FROM recipes r
-                LEFT JOIN recipe_details rd ON r.id = rd.recipe_id
-                GROUP BY r.id
-            """)
-        recipes = cursor.fetchall()
+        recipes = self.query_recipes(conn.cursor())
+        conn.close()
 
         self.table.setRowCount(len(recipes))
-        for row, (recipe_id, name, material_count, price_factor) in enumerate(recipes):
-            self.table.setItem(row, 0, QTableWidgetItem(name))
-            self.table.setItem(row, 1, QTableWidgetItem(str(material_count)))
-
-            # Get recipe ingredients with quantities
-            cursor.execute("""
-                SELECT m.name, rd.quantity
-                FROM recipe_details rd
-                JOIN materials m ON rd.material_id = m.id
-                WHERE rd.recipe_id = ?
-                ORDER BY m.name
-            """, (recipe_id,))
-            ingredients = cursor.fetchall()
-            
-            # Format ingredients list
-            ingredients_text = "\n".join([f"• {name}: {quantity} گرم" for name, quantity in ingredients])
-            
-            # Create a multi-line item for ingredients
-            ingredients_item = QTableWidgetItem(ingredients_text)
-            ingredients_item.setTextAlignment(Qt.AlignTop | Qt.AlignRight)
-            self.table.setItem(row, 2, ingredients_item)
-            
-            # Add price factor
-            price_factor_item = QTableWidgetItem(str(price_factor if price_factor is not None else 3.3))
-            price_factor_item.setTextAlignment(Qt.AlignCenter)
-            self.table.setItem(row, 3, price_factor_item)
-            
-            # Adjust row height based on number of ingredients
-            if ingredients:
-                num_lines = len(ingredients)
-                self.table.setRowHeight(row, max(30, num_lines * 25))
+        for row, recipe in enumerate(recipes):
+            self.set_recipe_row(row, recipe)
 
         # Adjust column widths
         self.table.resizeColumnsToContents()
         
         # Make ingredients column wider
         self.table.setColumnWidth(2, 400)
-        
+
+    def on_tables_changed(self, tables):
+        if changes_catalog(tables):
+            self.refresh_recipes()
+
+    def update_recipes(self, recipe_ids):
+        """Refresh only the rows of these recipes."""
+        conn = sqlite3.connect("coffee_shop.db")
+        recipes = {recipe[0]: recipe for recipe in self.query_recipes(conn.cursor(), recipe_ids)}
+        conn.close()
+        update_table_rows(self.table, {recipe_id: recipes.get(recipe_id) for recipe_id in recipe_ids},
+                          self.set_recipe_row)
+
+    def on_materials_changed(self, material_ids):
+        """A renamed material changes the ingredient lists of the recipes using it."""
+        conn = sqlite3.connect("coffee_shop.db")
+        recipe_ids = catalog.recipes_using(conn.cursor(), material_ids)
         conn.close()
+        if recipe_ids:
+            self.update_recipes(recipe_ids)
+
+    def set_recipe_row(self, row, recipe):
+        recipe_id, name, material_count, price_factor, ingredients = recipe
+        name_item = QTableWidgetItem(name)
+        name_item.setData(Qt.UserRole, recipe_id)
+        self.table.setItem(row, 0, name_item)
+        self.table.setItem(row, 1, QTableWidgetItem(str(material_count)))
+
+        # Format ingredients list
+        ingredients_text = "\n".join([f"• {name}: {quantity} گرم" for name, quantity in ingredients])
+
+        # Create a multi-line item for ingredients
+        ingredients_item = QTableWidgetItem(ingredients_text)
+        ingredients_item.setTextAlignment(Qt.AlignTop | Qt.AlignRight)
+        self.table.setItem(row, 2, ingredients_item)
+
+        # Add price factor
+        price_factor_item = QTableWidgetItem(str(price_factor if price_factor is not None else 3.3))
+        price_factor_item.setTextAlignment(Qt.AlignCenter)
+        self.table.setItem(row, 3, price_factor_item)
+
+        # Adjust row height based on number of ingredients
+        self.table.setRowHeight(row, max(30, len(ingredients) * 25))
 
     def add_recipe(self):
         """Open a dialog to add a new recipe."""
-        dialog = RecipeEditDialog(self)
-        dialog.exec()
-        self.refresh_recipes()
+        exec_and_delete(RecipeEditDialog(self))
 
     def edit_recipe(self):
         """Open a dialog to edit the selected recipe."""
@@ -1451,10 +2113,8 @@ class RecipesDialog(QDialog):
             QMessageBox.warning(self, "خطا", "لطفاً یک رسپی را انتخاب کنید.")
             return
 
-        recipe_name = self.table.item(selected_row, 0).text()
-        dialog = RecipeEditDialog(self, recipe_name)
-        dialog.exec()
-        self.refresh_recipes()
+        recipe_id = self.table.item(selected_row, 0).data(Qt.UserRole)
+        exec_and_delete(RecipeEditDialog(self, recipe_id))
 
     def delete_recipe(self):
         """Delete the selected recipe."""
@@ -1464,26 +2124,26 @@ class RecipesDialog(QDialog):
             return
 
         recipe_name = self.table.item(selected_row, 0).text()
+        recipe_id = self.table.item(selected_row, 0).data(Qt.UserRole)
         confirm = QMessageBox.question(
             self, "حذف رسپی", f"آیا مطمئن هستید که می‌خواهید رسپی '{recipe_name}' را حذف کنید؟",
             QMessageBox.Yes | QMessageBox.No
         )
         if confirm == QMessageBox.Yes:
-            conn = sqlite3.connect("coffee_shop.db")
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM recipes WHERE name = ?", (recipe_name,))
-            cursor.execute("DELETE FROM recipe_details WHERE recipe_id = (SELECT id FROM recipes WHERE name = ?)",
-                           (recipe_name,))
+            conn = db_watch.connect()
+            catalog.delete_recipe(conn.cursor(), recipe_id)
             conn.commit()
             conn.close()
-            self.refresh_recipes()
+            catalog_events.recipes_changed.emit([recipe_id])
 
 
 class RecipeEditDialog(QDialog):
-    def __init__(self, parent=None, recipe_name=None):
+    def __init__(self, parent=None, recipe_id=None):
         super().__init__(parent)
-        self.recipe_name = recipe_name
-        self.setWindowTitle("ویرایش رسپی" if recipe_name else "اضافه کردن رسپی")
+        self.recipe_id = recipe_id
+        # recipes.version when the recipe was loaded, checked again on save
+        self.version = None
+        self.setWindowTitle("ویرایش رسپی" if recipe_id else "اضافه کردن رسپی")
         self.setStyleSheet(f"background-color: {COLOR_BACKGROUND}; color: {COLOR_TEXT}; font-family: 'Yekan';")
         self.setGeometry(100, 100, 600, 400)
         self.setLayoutDirection(Qt.RightToLeft)  # راست‌چین کردن محتوا
@@ -1493,9 +2153,7 @@ class RecipeEditDialog(QDialog):
         # Recipe name, category and price factor
         form_layout_top = QFormLayout()
         self.name_input = QLineEdit()
-        if recipe_name:
-            self.name_input.setText(recipe_name)
-        
+
         # Add category combo box
         self.category_combo = QComboBox()
         self.category_combo.addItems(self.get_categories())
@@ -1568,57 +2226,39 @@ class RecipeEditDialog(QDialog):
         save_button.clicked.connect(self.save_recipe)
         layout.addWidget(save_button)
 
-        if recipe_name:
+        if recipe_id:
             self.load_recipe()
 
     def get_categories(self):
         """Get all categories from the database."""
         conn = sqlite3.connect("coffee_shop.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM categories")
-        categories = [row[0] for row in cursor.fetchall()]
+        categories = catalog.categories(conn.cursor())
         conn.close()
         return categories
 
     def get_material_names(self):
         """Get all material names from the database."""
         conn = sqlite3.connect("coffee_shop.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM materials")
-        materials = [row[0] for row in cursor.fetchall()]
+        materials = catalog.material_names(conn.cursor())
         conn.close()
         return materials
 
     def load_recipe(self):
         """Load the selected recipe details."""
         conn = sqlite3.connect("coffee_shop.db")
-        cursor = conn.cursor()
-        
-        # Get recipe category and price factor
-        cursor.execute("""
-            SELECT r.name, r.category_id, c.name, r.price_factor
-            FROM recipes r
-            LEFT JOIN categories c ON r.category_id = c.id
-            WHERE r.name = ?
-        """, (self.recipe_name,))
-        recipe_data = cursor.fetchone()
-        if recipe_data:
-            if recipe_data[2]:  # category name
-                category_index = self.category_combo.findText(recipe_data[2])
+        recipe = catalog.recipe(conn.cursor(), self.recipe_id)
+        conn.close()
+
+        materials = []
+        if recipe:
+            name, category, price_factor, self.version, materials = recipe
+            self.name_input.setText(name)
+            if category:
+                category_index = self.category_combo.findText(category)
                 if category_index >= 0:
                     self.category_combo.setCurrentIndex(category_index)
-            if recipe_data[3]:  # price factor
-                self.price_factor_input.setText(str(recipe_data[3]))
-        
-        # Get recipe materials
-        cursor.execute("""
-            SELECT m.name, rd.quantity
-            FROM recipe_details rd
-            JOIN materials m ON rd.material_id = m.id
-            WHERE rd.recipe_id = (SELECT id FROM recipes WHERE name = ?)
-        """, (self.recipe_name,))
-        materials = cursor.fetchall()
-        conn.close()
+            if price_factor:
+                self.price_factor_input.setText(str(price_factor))
 
         self.table.setRowCount(len(materials))
         for row, (material_name, quantity) in enumerate(materials):
@@ -1717,39 +2357,49 @@ class RecipeEditDialog(QDialog):
                 QMessageBox.warning(self, "خطا", f"مقدار برای '{material_name}' نامعتبر است.")
                 return
 
-        conn = sqlite3.connect("coffee_shop.db")
-        cursor = conn.cursor()
-
-        # Get category ID
-        cursor.execute("SELECT id FROM categories WHERE name = ?", (category_name,))
-        category_id = cursor.fetchone()[0]
-
-        if self.recipe_name:  # Update existing recipe
-            cursor.execute("""
-                UPDATE recipes 
-                SET name = ?, category_id = ?, price_factor = ? 
-                WHERE name = ?
-            """, (recipe_name, category_id, price_factor, self.recipe_name))
-            cursor.execute("DELETE FROM recipe_details WHERE recipe_id = (SELECT id FROM recipes WHERE name = ?)",
-                         (self.recipe_name,))
-        else:  # Insert new recipe
-            cursor.execute("""
-                INSERT INTO recipes (name, category_id, price_factor) 
-                VALUES (?, ?, ?)
-            """, (recipe_name, category_id, price_factor))
-            
-        recipe_id = cursor.execute("SELECT id FROM recipes WHERE name = ?", (recipe_name,)).fetchone()[0]
-
+        # Resolve IDs before touching the database
+        category_id = catalog_ids.get("categories", category_name)
+        if category_id is None:
+            QMessageBox.warning(self, "خطا", f"دسته‌بندی '{category_name}' یافت نشد.")
+            return
+        material_ids = []
         for material_name, quantity in materials:
-            material_id = cursor.execute("SELECT id FROM materials WHERE name = ?", (material_name,)).fetchone()[0]
-            cursor.execute("INSERT INTO recipe_details (recipe_id, material_id, quantity) VALUES (?, ?, ?)",
-                         (recipe_id, material_id, quantity))
+            material_id = catalog_ids.get("materials", material_name)
+            if material_id is None:
+                QMessageBox.warning(self, "خطا", f"ماده اولیه '{material_name}' یافت نشد.")
+                return
+            material_ids.append((material_id, quantity))
 
+        conn = db_watch.connect()
+        # An existing recipe is updated only if nobody else changed it since it was loaded
+        recipe_id = catalog.save_recipe(conn.cursor(), self.recipe_id, recipe_name, category_id, price_factor,
+                                        material_ids, self.version)
+        if recipe_id is None:
+            conn.rollback()
+            conn.close()
+            self.resolve_conflict()
+            return
         conn.commit()
         conn.close()
+        catalog_events.recipes_changed.emit([recipe_id])
         QMessageBox.information(self, "موفقیت", "رسپی با موفقیت ذخیره شد.")
         self.accept()
 
+    def resolve_conflict(self):
+        """Save over a recipe changed elsewhere since it was loaded, or show the other version instead."""
+        conn = sqlite3.connect("coffee_shop.db")
+        current = catalog.row_version(conn.cursor(), "recipes", self.recipe_id)
+        conn.close()
+        if current is None:
+            QMessageBox.warning(self, "خطا", "این رسپی در این فاصله حذف شده است.")
+            catalog_events.recipes_changed.emit([self.recipe_id])
+            self.reject()
+        elif confirm_overwrite(self, f"رسپی «{self.name_input.text()}»"):
+            self.version = current
+            self.save_recipe()
+        else:
+            self.load_recipe()
+
 
 class PricesDialog(QDialog):
     def __init__(self, parent=None):
@@ -1791,6 +2441,10 @@ class PricesDialog(QDialog):
         """)
         self.refresh_prices()
         layout.addWidget(self.table)
+        catalog_events.materials_changed.connect(self.on_materials_changed)
+        catalog_events.recipes_changed.connect(self.update_prices)
+        catalog_events.categories_changed.connect(self.on_categories_changed)
+        catalog_events.tables_changed.connect(self.on_tables_changed)
 
         # Export button
         export_button = QPushButton("ذخیره به PNG")
@@ -1801,50 +2455,61 @@ class PricesDialog(QDialog):
     def calculate_prices(self):
         """Calculate prices for each recipe."""
         conn = sqlite3.connect("coffee_shop.db")
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT r.name, 
-                   c.name as category_name,
-                   SUM(rd.quantity * m.price_per_gram) AS raw_price,
-                   r.price_factor
-            FROM recipes r
-            LEFT JOIN categories c ON r.category_id = c.id
-            JOIN recipe_details rd ON r.id = rd.recipe_id
-            JOIN materials m ON rd.material_id = m.id
-            GROUP BY r.id
-        """)
-        data = cursor.fetchall()
+        prices = catalog.price_list(conn.cursor())
         conn.close()
+        return prices
 
-        prices = []
-        for name, category, raw_price, price_factor in data:
-            if raw_price is None:
-                continue
-            raw_price = round(raw_price)
-            # Use recipe-specific price factor, fallback to 3.3 if not set
-            factor = price_factor if price_factor is not None else 3.3
-            secondary_price = round(raw_price * factor)
-            price_with_tax = round(secondary_price * 1.1)
-            final_price = math.ceil(price_with_tax)
-            prices.append((name, category or "بدون دسته‌بندی", raw_price, secondary_price, final_price, factor))
+    def query_prices(self, recipe_ids=None):
+        """catalog.recipe_prices rows matching the search box, of every recipe or of only these."""
+        conn = sqlite3.connect("coffee_shop.db")
+        prices = catalog.recipe_prices(conn.cursor(), recipe_ids)
+        conn.close()
+        search_text = self.search_box.text().strip().lower()
+        if search_text:
+            prices = [item for item in prices if search_text in item[1].lower() or search_text in item[2].lower()]
         return prices
 
     def refresh_prices(self):
         """Fetch menu items and display them in the table."""
-        search_text = self.search_box.text().strip()
-        prices = self.calculate_prices()
-        if search_text:
-            prices = [item for item in prices if search_text.lower() in item[0].lower() or 
-                     (item[1] and search_text.lower() in item[1].lower())]
-        
+        prices = self.query_prices()
         self.table.setRowCount(len(prices))
-        for row, (name, category, raw_price, secondary_price, final_price, factor) in enumerate(prices):
-            self.table.setItem(row, 0, QTableWidgetItem(name))
-            self.table.setItem(row, 1, QTableWidgetItem(category))
-            self.table.setItem(row, 2, QTableWidgetItem(f"{raw_price} تومان"))
-            self.table.setItem(row, 3, QTableWidgetItem(f"{secondary_price} تومان"))
-            self.table.setItem(row, 4, QTableWidgetItem(f"{final_price} تومان"))
-            self.table.setItem(row, 5, QTableWidgetItem(str(factor)))
+        for row, item in enumerate(prices):
+            self.set_price_row(row, item)
+
+    def on_tables_changed(self, tables):
+        if changes_catalog(tables):
+            self.refresh_prices()
+
+    def update_prices(self, recipe_ids):
+        """Reprice only the rows of these recipes."""
+        prices = {item[0]: item for item in self.query_prices(recipe_ids)}
+        update_table_rows(self.table, {recipe_id: prices.get(recipe_id) for recipe_id in recipe_ids},
+                          self.set_price_row)
+
+    def on_materials_changed(self, material_ids):
+        conn = sqlite3.connect("coffee_shop.db")
+        recipe_ids = catalog.recipes_using(conn.cursor(), material_ids)
+        conn.close()
+        if recipe_ids:
+            self.update_prices(recipe_ids)
+
+    def on_categories_changed(self, category_ids):
+        conn = sqlite3.connect("coffee_shop.db")
+        recipe_ids = catalog.recipes_in_categories(conn.cursor(), category_ids)
+        conn.close()
+        if recipe_ids:
+            self.update_prices(recipe_ids)
+
+    def set_price_row(self, row, item):
+        recipe_id, name, category, raw_price, secondary_price, final_price, factor = item
+        name_item = QTableWidgetItem(name)
+        name_item.setData(Qt.UserRole, recipe_id)
+        self.table.setItem(row, 0, name_item)
+        self.table.setItem(row, 1, QTableWidgetItem(category))
+        self.table.setItem(row, 2, QTableWidgetItem(f"{raw_price} تومان"))
+        self.table.setItem(row, 3, QTableWidgetItem(f"{secondary_price} تومان"))
+        self.table.setItem(row, 4, QTableWidgetItem(f"{final_price} تومان"))
+        self.table.setItem(row, 5, QTableWidgetItem(str(factor)))
 
     def export_to_image(self):
         """Export the menu as a PNG image."""
@@ -2006,27 +2671,31 @@ class OrderDialog(QDialog):
         self.lbl_receipt = QLabel(f"شماره فیش: {self.receipt_number}")
         self.lbl_receipt.setStyleSheet("font-weight: bold; color: #fcd40d;")
         top_info_layout.addWidget(self.lbl_receipt)
+
+        # شماره میز و فیش باز
+        table_label = QLabel("میز:")
+        table_label.setStyleSheet("font-weight: bold; color: #fcd40d;")
+        top_info_layout.addWidget(table_label)
+        self.table_spin = QSpinBox()
+        self.table_spin.setRange(0, 99)
+        self.table_spin.setSpecialValueText("-")
+        self.table_spin.setStyleSheet("background-color: #3E3E3E; color: white; padding: 5px; border-radius: 5px;")
+        top_info_layout.addWidget(self.table_spin)
+
+        self.open_ticket = None
+        self.ticket_total = 0
+        self.lbl_ticket = QLabel()
+        self.lbl_ticket.setStyleSheet("font-weight: bold; color: #4CAF50;")
+        top_info_layout.addWidget(self.lbl_ticket)
         
         main_layout.addLayout(top_info_layout)
 
         # Category buttons in two horizontal rows
-        categories = self.get_categories()
-        num_categories = len(categories)
-        num_per_row = (num_categories + 1) // 2  # Split categories into two rows
-        
-        # First row of categories
-        first_row = QHBoxLayout()
-        for i in range(num_per_row):
-            btn = self.create_category_button(categories[i])
-            first_row.addWidget(btn)
-        main_layout.addLayout(first_row)
-        
-        # Second row of categories
-        second_row = QHBoxLayout()
-        for i in range(num_per_row, num_categories):
-            btn = self.create_category_button(categories[i])
-            second_row.addWidget(btn)
-        main_layout.addLayout(second_row)
+        self.first_row = QHBoxLayout()
+        main_layout.addLayout(self.first_row)
+        self.second_row = QHBoxLayout()
+        main_layout.addLayout(self.second_row)
+        self.build_category_buttons()
 
         # Split the main content into two columns
         content_layout = QHBoxLayout()
@@ -2034,29 +2703,49 @@ class OrderDialog(QDialog):
         # Right column (Recipe list)
         right_column = QVBoxLayout()
         right_column.addWidget(QLabel("منو:"))
-        self.recipes_list = QListWidget()
-        self.recipes_list.setMaximumWidth(300)
+        # The whole priced menu lives in one model; categories are a filter on top of it
+        self.recipes_model = QStandardItemModel(self)
+        self.recipes_proxy = QSortFilterProxyModel(self)
+        self.recipes_proxy.setSourceModel(self.recipes_model)
+        self.recipes_proxy.setFilterRole(MENU_CATEGORY_ROLE)
+        self.recipes_list = QListView()
+        self.recipes_list.setModel(self.recipes_proxy)
+        self.recipes_list.setUniformItemSizes(True)
+        self.recipes_list.setEditTriggers(QListView.NoEditTriggers)
+        # Photo tiles; thumbnails are requested only for tiles being painted
+        self.recipes_list.setViewMode(QListView.IconMode)
+        self.recipes_list.setMovement(QListView.Static)
+        self.recipes_list.setResizeMode(QListView.Adjust)
+        self.recipes_list.setGridSize(RecipeTileDelegate.TILE_SIZE)
+        self.recipes_list.setItemDelegate(RecipeTileDelegate(self.recipes_list))
+        recipe_thumbnails.ready.connect(self.on_thumbnail_ready)
+        self.recipes_list.setMaximumWidth(430)
         self.recipes_list.setLayoutDirection(Qt.RightToLeft)  # Set layout direction to RTL
         self.recipes_list.setStyleSheet("""
-            QListWidget {
+            QListView {
                 background-color: #3E3E3E;
                 color: white;
                 border-radius: 10px;
                 padding: 5px;
                 text-align: right;  /* Right align text */
             }
-            QListWidget::item {
+            QListView::item {
                 padding: 5px;
                 border-radius: 5px;
                 text-align: right;  /* Right align items */
             }
-            QListWidget::item:selected {
+            QListView::item:selected {
                 background-color: #4a4a4a;
                 color: #fcd40d;
             }
         """)
-        self.recipes_list.itemClicked.connect(self.show_recipe_details)
+        self.recipes_list.clicked.connect(self.show_recipe_details)
         right_column.addWidget(self.recipes_list)
+        self.load_menu()
+        catalog_events.materials_changed.connect(self.on_materials_changed)
+        catalog_events.recipes_changed.connect(self.update_menu)
+        catalog_events.categories_changed.connect(self.on_categories_changed)
+        catalog_events.tables_changed.connect(self.on_tables_changed)
 
         # Left column (Order details)
         left_column = QVBoxLayout()
@@ -2236,7 +2925,43 @@ class OrderDialog(QDialog):
         """)
         cancel_btn.clicked.connect(self.reject)
         
+        # Hold button (نگه‌داشتن سفارش روی میز)
+        hold_btn = QPushButton("نگه‌داشتن سفارش")
+        hold_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #FF9800;
+                color: white;
+                border-radius: 5px;
+                padding: 10px 20px;
+                font-weight: bold;
+                min-width: 120px;
+            }
+            QPushButton:hover {
+                background-color: #F57C00;
+            }
+        """)
+        hold_btn.clicked.connect(self.hold_order)
+
+        # Open tickets button (سفارش‌های باز)
+        tickets_btn = QPushButton("سفارش‌های باز")
+        tickets_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #8E44AD;
+                color: white;
+                border-radius: 5px;
+                padding: 10px 20px;
+                font-weight: bold;
+                min-width: 120px;
+            }
+            QPushButton:hover {
+                background-color: #9B59B6;
+            }
+        """)
+        tickets_btn.clicked.connect(self.choose_open_ticket)
+        
         btn_layout.addWidget(save_btn)
+        btn_layout.addWidget(hold_btn)
+        btn_layout.addWidget(tickets_btn)
         btn_layout.addWidget(print_btn)
         btn_layout.addWidget(cancel_btn)
         main_layout.addLayout(btn_layout)
@@ -2244,7 +2969,18 @@ class OrderDialog(QDialog):
         # Load initial data
         if self.category_buttons:
             self.category_buttons[0].setChecked(True)
-            self.on_category_clicked('همه')
+            self.on_category_clicked(ALL_CATEGORIES)
+
+    def build_category_buttons(self):
+        """(Re)create the category buttons, split over the two rows"""
+        for btn in self.category_buttons:
+            btn.deleteLater()
+        self.category_buttons = []
+        categories = self.get_categories()
+        num_per_row = (len(categories) + 1) // 2  # Split categories into two rows
+        for i, category in enumerate(categories):
+            row = self.first_row if i < num_per_row else self.second_row
+            row.addWidget(self.create_category_button(category))
 
     def create_category_button(self, category):
         """Create a styled category button with rotating neon border animation"""
@@ -2411,67 +3147,133 @@ class OrderDialog(QDialog):
         self.lbl_date.setText(f"تاریخ و زمان: {formatted_date}")
         self.lbl_date.setStyleSheet("font-weight: bold; color: #fcd40d;")
 
+    def cart_lines(self):
+        """Return the lines in the cart as order-record lines."""
+        return [
+            {
+                "recipe_id": self.order_details.item(row, 0).data(Qt.UserRole),
+                "name": self.order_details.item(row, 0).text(),
+                "quantity": int(self.order_details.item(row, 2).text()),
+                "unit_price": int(self.order_details.item(row, 1).text().replace(',', '')),
+            }
+            for row in range(self.order_details.rowCount())
+        ]
+
     def save_order(self):
+        """Save and settle the cart, or settle the open ticket with any new lines"""
+        lines = self.cart_lines()
+        if not lines and not self.open_ticket:
+            QMessageBox.warning(self, "هشدار", "هیچ آیتمی در سفارش وجود ندارد.")
+            return
+
         try:
-            conn = sqlite3.connect("coffee_shop.db")
-            cursor = conn.cursor()
-            
-            # Get current Jalali date and time
-            now = datetime.now()
-            jalali_datetime = jdatetime.datetime.fromgregorian(datetime=now)
-            jalali_date = jalali_datetime.strftime("%Y/%m/%d")
-            jalali_time = jalali_datetime.strftime("%H:%M:%S")
-            
-            # Calculate total
-            total = sum(
-                int(self.order_details.item(row, 3).text().replace(',', ''))
-                for row in range(self.order_details.rowCount())
-            )
-            
-            # Save order details
-            cursor.execute("""
-                INSERT INTO orders 
-                (receipt_number, order_date, jalali_date, jalali_time, total_amount) 
-                VALUES (?, ?, ?, ?, ?)
-            """, (self.receipt_number, now.strftime("%Y-%m-%d %H:%M:%S"), 
-                  jalali_date, jalali_time, total))
-            
-            order_id = cursor.lastrowid
-            
-            # Save order items
-            for row in range(self.order_details.rowCount()):
-                item_name = self.order_details.item(row, 0).text()
-                quantity = int(self.order_details.item(row, 2).text())
-                unit_price = int(self.order_details.item(row, 1).text().replace(',', ''))
-                
-                cursor.execute("SELECT id FROM recipes WHERE name = ?", (item_name,))
-                recipe_id = cursor.fetchone()[0]
-                
-                cursor.execute("""
-                    INSERT INTO order_items 
-                    (order_id, recipe_id, quantity, unit_price, total_price) 
-                    VALUES (?, ?, ?, ?, ?)
-                """, (order_id, recipe_id, quantity, unit_price, unit_price * quantity))
-            
-            conn.commit()
+            low_stock = []
+            if self.open_ticket:
+                # New lines and the payment go in one record, so a failure leaves neither half written
+                if lines:
+                    record = {"type": "append", "receipt_number": self.open_ticket, "lines": lines,
+                              "payment_status": "paid"}
+                else:
+                    record = {"type": "status", "receipt_number": self.open_ticket, "payment_status": "paid"}
+                result = submit_order_record(record)
+                if not result["ok"]:
+                    raise ValueError(result["error"])
+                low_stock = result.get("low_stock")
+                now = jdatetime.datetime.now()
+                result.update({
+                    "jalali_date": now.strftime("%Y/%m/%d"),
+                    "jalali_time": now.strftime("%H:%M:%S"),
+                    "total": self.ticket_total + sum(line["unit_price"] * line["quantity"] for line in lines),
+                })
+            else:
+                result = submit_order_record({
+                    "receipt_number": self.receipt_number,
+                    "table_number": self.table_spin.value(),
+                    "payment_status": "paid",
+                    "lines": lines,
+                })
+                if not result["ok"]:
+                    raise ValueError(result["error"])
+                low_stock = result.get("low_stock")
+
+            self.receipt_number = result["receipt_number"]
+            self.lbl_receipt.setText(f"شماره فیش: {self.receipt_number}")
+            if result.get("order_id"):
+                catalog_events.orders_saved.emit([result["order_id"]])
             
             # Show success message with receipt details
             receipt_details = f"""
             سفارش با موفقیت ثبت شد!
             
             شماره فیش: {self.receipt_number}
-            تاریخ: {jalali_date}
-            ساعت: {jalali_time}
+            تاریخ: {result["jalali_date"]}
+            ساعت: {result["jalali_time"]}
             تعداد آیتم‌ها: {self.order_details.rowCount()}
-            مبلغ کل: {total:,} تومان
+            مبلغ کل: {result["total"]:,} تومان
             """
             QMessageBox.information(self, "موفقیت", receipt_details)
+            self.warn_low_stock(low_stock)
             self.accept()
             
         except Exception as e:
             QMessageBox.critical(self, "خطا", f"خطا در ثبت سفارش:\n{str(e)}")
-        finally:
-            conn.close()
+
+    def hold_order(self):
+        """Keep the cart as an open ticket for the table, to be settled later"""
+        lines = self.cart_lines()
+        if not lines:
+            QMessageBox.warning(self, "هشدار", "هیچ آیتمی در سفارش وجود ندارد.")
+            return
+
+        try:
+            if self.open_ticket:
+                record = {"type": "append", "receipt_number": self.open_ticket, "lines": lines}
+            else:
+                record = {
+                    "receipt_number": self.receipt_number,
+                    "table_number": self.table_spin.value(),
+                    "payment_status": "pending",
+                    "lines": lines,
+                }
+            result = submit_order_record(record)
+            if not result["ok"]:
+                raise ValueError(result["error"])
+            if result.get("order_id"):
+                catalog_events.orders_saved.emit([result["order_id"]])
+
+            table = self.table_spin.value()
+            QMessageBox.information(
+                self, "موفقیت",
+                f"سفارش {result['receipt_number']} برای میز {table or '-'} نگه داشته شد.\n"
+                f"مبلغ تا این لحظه: {result['total']:,} تومان"
+            )
+            self.warn_low_stock(result.get("low_stock"))
+            self.accept()
+        except Exception as e:
+            QMessageBox.critical(self, "خطا", f"خطا در نگه‌داشتن سفارش:\n{str(e)}")
+
+    def warn_low_stock(self, low_stock):
+        """Warn about materials this order took to or below their reorder level"""
+        if low_stock:
+            QMessageBox.warning(
+                self, "کمبود موجودی",
+                "موجودی این مواد به حد سفارش رسیده است:\n" + "\n".join(
+                    f"{name}: {quantity:,.0f} گرم (حد سفارش {level:,.0f})" for name, quantity, level in low_stock)
+            )
+
+    def choose_open_ticket(self):
+        """Pick an open ticket to add items to or settle"""
+        dialog = OpenTicketsDialog(self)
+        if exec_and_delete(dialog) == QDialog.Accepted and dialog.selected_ticket:
+            receipt_number, table_number, total = dialog.selected_ticket
+            self.open_ticket = receipt_number
+            self.ticket_total = total
+            self.receipt_number = receipt_number
+            self.lbl_receipt.setText(f"شماره فیش: {receipt_number}")
+            self.table_spin.setValue(table_number or 0)
+            self.table_spin.setEnabled(False)
+            self.lbl_ticket.setText(f"فیش باز - مبلغ قبلی: {total:,} تومان")
+            self.update_total()
 
     def on_category_clicked(self, category):
         """Handle category button clicks"""
@@ -2484,57 +3286,96 @@ class OrderDialog(QDialog):
         
         self.load_recipes(category)
 
-    def load_recipes(self, category=None):
-        """Load recipes based on selected category"""
+    def load_menu(self):
+        """Fill the menu model from the shared priced-menu cache"""
+        recipe_thumbnails.scan()
+        self.recipes_model.clear()
+        for menu_item in menu_cache.items():
+            item = QStandardItem()
+            self.set_menu_item(item, menu_item)
+            self.recipes_model.appendRow(item)
+
+    def set_menu_item(self, item, menu_item):
+        recipe_id, name, category, final_price = menu_item
+        item.setText(name)
+        item.setData(final_price, MENU_PRICE_ROLE)
+        item.setData(category or "", MENU_CATEGORY_ROLE)
+        item.setData(recipe_id, MENU_RECIPE_ID_ROLE)
+
+    def update_menu(self, recipe_ids):
+        """Update only the tiles of these recipes from the shared menu cache"""
+        wanted = set(recipe_ids)
+        changed = {menu_item[0]: menu_item for menu_item in menu_cache.items() if menu_item[0] in wanted}
+        for row in reversed(range(self.recipes_model.rowCount())):
+            item = self.recipes_model.item(row)
+            if item.data(MENU_RECIPE_ID_ROLE) not in wanted:
+                continue
+            menu_item = changed.pop(item.data(MENU_RECIPE_ID_ROLE), None)
+            if menu_item is None:
+                self.recipes_model.removeRow(row)
+            else:
+                self.set_menu_item(item, menu_item)
+        # New recipes go to their place in name order
+        names = [self.recipes_model.item(row).text() for row in range(self.recipes_model.rowCount())]
+        for menu_item in changed.values():
+            item = QStandardItem()
+            self.set_menu_item(item, menu_item)
+            row = bisect.bisect(names, menu_item[1])
+            names.insert(row, menu_item[1])
+            self.recipes_model.insertRow(row, item)
+
+    def on_materials_changed(self, material_ids):
         conn = sqlite3.connect("coffee_shop.db")
-        cursor = conn.cursor()
-        
-        if category == 'همه':
-            query = """
-                SELECT r.name, SUM(rd.quantity * m.price_per_gram) * COALESCE(r.price_factor, 3.3) * 1.1 as final_price
-                FROM recipes r
-                JOIN recipe_details rd ON r.id = rd.recipe_id
-                JOIN materials m ON rd.material_id = m.id
-                GROUP BY r.id, r.name
-                ORDER BY r.name
-            """
-            cursor.execute(query)
-        else:
-            query = """
-                SELECT r.name, SUM(rd.quantity * m.price_per_gram) * COALESCE(r.price_factor, 3.3) * 1.1 as final_price
-                FROM recipes r
-                JOIN recipe_details rd ON r.id = rd.recipe_id
-                JOIN materials m ON rd.material_id = m.id
-                JOIN categories c ON r.category_id = c.id
-                WHERE c.name = ?
-                GROUP BY r.id, r.name
-                ORDER BY r.name
-            """
-            cursor.execute(query, (category,))
-            
-        self.recipes = {row[0]: row[1] for row in cursor.fetchall()}
-        self.recipes_list.clear()
-        for name in self.recipes:
-            self.recipes_list.addItem(name)
-            
+        recipe_ids = catalog.recipes_using(conn.cursor(), material_ids)
         conn.close()
+        if recipe_ids:
+            self.update_menu(recipe_ids)
+
+    def on_categories_changed(self, category_ids):
+        self.reload_menu()
+
+    def on_tables_changed(self, tables):
+        if changes_catalog(tables):
+            self.reload_menu()
+
+    def reload_menu(self):
+        """Rebuild the category buttons and the menu from the reloaded cache, keeping the selected category"""
+        selected = next((btn.text() for btn in self.category_buttons if btn.isChecked()), ALL_CATEGORIES)
+        self.build_category_buttons()
+        self.load_menu()
+        if selected not in self.get_categories():
+            selected = ALL_CATEGORIES
+        self.on_category_clicked(selected)
+
+    def on_thumbnail_ready(self, recipe_id):
+        self.recipes_list.viewport().update()
+
+    def load_recipes(self, category=None):
+        """Show recipes of the selected category by swapping the model filter"""
+        if not category or category == ALL_CATEGORIES:
+            self.recipes_proxy.setFilterRegularExpression(QRegularExpression())
+        else:
+            pattern = f"^{QRegularExpression.escape(category)}$"
+            self.recipes_proxy.setFilterRegularExpression(QRegularExpression(pattern))
 
-    def show_recipe_details(self, item):
-        recipe_name = item.text()
-        price = self.recipes[recipe_name]
-        self.selected_recipe = (recipe_name, price)
+    def show_recipe_details(self, index):
+        recipe_name = index.data()
+        price = index.data(MENU_PRICE_ROLE)
+        recipe_id = index.data(MENU_RECIPE_ID_ROLE)
+        self.selected_recipe = (recipe_id, recipe_name, price)
 
     def add_to_order(self):
         if hasattr(self, 'selected_recipe'):
-            name, price = self.selected_recipe
+            recipe_id, name, price = self.selected_recipe
             quantity = self.quantity_spin.value()
             total = price * quantity
 
             row = self.order_details.rowCount()
             self.order_details.insertRow(row)
             
-            # Create items with center alignment
+            # Create items with center alignment; the line keeps its recipe ID
             name_item = QTableWidgetItem(name)
+            name_item.setData(Qt.UserRole, recipe_id)
             name_item.setTextAlignment(Qt.AlignCenter)
             
             price_item = QTableWidgetItem(f"{int(price):,}")
@@ -2589,19 +3430,14 @@ class OrderDialog(QDialog):
             self.update_total()
 
     def update_total(self):
-        total = sum(
+        total = self.ticket_total + sum(
             int(self.order_details.item(row, 3).text().replace(',', ''))
             for row in range(self.order_details.rowCount())
         )
         self.lbl_total.setText(f"مجموع کل: {total:,} تومان")
 
     def get_categories(self):
-        conn = sqlite3.connect("coffee_shop.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM categories")
-        categories = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return ['همه'] + categories
+        return [ALL_CATEGORIES] + menu_cache.categories()
 
     def print_order(self):
         if self.order_details.rowCount() == 0:
@@ -2767,7 +3603,7 @@ class OrderDialog(QDialog):
         print_button.clicked.connect(lambda: self.print_receipt(dialog))
         main_layout.addWidget(print_button)
 
-        dialog.exec_()
+        exec_and_delete(dialog)
 
     def create_separator(self):
         separator = QLabel("- - - - - - - - - - - - - - - - - -")
@@ -2843,6 +3679,177 @@ class OrderDialog(QDialog):
             QMessageBox.critical(self, "خطا", f"خطا در چاپ فیش:\n{str(e)}")
 
 
+class OpenTicketsDialog(QDialog):
+    """List unsettled tickets so one can be appended to or settled."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("سفارش‌های باز")
+        self.setStyleSheet(f"background-color: {COLOR_BACKGROUND}; color: {COLOR_TEXT}; font-family: 'Yekan';")
+        self.setGeometry(100, 100, 600, 400)
+        self.setLayoutDirection(Qt.RightToLeft)
+        self.selected_ticket = None
+
+        layout = QVBoxLayout(self)
+
+        self.table = QTableWidget()
+        self.table.setColumnCount(4)
+        self.table.setHorizontalHeaderLabels(["میز", "شماره فیش", "ساعت", "مبلغ تا کنون"])
+        self.table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.doubleClicked.connect(self.choose)
+        layout.addWidget(self.table)
+
+        choose_button = QPushButton("انتخاب")
+        choose_button.clicked.connect(self.choose)
+        layout.addWidget(choose_button)
+
+        conn = sqlite3.connect("coffee_shop.db")
+        self.tickets = order_service.open_tickets(conn.cursor())
+        conn.close()
+
+        self.table.setRowCount(len(self.tickets))
+        for row, (receipt_number, table_number, jalali_time, total) in enumerate(self.tickets):
+            self.table.setItem(row, 0, QTableWidgetItem(str(table_number or "-")))
+            self.table.setItem(row, 1, QTableWidgetItem(receipt_number))
+            self.table.setItem(row, 2, QTableWidgetItem(jalali_time))
+            self.table.setItem(row, 3, QTableWidgetItem(f"{total:,}"))
+        self.table.resizeColumnsToContents()
+
+    def choose(self):
+        row = self.table.currentRow()
+        if row == -1:
+            QMessageBox.warning(self, "خطا", "لطفاً یک سفارش را انتخاب کنید.")
+            return
+        receipt_number, table_number, _, total = self.tickets[row]
+        self.selected_ticket = (receipt_number, table_number, total)
+        self.accept()
+
+
+class KitchenQueueDialog(QDialog):
+    """Live kitchen/bar queue; rows are updated in place as statuses change."""
+
+    STATUS_LABELS = {
+        "pending": "در انتظار",
+        "preparing": "در حال آماده‌سازی",
+        "ready": "آماده تحویل",
+    }
+    NEXT_STATUS = {"pending": "preparing", "preparing": "ready", "ready": "served"}
+    NEXT_LABELS = {"pending": "شروع", "preparing": "آماده شد", "ready": "تحویل شد"}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("صف آشپزخانه و بار")
+        self.setStyleSheet(f"background-color: {COLOR_BACKGROUND}; color: {COLOR_TEXT}; font-family: 'Yekan';")
+        self.setGeometry(100, 100, 1000, 600)
+        self.setLayoutDirection(Qt.RightToLeft)
+
+        layout = QVBoxLayout(self)
+
+        self.table = QTableWidget()
+        self.table.setColumnCount(7)
+        self.table.setHorizontalHeaderLabels(["شماره فیش", "میز", "ساعت", "آیتم‌ها", "وضعیت", "مرحله بعد", "لغو"])
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setStyleSheet(f"""
+            QTableWidget {{
+                background-color: #3E3E3E;
+                color: {COLOR_TEXT};
+                font-family: 'Yekan';
+                font-size: 14px;
+            }}
+            QHeaderView::section {{
+                background-color: {COLOR_ACCENT};
+                color: black;
+                font-weight: bold;
+                font-family: 'Yekan';
+                font-size: 16px;
+            }}
+        """)
+        self.table.setColumnWidth(3, 350)
+        layout.addWidget(self.table)
+
+        # order_id -> last shown (status, items text)
+        self.shown = {}
+        self.refresh_queue()
+
+        # Other tills' orders arrive through the main window's table watcher
+        catalog_events.orders_saved.connect(self.on_orders_saved)
+        catalog_events.tables_changed.connect(self.on_tables_changed)
+
+    def on_orders_saved(self, order_ids):
+        self.refresh_queue()
+
+    def on_tables_changed(self, tables):
+        if any(table in db_schema.ORDER_TABLES for table in tables):
+            self.refresh_queue()
+
+    def refresh_queue(self):
+        """Re-read the live queue and touch only the rows that changed."""
+        conn = sqlite3.connect("coffee_shop.db")
+        cursor = conn.cursor()
+        live = order_service.live_orders(cursor)
+        items = {}
+        if live:
+            placeholders = ",".join("?" * len(live))
+            cursor.execute(f"""
+                SELECT oi.order_id, r.name, SUM(oi.quantity)
+                FROM order_items oi
+                JOIN recipes r ON oi.recipe_id = r.id
+                WHERE oi.order_id IN ({placeholders})
+                GROUP BY oi.order_id, oi.recipe_id
+                ORDER BY MIN(oi.id)
+            """, [order[0] for order in live])
+            for order_id, name, quantity in cursor.fetchall():
+                items.setdefault(order_id, []).append(f"{name} × {quantity}")
+        conn.close()
+
+        live_ids = {order[0] for order in live}
+        for row in range(self.table.rowCount() - 1, -1, -1):
+            order_id = self.table.item(row, 0).data(Qt.UserRole)
+            if order_id not in live_ids:
+                self.table.removeRow(row)
+                self.shown.pop(order_id, None)
+
+        rows = {self.table.item(row, 0).data(Qt.UserRole): row for row in range(self.table.rowCount())}
+        for order_id, receipt_number, table_number, jalali_time, status in live:
+            items_text = "\n".join(items.get(order_id, []))
+            if self.shown.get(order_id) == (status, items_text):
+                continue
+            row = rows.get(order_id)
+            if row is None:
+                row = self.table.rowCount()
+                self.table.insertRow(row)
+                receipt_item = QTableWidgetItem(receipt_number)
+                receipt_item.setData(Qt.UserRole, order_id)
+                self.table.setItem(row, 0, receipt_item)
+                self.table.setItem(row, 1, QTableWidgetItem(str(table_number or "-")))
+                self.table.setItem(row, 2, QTableWidgetItem(jalali_time))
+
+                cancel_button = QPushButton("لغو")
+                cancel_button.setStyleSheet("background-color: #ff4444; color: white; border-radius: 5px; padding: 5px;")
+                cancel_button.clicked.connect(lambda _, r=receipt_number: self.set_status(r, "cancelled"))
+                self.table.setCellWidget(row, 6, cancel_button)
+
+            self.table.setItem(row, 3, QTableWidgetItem(items_text))
+            self.table.setItem(row, 4, QTableWidgetItem(self.STATUS_LABELS[status]))
+            next_button = QPushButton(self.NEXT_LABELS[status])
+            next_button.setStyleSheet("background-color: #4CAF50; color: white; border-radius: 5px; padding: 5px;")
+            next_button.clicked.connect(
+                lambda _, r=receipt_number, n=self.NEXT_STATUS[status]: self.set_status(r, n))
+            self.table.setCellWidget(row, 5, next_button)
+            self.table.setRowHeight(row, max(30, len(items.get(order_id, [])) * 25))
+            self.shown[order_id] = (status, items_text)
+
+    def set_status(self, receipt_number, status):
+        result = submit_order_record({"type": "status", "receipt_number": receipt_number, "order_status": status})
+        if not result["ok"]:
+            QMessageBox.warning(self, "خطا", result["error"])
+        if result.get("order_id"):
+            catalog_events.orders_saved.emit([result["order_id"]])
+        else:
+            self.refresh_queue()
+
+
 class OrderReportDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -2858,52 +3865,133 @@ class OrderReportDialog(QDialog):
         self.date_filter.setCalendarPopup(True)
         self.date_filter.setDate(QDate.currentDate())
         self.date_filter.dateChanged.connect(self.load_orders)
+
+        # بازه گزارش نسبت به تاریخ انتخاب‌شده: یک روز فهرست سفارش‌ها، بازه‌های بلندتر از جداول تجمیعی
+        self.range_combo = QComboBox()
+        self.range_combo.addItems([label for label, _ in jalali_calendar.RANGE_PRESETS])
+        self.range_combo.currentIndexChanged.connect(self.load_orders)
         
         filter_layout = QHBoxLayout()
         filter_layout.addWidget(QLabel("فیلتر بر اساس تاریخ:"))
         filter_layout.addWidget(self.date_filter)
+        filter_layout.addWidget(QLabel("بازه:"))
+        filter_layout.addWidget(self.range_combo)
         layout.addLayout(filter_layout)
 
         # جدول سفارشات
         self.orders_table = QTableWidget()
-        self.orders_table.setColumnCount(5)
-        self.orders_table.setHorizontalHeaderLabels(["شماره سفارش", "تاریخ", "تعداد آیتم‌ها", "مبلغ کل", "جزئیات"])
-        self.orders_table.doubleClicked.connect(self.show_order_details)
+        self.orders_table.doubleClicked.connect(self.on_row_double_clicked)
         layout.addWidget(self.orders_table)
 
+        # جدول فروش آیتم‌ها در گزارش بازه‌ها
+        self.recipes_table = QTableWidget()
+        self.recipes_table.setColumnCount(3)
+        self.recipes_table.setHorizontalHeaderLabels(["آیتم", "تعداد فروش", "مبلغ کل"])
+        layout.addWidget(self.recipes_table)
+
+        self.lbl_summary = QLabel()
+        self.lbl_summary.setStyleSheet("font-weight: bold; color: #fcd40d;")
+        layout.addWidget(self.lbl_summary)
+
         self.load_orders()
+        catalog_events.orders_saved.connect(self.on_orders_saved)
+        catalog_events.tables_changed.connect(self.on_tables_changed)
 
     def load_orders(self):
         selected_date = self.date_filter.date().toPython()
-        jalali_date = jdatetime.date.fromgregorian(date=selected_date).strftime("%Y/%m/%d")
-        
+        day_key = jalali_calendar.day_key(jdatetime.date.fromgregorian(date=selected_date))
+
         conn = sqlite3.connect("coffee_shop.db")
         cursor = conn.cursor()
+        try:
+            first_day, last_day = jalali_calendar.preset_range(cursor, self.range_combo.currentIndex(), day_key)
+        except ValueError as e:
+            conn.close()
+            self.orders_table.setRowCount(0)
+            self.recipes_table.hide()
+            self.lbl_summary.setText(str(e))
+            return
+
+        if first_day != last_day:
+            self.load_summary(cursor, first_day, last_day)
+            conn.close()
+            return
+
+        self.recipes_table.hide()
+        self.lbl_summary.clear()
+        self.orders_table.setColumnCount(5)
+        self.orders_table.setHorizontalHeaderLabels(["شماره سفارش", "تاریخ", "تعداد آیتم‌ها", "مبلغ کل", "جزئیات"])
         
-        cursor.execute("""
-            SELECT o.id, o.jalali_date, 
-                   COUNT(oi.id), o.total_amount 
-            FROM orders o
-            LEFT JOIN order_items oi ON o.id = oi.order_id
-            WHERE o.jalali_date = ?
-            GROUP BY o.id
-        """, (jalali_date,))
-        
-        orders = cursor.fetchall()
-        
+        orders = reports.day_orders(cursor, day_key)
         self.orders_table.setRowCount(len(orders))
-        for row, (order_id, date, item_count, total) in enumerate(orders):
-            self.orders_table.setItem(row, 0, QTableWidgetItem(str(order_id)))
-            self.orders_table.setItem(row, 1, QTableWidgetItem(date))
-            self.orders_table.setItem(row, 2, QTableWidgetItem(str(item_count)))
-            self.orders_table.setItem(row, 3, QTableWidgetItem(f"{total:,}"))
-            
-            btn_details = QPushButton("مشاهده جزئیات")
-            btn_details.clicked.connect(lambda _, oid=order_id: self.show_order_details(oid))
-            self.orders_table.setCellWidget(row, 4, btn_details)
+        for row, order in enumerate(orders):
+            self.set_order_row(row, order)
             
         conn.close()
 
+    def set_order_row(self, row, order):
+        order_id, date, item_count, total = order
+        id_item = QTableWidgetItem(str(order_id))
+        id_item.setData(Qt.UserRole, order_id)
+        self.orders_table.setItem(row, 0, id_item)
+        self.orders_table.setItem(row, 1, QTableWidgetItem(date))
+        self.orders_table.setItem(row, 2, QTableWidgetItem(str(item_count)))
+        self.orders_table.setItem(row, 3, QTableWidgetItem(f"{total:,}"))
+
+        btn_details = QPushButton("مشاهده جزئیات")
+        btn_details.clicked.connect(lambda _, oid=order_id: self.show_order_details(oid))
+        self.orders_table.setCellWidget(row, 4, btn_details)
+
+    def on_tables_changed(self, tables):
+        if "orders" in tables:
+            self.load_orders()
+
+    def on_orders_saved(self, order_ids):
+        """Add or update just these orders in a single-day list; range summaries are re-read from the rollups"""
+        if self.orders_table.columnCount() != 5:
+            self.load_orders()
+            return
+        selected_date = self.date_filter.date().toPython()
+        day_key = jalali_calendar.day_key(jdatetime.date.fromgregorian(date=selected_date))
+        conn = sqlite3.connect("coffee_shop.db")
+        orders = {order[0]: order for order in reports.day_orders(conn.cursor(), day_key, order_ids)}
+        conn.close()
+        update_table_rows(self.orders_table, {order_id: orders.get(order_id) for order_id in order_ids},
+                          self.set_order_row)
+
+    def load_summary(self, cursor, first_day, last_day):
+        """Show a range of days from the rollup tables, one row per day or per month."""
+        self.orders_table.setColumnCount(4)
+        self.orders_table.setHorizontalHeaderLabels(["دوره", "تعداد سفارش", "تعداد آیتم‌ها", "مبلغ کل"])
+
+        periods, recipes = reports.sales_summary(cursor, first_day, last_day)
+
+        self.orders_table.setRowCount(len(periods))
+        for row, (period, order_count, item_count, revenue) in enumerate(periods):
+            self.orders_table.setItem(row, 0, QTableWidgetItem(period))
+            self.orders_table.setItem(row, 1, QTableWidgetItem(str(order_count)))
+            self.orders_table.setItem(row, 2, QTableWidgetItem(str(item_count)))
+            self.orders_table.setItem(row, 3, QTableWidgetItem(f"{revenue:,}"))
+
+        self.recipes_table.setRowCount(len(recipes))
+        for row, (name, quantity, revenue) in enumerate(recipes):
+            self.recipes_table.setItem(row, 0, QTableWidgetItem(name))
+            self.recipes_table.setItem(row, 1, QTableWidgetItem(str(quantity)))
+            self.recipes_table.setItem(row, 2, QTableWidgetItem(f"{revenue:,}"))
+        self.recipes_table.show()
+
+        total_orders = sum(period[1] for period in periods)
+        total_revenue = sum(period[3] for period in periods)
+        self.lbl_summary.setText(
+            f"{jalali_calendar.to_jalali_date(first_day)} تا {jalali_calendar.to_jalali_date(last_day)}    "
+            f"تعداد سفارش: {total_orders:,}    فروش کل: {total_revenue:,} تومان"
+        )
+
+    def on_row_double_clicked(self, index):
+        """Open order details from the single-day list; summary rows have none"""
+        if self.orders_table.columnCount() == 5:
+            self.show_order_details(int(self.orders_table.item(index.row(), 0).text()))
+
     def show_order_details(self, order_id):
         conn = sqlite3.connect("coffee_shop.db")
         cursor = conn.cursor()
@@ -2933,8 +4021,614 @@ class OrderReportDialog(QDialog):
             table.setItem(row, 3, QTableWidgetItem(f"{total:,}"))
             
         layout.addWidget(table)
-        dialog.exec()
         conn.close()
+        exec_and_delete(dialog)
+
+
+class MarginReportDialog(QDialog):
+    """Gross profit per item, category, day or month from the cost snapshotted at sale time"""
+
+    GROUPINGS = [("آیتم", "recipe"), ("دسته‌بندی", "category"), ("روز", "day"), ("ماه", "month")]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("گزارش سود ناخالص")
+        self.setStyleSheet(f"background-color: {COLOR_BACKGROUND}; color: {COLOR_TEXT}; font-family: 'Yekan';")
+        self.setGeometry(100, 100, 1000, 600)
+        self.setLayoutDirection(Qt.RightToLeft)
+
+        layout = QVBoxLayout(self)
+
+        self.date_filter = QDateEdit()
+        self.date_filter.setCalendarPopup(True)
+        self.date_filter.setDate(QDate.currentDate())
+        self.date_filter.dateChanged.connect(self.load_report)
+
+        self.range_combo = QComboBox()
+        self.range_combo.addItems([label for label, _ in jalali_calendar.RANGE_PRESETS])
+        self.range_combo.setCurrentIndex(3)
+        self.range_combo.currentIndexChanged.connect(self.load_report)
+
+        self.group_combo = QComboBox()
+        self.group_combo.addItems([label for label, _ in self.GROUPINGS])
+        self.group_combo.currentIndexChanged.connect(self.load_report)
+
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("تاریخ:"))
+        filter_layout.addWidget(self.date_filter)
+        filter_layout.addWidget(QLabel("بازه:"))
+        filter_layout.addWidget(self.range_combo)
+        filter_layout.addWidget(QLabel("بر اساس:"))
+        filter_layout.addWidget(self.group_combo)
+        layout.addLayout(filter_layout)
+
+        self.table = QTableWidget()
+        self.table.setColumnCount(6)
+        self.table.setHorizontalHeaderLabels(["عنوان", "تعداد", "فروش", "بهای تمام‌شده", "سود ناخالص", "حاشیه سود"])
+        self.table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.table)
+
+        self.lbl_summary = QLabel()
+        self.lbl_summary.setStyleSheet("font-weight: bold; color: #fcd40d;")
+        layout.addWidget(self.lbl_summary)
+
+        self.load_report()
+
+    def load_report(self):
+        selected_date = self.date_filter.date().toPython()
+        day_key = jalali_calendar.day_key(jdatetime.date.fromgregorian(date=selected_date))
+
+        conn = sqlite3.connect("coffee_shop.db")
+        cursor = conn.cursor()
+        try:
+            first_day, last_day = jalali_calendar.preset_range(cursor, self.range_combo.currentIndex(), day_key)
+            rows = margins.margin_report(cursor, first_day, last_day,
+                                         self.GROUPINGS[self.group_combo.currentIndex()][1])
+        except ValueError as e:
+            self.table.setRowCount(0)
+            self.lbl_summary.setText(str(e))
+            return
+        finally:
+            conn.close()
+
+        self.table.setRowCount(len(rows))
+        for row, (name, quantity, revenue, cost, profit, margin) in enumerate(rows):
+            self.table.setItem(row, 0, QTableWidgetItem(name))
+            self.table.setItem(row, 1, QTableWidgetItem(str(quantity)))
+            self.table.setItem(row, 2, QTableWidgetItem(f"{revenue:,}"))
+            self.table.setItem(row, 3, QTableWidgetItem(f"{cost:,}"))
+            self.table.setItem(row, 4, QTableWidgetItem(f"{profit:,}"))
+            self.table.setItem(row, 5, QTableWidgetItem(f"{margin:.1f}%"))
+
+        revenue = sum(row[2] for row in rows)
+        profit = sum(row[4] for row in rows)
+        margin = profit * 100 / revenue if revenue else 0.0
+        self.lbl_summary.setText(
+            f"{jalali_calendar.to_jalali_date(first_day)} تا {jalali_calendar.to_jalali_date(last_day)}    "
+            f"فروش: {revenue:,} تومان    سود ناخالص: {profit:,} تومان ({margin:.1f}%)"
+        )
+
+
+class ForecastDialog(QDialog):
+    """Expected sales per item and the materials to buy for the next days"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("پیش‌بینی فروش و خرید مواد")
+        self.setStyleSheet(f"background-color: {COLOR_BACKGROUND}; color: {COLOR_TEXT}; font-family: 'Yekan';")
+        self.setGeometry(100, 100, 1000, 700)
+        self.setLayoutDirection(Qt.RightToLeft)
+
+        layout = QVBoxLayout(self)
+
+        self.days_spin = QSpinBox()
+        self.days_spin.setRange(1, 60)
+        self.days_spin.setValue(7)
+        self.days_spin.valueChanged.connect(self.load_forecast)
+
+        self.window_spin = QSpinBox()
+        self.window_spin.setRange(7, 365)
+        self.window_spin.setValue(forecasting.MOVING_AVERAGE_DAYS)
+        self.window_spin.valueChanged.connect(self.load_forecast)
+
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("تعداد روزهای آینده:"))
+        filter_layout.addWidget(self.days_spin)
+        filter_layout.addWidget(QLabel("میانگین فروش روزهای اخیر:"))
+        filter_layout.addWidget(self.window_spin)
+        layout.addLayout(filter_layout)
+
+        layout.addWidget(QLabel("فهرست خرید"))
+        self.purchase_table = QTableWidget()
+        self.purchase_table.setColumnCount(6)
+        self.purchase_table.setHorizontalHeaderLabels(
+            ["ماده اولیه", "نیاز (گرم)", "موجودی", "حد سفارش", "مقدار خرید", "هزینه تقریبی"])
+        layout.addWidget(self.purchase_table)
+
+        layout.addWidget(QLabel("فروش پیش‌بینی‌شده"))
+        self.recipes_table = QTableWidget()
+        self.recipes_table.setColumnCount(2)
+        self.recipes_table.setHorizontalHeaderLabels(["آیتم", "تعداد"])
+        layout.addWidget(self.recipes_table)
+
+        self.lbl_summary = QLabel()
+        self.lbl_summary.setStyleSheet("font-weight: bold; color: #fcd40d;")
+        layout.addWidget(self.lbl_summary)
+
+        self.load_forecast()
+
+    def load_forecast(self):
+        today = jalali_calendar.day_key(jdatetime.date.today())
+        conn = sqlite3.connect("coffee_shop.db")
+        cursor = conn.cursor()
+        try:
+            forecast = forecasting.recipe_forecast(cursor, today, self.days_spin.value(), self.window_spin.value())
+            purchases = forecasting.purchase_list(cursor, forecast)
+            names = dict(cursor.execute("SELECT id, name FROM recipes"))
+        except ValueError as e:
+            self.lbl_summary.setText(str(e))
+            return
+        finally:
+            conn.close()
+
+        self.purchase_table.setRowCount(len(purchases))
+        for row, (name, needed, on_hand, reorder_level, to_buy, cost) in enumerate(purchases):
+            self.purchase_table.setItem(row, 0, QTableWidgetItem(name))
+            for column, value in enumerate((needed, on_hand, reorder_level, to_buy, cost), start=1):
+                self.purchase_table.setItem(row, column, QTableWidgetItem(f"{value:,.0f}"))
+
+        recipes = sorted(forecast.items(), key=lambda item: item[1], reverse=True)
+        self.recipes_table.setRowCount(len(recipes))
+        for row, (recipe_id, quantity) in enumerate(recipes):
+            self.recipes_table.setItem(row, 0, QTableWidgetItem(names.get(recipe_id, f"#{recipe_id}")))
+            self.recipes_table.setItem(row, 1, QTableWidgetItem(f"{quantity:,.1f}"))
+
+        total_cost = sum(row[5] for row in purchases)
+        self.lbl_summary.setText(f"هزینه تقریبی خرید: {total_cost:,.0f} تومان")
+
+
+class ExportWorker(QObject):
+    """Runs one export off the UI thread"""
+    progress = Signal(int, int)
+    finished = Signal(int)
+    failed = Signal(str)
+
+    def __init__(self, name, path, file_format):
+        super().__init__()
+        self.name = name
+        self.path = path
+        self.file_format = file_format
+        self.cancel_requested = False
+
+    def run(self):
+        try:
+            rows = exports.export(self.name, self.path, self.file_format,
+                                  progress=self.progress.emit, cancelled=lambda: self.cancel_requested)
+        except exports.ExportCancelled:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.failed.emit("خروجی لغو شد.")
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.finished.emit(rows)
+
+
+class BackupWorker(QObject):
+    """Runs a backup job off the UI thread"""
+    progress = Signal(int, int)
+    finished = Signal(str)
+    failed = Signal(str)
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+
+    def run(self):
+        try:
+            path = self.job(self.progress.emit)
+        except (OSError, sqlite3.Error, backups.BackupError) as e:
+            self.failed.emit(str(e))
+        else:
+            self.finished.emit(path)
+
+
+class PriceFeedWorker(QObject):
+    """Applies waiting supplier price files off the UI thread"""
+    finished = Signal(list, list, list, list)
+
+    def __init__(self, folder):
+        super().__init__()
+        self.folder = folder
+
+    def run(self):
+        conn = db_watch.connect(timeout=30)
+        try:
+            changes, recipe_ids, unmatched, failed = price_feed.process_folder(conn, self.folder)
+        except (OSError, sqlite3.Error) as e:
+            changes, recipe_ids, unmatched, failed = [], [], [], [str(e)]
+        finally:
+            conn.close()
+        self.finished.emit(changes, recipe_ids, unmatched, failed)
+
+
+class ExportDialog(QDialog):
+    """Export orders, order lines, materials, recipes or prices to CSV or Excel"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("خروجی داده‌ها")
+        self.setStyleSheet(f"background-color: {COLOR_BACKGROUND}; color: {COLOR_TEXT}; font-family: 'Yekan';")
+        self.setLayoutDirection(Qt.RightToLeft)
+        self.export_thread = None
+        self.worker = None
+
+        layout = QFormLayout(self)
+        self.data_combo = QComboBox()
+        for name, (title, _, _) in exports.EXPORTS.items():
+            self.data_combo.addItem(title, name)
+        self.format_combo = QComboBox()
+        self.format_combo.addItem("CSV", "csv")
+        self.format_combo.addItem("Excel (XLSX)", "xlsx")
+        layout.addRow("داده:", self.data_combo)
+        layout.addRow("قالب فایل:", self.format_combo)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setValue(0)
+        layout.addRow(self.progress_bar)
+        self.lbl_status = QLabel()
+        layout.addRow(self.lbl_status)
+
+        buttons_layout = QHBoxLayout()
+        self.btn_export = QPushButton("ذخیره خروجی")
+        self.btn_export.setStyleSheet(button_style)
+        self.btn_export.clicked.connect(self.start_export)
+        self.btn_cancel = QPushButton("لغو")
+        self.btn_cancel.setStyleSheet(button_style)
+        self.btn_cancel.setEnabled(False)
+        self.btn_cancel.clicked.connect(self.cancel_export)
+        buttons_layout.addWidget(self.btn_export)
+        buttons_layout.addWidget(self.btn_cancel)
+        layout.addRow(buttons_layout)
+
+    def start_export(self):
+        name = self.data_combo.currentData()
+        file_format = self.format_combo.currentData()
+        default_name = f"{name}-{jdatetime.date.today().strftime('%Y%m%d')}.{file_format}"
+        file_filter = "CSV Files (*.csv)" if file_format == "csv" else "Excel Files (*.xlsx)"
+        path, _ = QFileDialog.getSaveFileName(self, "ذخیره خروجی", default_name, file_filter)
+        if not path:
+            return
+
+        self.export_thread = QThread(self)
+        self.worker = ExportWorker(name, path, file_format)
+        self.worker.moveToThread(self.export_thread)
+        self.export_thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.on_progress)
+        self.worker.finished.connect(self.on_finished)
+        self.worker.failed.connect(self.on_failed)
+        self.worker.finished.connect(self.export_thread.quit)
+        self.worker.failed.connect(self.export_thread.quit)
+        self.export_thread.finished.connect(self.worker.deleteLater)
+
+        self.btn_export.setEnabled(False)
+        self.btn_cancel.setEnabled(True)
+        self.progress_bar.setValue(0)
+        self.lbl_status.setText("در حال ذخیره...")
+        self.export_thread.start()
+
+    def cancel_export(self):
+        if self.worker:
+            self.worker.cancel_requested = True
+
+    def on_progress(self, done, total):
+        self.progress_bar.setMaximum(max(total, 1))
+        self.progress_bar.setValue(done)
+
+    def on_finished(self, rows):
+        self.progress_bar.setValue(self.progress_bar.maximum())
+        self.lbl_status.setText(f"{rows:,} ردیف ذخیره شد.")
+        self.export_done()
+
+    def on_failed(self, error):
+        self.lbl_status.setText(error)
+        self.export_done()
+
+    def export_done(self):
+        self.worker = None
+        self.btn_export.setEnabled(True)
+        self.btn_cancel.setEnabled(False)
+
+    def done(self, result):
+        # Stop a running export before the dialog and its thread go away
+        if self.export_thread and self.export_thread.isRunning():
+            self.cancel_export()
+            # The queued quit from the worker cannot run while this thread waits
+            self.export_thread.quit()
+            self.export_thread.wait()
+        super().done(result)
+
+
+class CatalogImportDialog(QDialog):
+    """Preview and apply a bulk import of materials, categories and recipes from CSV files"""
+
+    ACTION_LABELS = {"add": "افزودن", "update": "تغییر", "unchanged": "بدون تغییر"}
+    KIND_LABELS = {"materials": "ماده اولیه", "categories": "دسته‌بندی", "recipes": "آیتم"}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("ورود گروهی کاتالوگ")
+        self.setStyleSheet(f"background-color: {COLOR_BACKGROUND}; color: {COLOR_TEXT}; font-family: 'Yekan';")
+        self.setGeometry(100, 100, 1000, 700)
+        self.setLayoutDirection(Qt.RightToLeft)
+        self.plan = None
+
+        layout = QVBoxLayout(self)
+
+        btn_choose = QPushButton("انتخاب فایل‌های CSV")
+        btn_choose.setStyleSheet(button_style)
+        btn_choose.clicked.connect(self.choose_files)
+        layout.addWidget(btn_choose)
+
+        self.changes_table = QTableWidget()
+        self.changes_table.setColumnCount(4)
+        self.changes_table.setHorizontalHeaderLabels(["عملیات", "نوع", "نام", "جزئیات"])
+        self.changes_table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.changes_table)
+
+        layout.addWidget(QLabel("خطاها"))
+        self.errors_list = QListWidget()
+        self.errors_list.setMaximumHeight(150)
+        layout.addWidget(self.errors_list)
+
+        self.lbl_summary = QLabel()
+        self.lbl_summary.setStyleSheet("font-weight: bold; color: #fcd40d;")
+        layout.addWidget(self.lbl_summary)
+
+        self.btn_apply = QPushButton("اعمال تغییرات")
+        self.btn_apply.setStyleSheet(button_style)
+        self.btn_apply.setEnabled(False)
+        self.btn_apply.clicked.connect(self.apply_import)
+        layout.addWidget(self.btn_apply)
+
+    def choose_files(self):
+        paths, _ = QFileDialog.getOpenFileNames(self, "انتخاب فایل‌ها", "", "CSV Files (*.csv)")
+        if not paths:
+            return
+        conn = sqlite3.connect("coffee_shop.db")
+        self.plan = catalog_import.plan_import(conn.cursor(), paths)
+        conn.close()
+        self.show_plan()
+
+    def show_plan(self):
+        # Changes first, unchanged rows at the end
+        changes = sorted(self.plan.changes, key=lambda change: change[0] == "unchanged")
+        self.changes_table.setRowCount(len(changes))
+        action_colors = {"add": QColor("#2ecc71"), "update": QColor("#f39c12")}
+        for row, (action, kind, name, detail) in enumerate(changes):
+            action_item = QTableWidgetItem(self.ACTION_LABELS[action])
+            if action in action_colors:
+                action_item.setForeground(action_colors[action])
+            self.changes_table.setItem(row, 0, action_item)
+            self.changes_table.setItem(row, 1, QTableWidgetItem(self.KIND_LABELS[kind]))
+            self.changes_table.setItem(row, 2, QTableWidgetItem(name))
+            self.changes_table.setItem(row, 3, QTableWidgetItem(detail))
+
+        self.errors_list.clear()
+        self.errors_list.addItems(self.plan.errors)
+
+        counts = self.plan.counts()
+        self.lbl_summary.setText(
+            f"افزودن: {counts.get('add', 0)}    تغییر: {counts.get('update', 0)}    "
+            f"بدون تغییر: {counts.get('unchanged', 0)}    خطا: {len(self.plan.errors)}"
+        )
+        self.btn_apply.setEnabled(not self.plan.errors and bool(counts.get("add") or counts.get("update")))
+
+    def apply_import(self):
+        conn = db_watch.connect()
+        try:
+            material_ids, category_ids, recipe_ids = catalog_import.apply_import(conn, self.plan)
+        except (ValueError, sqlite3.Error) as e:
+            QMessageBox.critical(self, "خطا", f"خطا در ورود اطلاعات:\n{str(e)}")
+            return
+        finally:
+            conn.close()
+
+        # Categories first, so windows showing recipes already know new category names
+        if category_ids:
+            catalog_events.categories_changed.emit(category_ids)
+        if material_ids:
+            catalog_events.materials_changed.emit(material_ids)
+        if recipe_ids:
+            catalog_events.recipes_changed.emit(recipe_ids)
+        QMessageBox.information(self, "موفقیت", "تغییرات کاتالوگ با موفقیت اعمال شد.")
+        self.accept()
+
+
+class StockMovementDialog(QDialog):
+    """Enter a stock-in receipt, a physical count or a reorder level for one material"""
+
+    def __init__(self, parent, title, materials, material_id=None):
+        super().__init__(parent)
+        self.setWindowTitle(title)
+        self.setStyleSheet(f"background-color: {COLOR_BACKGROUND}; color: {COLOR_TEXT}; font-family: 'Yekan';")
+        self.setLayoutDirection(Qt.RightToLeft)
+
+        layout = QFormLayout(self)
+        self.material_combo = QComboBox()
+        for mid, name in materials:
+            self.material_combo.addItem(name, mid)
+        if material_id is not None:
+            self.material_combo.setCurrentIndex(self.material_combo.findData(material_id))
+        self.quantity_input = QLineEdit()
+        self.quantity_input.setPlaceholderText("گرم")
+        self.note_input = QLineEdit()
+        layout.addRow("ماده اولیه:", self.material_combo)
+        layout.addRow("مقدار (گرم):", self.quantity_input)
+        layout.addRow("توضیحات:", self.note_input)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+
+    def values(self):
+        """(material_id, grams, note); raises ValueError for a bad quantity"""
+        return (self.material_combo.currentData(), float(self.quantity_input.text().replace(',', '')),
+                self.note_input.text().strip() or None)
+
+
+class StockDialog(QDialog):
+    """Material stock levels with receipts, counts, reorder levels and reconciliation"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("موجودی انبار")
+        self.setStyleSheet(f"background-color: {COLOR_BACKGROUND}; color: {COLOR_TEXT}; font-family: 'Yekan';")
+        self.setGeometry(100, 100, 900, 600)
+        self.setLayoutDirection(Qt.RightToLeft)
+
+        layout = QVBoxLayout(self)
+
+        self.table = QTableWidget()
+        self.table.setColumnCount(4)
+        self.table.setHorizontalHeaderLabels(["ماده اولیه", "موجودی (گرم)", "حد سفارش", "وضعیت"])
+        self.table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.table)
+
+        buttons_layout = QHBoxLayout()
+        for text, handler in (
+            ("ورود کالا", self.receive_stock),
+            ("شمارش انبار", self.count_stock),
+            ("حد سفارش", self.set_reorder_level),
+            ("گزارش مغایرت", self.show_reconciliation),
+        ):
+            button = QPushButton(text)
+            button.setStyleSheet(button_style)
+            button.clicked.connect(handler)
+            buttons_layout.addWidget(button)
+        layout.addLayout(buttons_layout)
+
+        self.load_stock()
+
+    def load_stock(self):
+        conn = sqlite3.connect("coffee_shop.db")
+        self.levels = stock.stock_levels(conn.cursor())
+        conn.close()
+
+        self.table.setRowCount(len(self.levels))
+        for row, (material_id, name, quantity, reorder_level) in enumerate(self.levels):
+            name_item = QTableWidgetItem(name)
+            name_item.setData(Qt.UserRole, material_id)
+            self.table.setItem(row, 0, name_item)
+            self.table.setItem(row, 1, QTableWidgetItem(f"{quantity:,.0f}"))
+            self.table.setItem(row, 2, QTableWidgetItem(f"{reorder_level:,.0f}"))
+            low = reorder_level > 0 and quantity <= reorder_level
+            status_item = QTableWidgetItem("کمبود" if low else "")
+            if low:
+                status_item.setForeground(QColor("#e74c3c"))
+            self.table.setItem(row, 3, status_item)
+
+    def edit_stock(self, title, apply):
+        """Ask for a material and quantity, then apply(cursor, material_id, grams, note) and reload"""
+        selected = self.table.item(self.table.currentRow(), 0) if self.table.currentRow() >= 0 else None
+        dialog = StockMovementDialog(self, title, [(mid, name) for mid, name, _, _ in self.levels],
+                                     selected.data(Qt.UserRole) if selected else None)
+        if dialog.exec() != QDialog.Accepted:
+            return
+        conn = db_watch.connect()
+        try:
+            apply(conn.cursor(), *dialog.values())
+            conn.commit()
+        except ValueError as e:
+            QMessageBox.warning(self, "خطا", f"مقدار نامعتبر است:\n{str(e)}")
+        finally:
+            conn.close()
+        self.load_stock()
+
+    def receive_stock(self):
+        today = jalali_calendar.day_key(jdatetime.date.today())
+        self.edit_stock("ورود کالا", lambda cursor, mid, grams, note: stock.receive(cursor, mid, grams, today, note))
+
+    def count_stock(self):
+        today = jalali_calendar.day_key(jdatetime.date.today())
+        self.edit_stock("شمارش انبار", lambda cursor, mid, grams, note: stock.count(cursor, mid, grams, today, note))
+
+    def set_reorder_level(self):
+        self.edit_stock("حد سفارش", lambda cursor, mid, grams, note: stock.set_reorder_level(cursor, mid, grams))
+
+    def show_reconciliation(self):
+        dialog = StockReconciliationDialog(self)
+        dialog.exec()
+
+
+class StockReconciliationDialog(QDialog):
+    """Opening balance, receipts, consumption, count corrections and closing balance per material"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("گزارش مغایرت انبار")
+        self.setStyleSheet(f"background-color: {COLOR_BACKGROUND}; color: {COLOR_TEXT}; font-family: 'Yekan';")
+        self.setGeometry(100, 100, 1100, 600)
+        self.setLayoutDirection(Qt.RightToLeft)
+
+        layout = QVBoxLayout(self)
+
+        self.date_filter = QDateEdit()
+        self.date_filter.setCalendarPopup(True)
+        self.date_filter.setDate(QDate.currentDate())
+        self.date_filter.dateChanged.connect(self.load_report)
+
+        self.range_combo = QComboBox()
+        self.range_combo.addItems([label for label, _ in jalali_calendar.RANGE_PRESETS])
+        self.range_combo.setCurrentIndex(1)
+        self.range_combo.currentIndexChanged.connect(self.load_report)
+
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("تاریخ:"))
+        filter_layout.addWidget(self.date_filter)
+        filter_layout.addWidget(QLabel("بازه:"))
+        filter_layout.addWidget(self.range_combo)
+        layout.addLayout(filter_layout)
+
+        self.table = QTableWidget()
+        self.table.setColumnCount(8)
+        self.table.setHorizontalHeaderLabels(
+            ["ماده اولیه", "اول دوره", "ورودی", "مصرف", "اصلاح شمارش", "پایان دوره", "موجودی فعلی", "مغایرت دفتر"])
+        layout.addWidget(self.table)
+
+        self.lbl_summary = QLabel()
+        self.lbl_summary.setStyleSheet("font-weight: bold; color: #fcd40d;")
+        layout.addWidget(self.lbl_summary)
+
+        self.load_report()
+
+    def load_report(self):
+        selected_date = self.date_filter.date().toPython()
+        day_key = jalali_calendar.day_key(jdatetime.date.fromgregorian(date=selected_date))
+
+        conn = sqlite3.connect("coffee_shop.db")
+        cursor = conn.cursor()
+        try:
+            first_day, last_day = jalali_calendar.preset_range(cursor, self.range_combo.currentIndex(), day_key)
+            rows = stock.reconciliation(cursor, first_day, last_day)
+        except ValueError as e:
+            self.table.setRowCount(0)
+            self.lbl_summary.setText(str(e))
+            return
+        finally:
+            conn.close()
+
+        self.table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            self.table.setItem(row, 0, QTableWidgetItem(values[0]))
+            for column, value in enumerate(values[1:], start=1):
+                self.table.setItem(row, column, QTableWidgetItem(f"{value:,.0f}"))
+            if round(values[7]):
+                self.table.item(row, 7).setForeground(QColor("#e74c3c"))
+
+        self.lbl_summary.setText(
+            f"{jalali_calendar.to_jalali_date(first_day)} تا {jalali_calendar.to_jalali_date(last_day)}")
 
 
 if __name__ == "__main__":
@@ -2954,10 +4648,6 @@ if __name__ == "__main__":
             )
             """)
             
-            # Drop and recreate orders table
-            cursor.execute("DROP TABLE IF EXISTS order_items")
-            cursor.execute("DROP TABLE IF EXISTS orders")
-            
             # جدول سفارشات
             cursor.execute("""
             CREATE TABLE IF NOT EXISTS orders (
@@ -2997,6 +4687,12 @@ if __name__ == "__main__":
             )
             """)
             conn.commit()
+
+            migration_conn = order_service.connect()
+            try:
+                db_schema.migrate(migration_conn)
+            finally:
+                migration_conn.close()
                 
         except Exception as e:
             conn.rollback()
@@ -3007,6 +4703,17 @@ if __name__ == "__main__":
     init_db()
 
     app = QApplication([])
+
+    # Apply orders that were journaled but not saved before the last shutdown
+    recovery_conn = order_service.connect()
+    try:
+        get_order_journal(recovery_conn)
+    except JournalInUse:
+        QMessageBox.critical(None, "خطا", "برنامه کافه پیونی روی این دستگاه از قبل باز است.")
+        raise SystemExit(1)
+    finally:
+        recovery_conn.close()
+
     window = ModernMainWindow()
     window.setStyleSheet("QApplication { font-family: 'Yekan'; }")
     window.show()
@@ -0,0 +1,256 @@
+"""Online backups of coffee_shop.db through the SQLite backup API.
+
+The copy is made page batch by page batch from a read connection, so it
+includes whatever is still in the WAL and never sees a half-written page.
+Tills keep saving orders while it runs. Each backup is written to a
+.partial file, checked with PRAGMA quick_check and only then renamed into
+place, so a backup file that exists is a good one.
+
+Scheduled backups go to the backup folder as
+coffee_shop-YYYYMMDD-HHMMSS-<kind>.db and are rotated by rotate().
+
+Hourly backups are incremental snapshots instead of full copies. The
+database is split into fixed-size chunks of whole pages; each chunk is
+stored once under chunks/ by its SHA-256, compressed with zlib, and a
+snapshot is a JSON manifest in snapshots/ listing its chunks in order. A
+snapshot only adds the chunks that changed since any earlier one, and any
+snapshot can be reassembled into a database file by restore_snapshot().
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import zlib
+from datetime import datetime, timedelta
+
+import order_service
+
+
+DB_PATH = "coffee_shop.db"
+BACKUP_DIR = "backups"
+PAGES_PER_STEP = 1024
+KEEP_HOURS = 24
+KEEP_DAYS = 30
+BACKUP_NAME = re.compile(r"^coffee_shop-(\d{8}-\d{6})-\w+\.(db|json)$")
+SNAPSHOT_DIR = "snapshots"
+CHUNK_DIR = "chunks"
+CHUNK_SIZE = 64 * 1024
+
+
+class BackupError(Exception):
+    pass
+
+
+def verify(path):
+    """Raise BackupError unless PRAGMA quick_check passes on the file."""
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    except sqlite3.Error as e:
+        raise BackupError(f"{path}: {e}")
+    finally:
+        conn.close()
+    if result != "ok":
+        raise BackupError(f"{path}: quick_check failed: {result}")
+
+
+def backup_database(target_path, db_path=DB_PATH, progress=None, pages=PAGES_PER_STEP):
+    """Copy the live database to target_path and verify the copy.
+
+    progress(copied_pages, total_pages) is called after each batch.
+    """
+    partial_path = target_path + ".partial"
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    source = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    target = sqlite3.connect(partial_path)
+    try:
+        def report(status, remaining, total):
+            if progress:
+                progress(total - remaining, total)
+        # Hold one read snapshot for the whole copy; otherwise every order
+        # saved between two batches restarts the backup from page one.
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        source.backup(target, pages=pages, progress=report)
+        source.execute("COMMIT")
+    finally:
+        target.close()
+        source.close()
+    try:
+        verify(partial_path)
+    except BackupError:
+        os.remove(partial_path)
+        raise
+    os.replace(partial_path, target_path)
+    return target_path
+
+
+def restore_database(source_path, db_path=DB_PATH):
+    """Copy a backup over the live database through the backup API.
+
+    The copy is one write transaction on the live database, so other
+    connections see either the old data or the restored data, never a mix.
+    The order journals are then marked applied to their current end, so
+    orders taken after the backup are not replayed into it on the next start.
+    """
+    verify(source_path)
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(db_path, timeout=30)
+    try:
+        source.backup(target)
+        order_service.skip_journaled_orders(target, db_path)
+    finally:
+        target.close()
+        source.close()
+
+
+def scheduled_backup(kind, backup_dir=BACKUP_DIR, db_path=DB_PATH, progress=None):
+    """Take a backup into backup_dir, rotate old ones and return the new path."""
+    os.makedirs(backup_dir, exist_ok=True)
+    name = f"coffee_shop-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{kind}.db"
+    path = backup_database(os.path.join(backup_dir, name), db_path, progress)
+    rotate(backup_dir)
+    return path
+
+
+def list_backups(backup_dir=BACKUP_DIR):
+    """(taken_at, path) of scheduled backups, newest first."""
+    if not os.path.isdir(backup_dir):
+        return []
+    backups = []
+    for name in os.listdir(backup_dir):
+        match = BACKUP_NAME.match(name)
+        if match:
+            backups.append((datetime.strptime(match.group(1), "%Y%m%d-%H%M%S"), os.path.join(backup_dir, name)))
+    return sorted(backups, reverse=True)
+
+
+def rotate(backup_dir=BACKUP_DIR, keep_hours=KEEP_HOURS, keep_days=KEEP_DAYS, now=None):
+    """Delete old backups: keep everything from the last keep_hours hours and
+    the newest backup of each day for keep_days days. Returns deleted paths."""
+    now = now or datetime.now()
+    kept_days = set()
+    deleted = []
+    for taken_at, path in list_backups(backup_dir):
+        if taken_at >= now - timedelta(hours=keep_hours):
+            continue
+        day = taken_at.date()
+        if taken_at >= now - timedelta(days=keep_days) and day not in kept_days:
+            kept_days.add(day)
+            continue
+        os.remove(path)
+        deleted.append(path)
+    return deleted
+
+
+def _chunk_path(chunk_dir, digest):
+    return os.path.join(chunk_dir, digest[:2], digest)
+
+
+def _write_atomic(path, data):
+    with open(path + ".partial", "wb") as f:
+        f.write(data)
+    os.replace(path + ".partial", path)
+
+
+def snapshot(kind, backup_dir=BACKUP_DIR, db_path=DB_PATH, progress=None):
+    """Take an incremental snapshot into backup_dir and return its manifest path.
+
+    The database is first copied online to a scratch file, so the snapshot
+    is consistent; only chunks not already in the store are compressed and
+    written. Old snapshots are rotated and chunks no longer used are removed.
+    """
+    snapshot_dir = os.path.join(backup_dir, SNAPSHOT_DIR)
+    chunk_dir = os.path.join(backup_dir, CHUNK_DIR)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    scratch_path = os.path.join(backup_dir, "snapshot.db")
+    backup_database(scratch_path, db_path, progress)
+
+    chunks = []
+    written = 0
+    try:
+        size = os.path.getsize(scratch_path)
+        total = (size + CHUNK_SIZE - 1) // CHUNK_SIZE
+        with open(scratch_path, "rb") as f:
+            while True:
+                data = f.read(CHUNK_SIZE)
+                if not data:
+                    break
+                digest = hashlib.sha256(data).hexdigest()
+                path = _chunk_path(chunk_dir, digest)
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    _write_atomic(path, zlib.compress(data))
+                    written += 1
+                chunks.append(digest)
+                if progress:
+                    progress(len(chunks), total)
+    finally:
+        os.remove(scratch_path)
+
+    taken_at = datetime.now()
+    manifest = {
+        "taken_at": taken_at.isoformat(timespec="seconds"),
+        "kind": kind,
+        "size": size,
+        "chunk_size": CHUNK_SIZE,
+        "new_chunks": written,
+        "chunks": chunks,
+    }
+    manifest_path = os.path.join(snapshot_dir, f"coffee_shop-{taken_at.strftime('%Y%m%d-%H%M%S')}-{kind}.json")
+    _write_atomic(manifest_path, json.dumps(manifest).encode("utf-8"))
+    rotate(snapshot_dir)
+    prune_chunks(backup_dir)
+    return manifest_path
+
+
+def _read_chunk(chunk_dir, digest):
+    try:
+        with open(_chunk_path(chunk_dir, digest), "rb") as f:
+            data = zlib.decompress(f.read())
+    except (OSError, zlib.error) as e:
+        raise BackupError(f"chunk {digest}: {e}")
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise BackupError(f"chunk {digest} is corrupt")
+    return data
+
+
+def restore_snapshot(manifest_path, target_path):
+    """Reassemble the snapshot described by manifest_path into target_path."""
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    chunk_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(manifest_path))), CHUNK_DIR)
+    partial_path = target_path + ".partial"
+    try:
+        with open(partial_path, "wb") as f:
+            for digest in manifest["chunks"]:
+                f.write(_read_chunk(chunk_dir, digest))
+        if os.path.getsize(partial_path) != manifest["size"]:
+            raise BackupError(f"{manifest_path}: restored size does not match")
+        verify(partial_path)
+        os.replace(partial_path, target_path)
+    except (BackupError, OSError):
+        # A full disk or a missing chunk must not leave a half-written file behind
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    return target_path
+
+
+def prune_chunks(backup_dir=BACKUP_DIR):
+    """Delete chunks that no snapshot refers to; returns how many were deleted."""
+    snapshot_dir = os.path.join(backup_dir, SNAPSHOT_DIR)
+    chunk_dir = os.path.join(backup_dir, CHUNK_DIR)
+    used = set()
+    for _, path in list_backups(snapshot_dir):
+        with open(path, encoding="utf-8") as f:
+            used.update(json.load(f)["chunks"])
+    deleted = 0
+    for prefix in os.listdir(chunk_dir) if os.path.isdir(chunk_dir) else []:
+        for name in os.listdir(os.path.join(chunk_dir, prefix)):
+            if name not in used:
+                os.remove(os.path.join(chunk_dir, prefix, name))
+                deleted += 1
+    return deleted
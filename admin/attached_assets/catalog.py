@@ -0,0 +1,272 @@
+"""Catalog queries, edits and menu pricing, without any Qt.
+
+A recipe's raw price is the cost of its ingredients. The price list rounds
+it, multiplies it by the recipe's price factor (3.3 when none is set) and
+adds 10% tax. The order screen prices with the same formula in one query,
+without the intermediate rounding.
+
+Edits take a cursor and leave committing to the caller. Updates are
+compare-and-set on the row versions of db_schema, so an edit made from a
+stale copy of a row saves nothing.
+"""
+import math
+
+
+DEFAULT_PRICE_FACTOR = 3.3
+TAX_RATE = 1.1
+UNCATEGORIZED = "بدون دسته‌بندی"
+
+_MENU_QUERY = """
+    SELECT r.id, r.name, c.name,
+           SUM(rd.quantity * m.price_per_gram) * COALESCE(r.price_factor, 3.3) * 1.1 AS final_price
+    FROM recipes r
+    JOIN recipe_details rd ON r.id = rd.recipe_id
+    JOIN materials m ON rd.material_id = m.id
+    LEFT JOIN categories c ON r.category_id = c.id
+"""
+
+
+def catalog_version(cursor):
+    """Counter that changes whenever a material, category or recipe does (see db_schema.track_changes)."""
+    return cursor.execute("""
+        SELECT COALESCE(SUM(version), 0) FROM table_versions
+        WHERE name IN ('materials', 'categories', 'recipes', 'recipe_details')
+    """).fetchone()[0]
+
+
+def list_price(raw_price, price_factor=None):
+    """(raw_price, secondary_price, final_price, factor) rounded as on the price list."""
+    factor = price_factor if price_factor is not None else DEFAULT_PRICE_FACTOR
+    raw_price = round(raw_price)
+    secondary_price = round(raw_price * factor)
+    return raw_price, secondary_price, math.ceil(round(secondary_price * TAX_RATE)), factor
+
+
+def _only(column, ids):
+    """WHERE clause and parameters limiting column to ids; no limit when ids is None."""
+    if ids is None:
+        return "", ()
+    return f" WHERE {column} IN ({','.join('?' * len(ids))})", tuple(ids)
+
+
+def menu(cursor, recipe_ids=None):
+    """(recipe_id, name, category, final_price) of every priced recipe, or of only these, ordered by name."""
+    where, params = _only("r.id", recipe_ids)
+    return cursor.execute(_MENU_QUERY + where + " GROUP BY r.id, r.name ORDER BY r.name", params).fetchall()
+
+
+def menu_prices(cursor, recipe_ids):
+    """{recipe_id: final_price} of only these recipes."""
+    return {recipe_id: price for recipe_id, _, _, price in menu(cursor, recipe_ids)}
+
+
+def recipes_using(cursor, material_ids):
+    """IDs of the recipes that use any of these materials."""
+    where, params = _only("material_id", material_ids)
+    return [row[0] for row in cursor.execute("SELECT DISTINCT recipe_id FROM recipe_details" + where, params)]
+
+
+def recipes_in_categories(cursor, category_ids):
+    """IDs of the recipes in any of these categories."""
+    where, params = _only("category_id", category_ids)
+    return [row[0] for row in cursor.execute("SELECT id FROM recipes" + where, params)]
+
+
+def categories(cursor):
+    """Category names in database order."""
+    return [row[0] for row in cursor.execute("SELECT name FROM categories")]
+
+
+def materials(cursor, text="", material_ids=None):
+    """(id, name, price_per_gram) of the materials whose name contains text, or of only these."""
+    query = "SELECT id, name, price_per_gram FROM materials WHERE name LIKE ?"
+    params = [f"%{text}%"]
+    if material_ids is not None:
+        query += f" AND id IN ({','.join('?' * len(material_ids))})"
+        params += material_ids
+    return cursor.execute(query, params).fetchall()
+
+
+def material_names(cursor):
+    """Material names in database order."""
+    return [row[0] for row in cursor.execute("SELECT name FROM materials")]
+
+
+def material(cursor, material_id):
+    """(name, price_per_gram, version) of a material, or None when it does not exist."""
+    return cursor.execute(
+        "SELECT name, price_per_gram, version FROM materials WHERE id = ?", (material_id,)).fetchone()
+
+
+def row_version(cursor, table, row_id):
+    """Current version of a material or recipe row, or None once it was deleted."""
+    row = cursor.execute(f"SELECT version FROM {table} WHERE id = ?", (row_id,)).fetchone()
+    return row[0] if row else None
+
+
+def add_material(cursor, name, price_per_gram):
+    """Insert a material and return its ID; sqlite3.IntegrityError when the name is taken."""
+    cursor.execute("INSERT INTO materials (name, price_per_gram) VALUES (?, ?)", (name, price_per_gram))
+    return cursor.lastrowid
+
+
+def update_material(cursor, material_id, name, price_per_gram, version):
+    """Update a material still at version; False when it changed or was deleted since."""
+    cursor.execute("UPDATE materials SET name = ?, price_per_gram = ? WHERE id = ? AND version = ?",
+                   (name, price_per_gram, material_id, version))
+    return cursor.rowcount > 0
+
+
+def recipes_with_material(cursor, material_id):
+    """Names of the recipes that use a material."""
+    return [row[0] for row in cursor.execute("""
+        SELECT r.name
+        FROM recipes r
+        JOIN recipe_details rd ON r.id = rd.recipe_id
+        WHERE rd.material_id = ?
+    """, (material_id,))]
+
+
+def delete_material(cursor, material_id):
+    """Delete a material; callers check recipes_with_material first."""
+    cursor.execute("DELETE FROM materials WHERE id = ?", (material_id,))
+
+
+def recipe(cursor, recipe_id):
+    """A recipe for editing, or None when it does not exist.
+
+    Returns (name, category, price_factor, version, [(material, quantity)]);
+    category is None for uncategorized recipes.
+    """
+    row = cursor.execute("""
+        SELECT r.name, c.name, r.price_factor, r.version
+        FROM recipes r
+        LEFT JOIN categories c ON r.category_id = c.id
+        WHERE r.id = ?
+    """, (recipe_id,)).fetchone()
+    if row is None:
+        return None
+    ingredients = cursor.execute("""
+        SELECT m.name, rd.quantity
+        FROM recipe_details rd
+        JOIN materials m ON rd.material_id = m.id
+        WHERE rd.recipe_id = ?
+    """, (recipe_id,)).fetchall()
+    return (*row, ingredients)
+
+
+def save_recipe(cursor, recipe_id, name, category_id, price_factor, ingredients, version=None):
+    """Insert a recipe (recipe_id None) or update one still at version, with its ingredients.
+
+    ingredients are (material_id, quantity) pairs and replace the recipe's
+    current ones. Returns the recipe's ID, or None when an update found the
+    recipe changed or deleted since version.
+    """
+    if recipe_id:
+        cursor.execute("""
+            UPDATE recipes
+            SET name = ?, category_id = ?, price_factor = ?
+            WHERE id = ? AND version = ?
+        """, (name, category_id, price_factor, recipe_id, version))
+        if not cursor.rowcount:
+            return None
+        cursor.execute("DELETE FROM recipe_details WHERE recipe_id = ?", (recipe_id,))
+    else:
+        cursor.execute("INSERT INTO recipes (name, category_id, price_factor) VALUES (?, ?, ?)",
+                       (name, category_id, price_factor))
+        recipe_id = cursor.lastrowid
+    cursor.executemany("INSERT INTO recipe_details (recipe_id, material_id, quantity) VALUES (?, ?, ?)",
+                       [(recipe_id, material_id, quantity) for material_id, quantity in ingredients])
+    return recipe_id
+
+
+def delete_recipe(cursor, recipe_id):
+    """Delete a recipe and its ingredients."""
+    # Details first; once the recipe row is gone its ID cannot be looked up by name
+    cursor.execute("DELETE FROM recipe_details WHERE recipe_id = ?", (recipe_id,))
+    cursor.execute("DELETE FROM recipes WHERE id = ?", (recipe_id,))
+
+
+def recipe_prices(cursor, recipe_ids=None):
+    """(recipe_id, name, category, raw_price, secondary_price, final_price, factor) of every priced recipe, or of only these."""
+    where, params = _only("r.id", recipe_ids)
+    prices = []
+    for recipe_id, name, category, raw_price, price_factor in cursor.execute(f"""
+        SELECT r.id, r.name, c.name, SUM(rd.quantity * m.price_per_gram), r.price_factor
+        FROM recipes r
+        LEFT JOIN categories c ON r.category_id = c.id
+        JOIN recipe_details rd ON r.id = rd.recipe_id
+        JOIN materials m ON rd.material_id = m.id
+        {where}
+        GROUP BY r.id
+    """, params):
+        if raw_price is None:
+            continue
+        prices.append((recipe_id, name, category or UNCATEGORIZED, *list_price(raw_price, price_factor)))
+    return prices
+
+
+def price_list(cursor):
+    """(name, category, raw_price, secondary_price, final_price, factor) of every priced recipe."""
+    return [row[1:] for row in recipe_prices(cursor)]
+
+
+def price_list_document(cursor):
+    """The price list as JSON-ready dicts."""
+    return [
+        {"name": name, "category": category, "raw_price": raw_price, "secondary_price": secondary_price,
+         "final_price": final_price, "price_factor": factor}
+        for name, category, raw_price, secondary_price, final_price, factor in price_list(cursor)
+    ]
+
+
+def search(cursor, text):
+    """Materials and recipes matching text.
+
+    Returns ([(name, price_per_gram)], [(name, category, final_price,
+    [(material, grams)])]). Recipes match by their own name or category
+    name, and every recipe of a category named exactly text is included.
+    """
+    pattern = f"%{text}%"
+    materials = cursor.execute(
+        "SELECT name, price_per_gram FROM materials WHERE name LIKE ?", (pattern,)).fetchall()
+    recipes = cursor.execute("""
+        SELECT r.id, r.name, c.name, SUM(rd.quantity * m.price_per_gram), r.price_factor
+        FROM recipes r
+        LEFT JOIN categories c ON r.category_id = c.id
+        JOIN recipe_details rd ON r.id = rd.recipe_id
+        JOIN materials m ON rd.material_id = m.id
+        WHERE r.name LIKE ? OR c.name LIKE ? OR c.name = ?
+        GROUP BY r.id
+        ORDER BY r.name
+    """, (pattern, pattern, text)).fetchall()
+    if not recipes:
+        return materials, []
+
+    placeholders = ",".join("?" * len(recipes))
+    ingredients = {}
+    for recipe_id, name, quantity in cursor.execute(f"""
+        SELECT rd.recipe_id, m.name, rd.quantity
+        FROM recipe_details rd
+        JOIN materials m ON rd.material_id = m.id
+        WHERE rd.recipe_id IN ({placeholders})
+        ORDER BY m.name
+    """, [recipe[0] for recipe in recipes]):
+        ingredients.setdefault(recipe_id, []).append((name, quantity))
+    return materials, [
+        (name, category or UNCATEGORIZED, list_price(raw_price, price_factor)[2], ingredients.get(recipe_id, []))
+        for recipe_id, name, category, raw_price, price_factor in recipes
+    ]
+
+
+def menu_document(cursor):
+    """The customer menu as a JSON-ready dict: categories, each with its items and prices."""
+    grouped = {}
+    for recipe_id, name, category, _, _, final_price, _ in recipe_prices(cursor):
+        grouped.setdefault(category, []).append({"id": recipe_id, "name": name, "price": final_price})
+    return {
+        "categories": [
+            {"name": category, "items": sorted(items, key=lambda item: item["name"])}
+            for category, items in sorted(grouped.items())
+        ]
+    }
@@ -0,0 +1,268 @@
+"""Bulk import of materials, categories and recipes from CSV files.
+
+Files are recognised by their header row; the Persian headers written by
+exports.py and these English ones are both accepted:
+
+    materials    name, price_per_gram[, sku]
+    categories   name
+    recipes      recipe, category, price_factor, material, quantity
+                 (one row per ingredient)
+
+plan_import() reads and validates every file in memory against the current
+catalog and returns an ImportPlan listing the changes and any errors;
+apply_import() writes a clean plan in one transaction. Materials imported
+in the same plan can be used by the recipes in it.
+"""
+import csv
+import sqlite3
+
+
+DEFAULT_PRICE_FACTOR = 3.3
+
+HEADER_ALIASES = {
+    "name": "name", "نام": "name",
+    "sku": "sku", "کد کالا": "sku",
+    "price_per_gram": "price_per_gram", "قیمت هر گرم": "price_per_gram",
+    "recipe": "recipe", "آیتم": "recipe",
+    "category": "category", "دسته‌بندی": "category",
+    "price_factor": "price_factor", "ضریب قیمت": "price_factor",
+    "material": "material", "ماده اولیه": "material",
+    "quantity": "quantity", "مقدار (گرم)": "quantity",
+}
+FILE_KINDS = [
+    ("recipes", {"recipe", "material", "quantity"}),
+    ("materials", {"name", "price_per_gram"}),
+    ("categories", {"name"}),
+]
+
+
+class ImportPlan:
+    """Validated changes of an import, ready to preview and apply."""
+
+    def __init__(self):
+        self.errors = []
+        # (action, kind, name, detail) with action 'add', 'update' or 'unchanged'
+        self.changes = []
+        self.new_materials = []
+        self.updated_materials = []
+        self.new_categories = []
+        # name: (category, price_factor, [(material, quantity)], exists)
+        self.recipes = {}
+
+    def error(self, path, line, message):
+        self.errors.append(f"{path}:{line}: {message}")
+
+    def counts(self):
+        """{action: count} over all changes."""
+        counts = {}
+        for action, _, _, _ in self.changes:
+            counts[action] = counts.get(action, 0) + 1
+        return counts
+
+
+def _read_rows(path):
+    """(kind, [(line_number, {field: value})]) of a CSV file."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = next(reader, None) or []
+        fields = [HEADER_ALIASES.get(column.strip()) for column in header]
+        kind = next((kind for kind, required in FILE_KINDS if required <= set(fields)), None)
+        if kind is None:
+            raise ValueError(f"{path}: unrecognised header {header}")
+        rows = []
+        for line, values in enumerate(reader, start=2):
+            if not any(value.strip() for value in values):
+                continue
+            rows.append((line, {field: value.strip() for field, value in zip(fields, values) if field}))
+        return kind, rows
+
+
+def _parse_int(value):
+    return int(float(value.replace(",", "")))
+
+
+def _plan_materials(plan, path, rows, materials, skus):
+    seen = set()
+    seen_skus = set()
+    for line, row in rows:
+        name = row.get("name", "")
+        if not name:
+            plan.error(path, line, "material name is empty")
+            continue
+        if name in seen:
+            plan.error(path, line, f"duplicate material '{name}'")
+            continue
+        seen.add(name)
+        try:
+            price = _parse_int(row.get("price_per_gram", ""))
+            if price < 0:
+                raise ValueError
+        except ValueError:
+            plan.error(path, line, f"invalid price '{row.get('price_per_gram', '')}' for '{name}'")
+            continue
+        # Files without a SKU column keep the SKUs already stored
+        sku = (row.get("sku") or None) if "sku" in row else skus.get(name)
+        if sku and sku in seen_skus:
+            plan.error(path, line, f"duplicate SKU '{sku}'")
+            continue
+        seen_skus.add(sku)
+        if name not in materials:
+            plan.new_materials.append((name, price, sku))
+            plan.changes.append(("add", "materials", name, f"{price:,}"))
+        elif (materials[name], skus.get(name)) != (price, sku):
+            plan.updated_materials.append((price, sku, name))
+            detail = f"{materials[name]:,} → {price:,}"
+            if skus.get(name) != sku:
+                detail += f"    SKU: {skus.get(name) or '-'} → {sku or '-'}"
+            plan.changes.append(("update", "materials", name, detail))
+        else:
+            plan.changes.append(("unchanged", "materials", name, f"{price:,}"))
+        materials[name] = price
+        skus[name] = sku
+
+
+def _plan_categories(plan, path, rows, categories):
+    for line, row in rows:
+        name = row.get("name", "")
+        if not name:
+            plan.error(path, line, "category name is empty")
+        elif name not in categories:
+            categories.add(name)
+            plan.new_categories.append((name,))
+            plan.changes.append(("add", "categories", name, ""))
+
+
+def _plan_recipes(plan, cursor, path, rows, materials, categories):
+    recipes = {}
+    for line, row in rows:
+        name = row.get("recipe", "")
+        material = row.get("material", "")
+        if not name or not material:
+            plan.error(path, line, "recipe and material names are required")
+            continue
+        if material not in materials:
+            plan.error(path, line, f"unknown material '{material}' in '{name}'")
+            continue
+        try:
+            quantity = _parse_int(row.get("quantity", ""))
+            if quantity <= 0:
+                raise ValueError
+        except ValueError:
+            plan.error(path, line, f"invalid quantity '{row.get('quantity', '')}' for '{material}' in '{name}'")
+            continue
+        try:
+            price_factor = float(row["price_factor"]) if row.get("price_factor") else DEFAULT_PRICE_FACTOR
+            if price_factor <= 0:
+                raise ValueError
+        except ValueError:
+            plan.error(path, line, f"invalid price factor '{row['price_factor']}' for '{name}'")
+            continue
+        category = row.get("category") or None
+
+        if name not in recipes:
+            recipes[name] = (category, price_factor, {})
+        elif recipes[name][:2] != (category, price_factor):
+            plan.error(path, line, f"'{name}' has different category or price factor on different rows")
+            continue
+        ingredients = recipes[name][2]
+        if material in ingredients:
+            plan.error(path, line, f"duplicate material '{material}' in '{name}'")
+            continue
+        ingredients[material] = quantity
+
+    existing = {}
+    for name, category, price_factor, material, quantity in cursor.execute("""
+        SELECT r.name, c.name, r.price_factor, m.name, rd.quantity
+        FROM recipes r
+        LEFT JOIN categories c ON r.category_id = c.id
+        LEFT JOIN recipe_details rd ON rd.recipe_id = r.id
+        LEFT JOIN materials m ON rd.material_id = m.id
+    """):
+        entry = existing.setdefault(name, (category, price_factor or DEFAULT_PRICE_FACTOR, {}))
+        if material is not None:
+            entry[2][material] = quantity
+
+    for name, (category, price_factor, ingredients) in recipes.items():
+        if category and category not in categories:
+            categories.add(category)
+            plan.new_categories.append((category,))
+            plan.changes.append(("add", "categories", category, ""))
+        detail = "، ".join(f"{material} {quantity}" for material, quantity in ingredients.items())
+        if name not in existing:
+            action = "add"
+        elif existing[name] != (category, price_factor, ingredients):
+            action = "update"
+        else:
+            action = "unchanged"
+        plan.changes.append((action, "recipes", name, detail))
+        if action != "unchanged":
+            plan.recipes[name] = (category, price_factor, list(ingredients.items()), name in existing)
+
+
+def plan_import(cursor, paths):
+    """Read and validate CSV files; nothing is written."""
+    plan = ImportPlan()
+    files = {"materials": [], "categories": [], "recipes": []}
+    for path in paths:
+        try:
+            kind, rows = _read_rows(path)
+        except (OSError, UnicodeDecodeError, ValueError, csv.Error) as e:
+            plan.errors.append(str(e))
+            continue
+        files[kind].append((path, rows))
+
+    materials = dict(cursor.execute("SELECT name, price_per_gram FROM materials"))
+    skus = dict(cursor.execute("SELECT name, sku FROM materials"))
+    categories = {row[0] for row in cursor.execute("SELECT name FROM categories")}
+    # Materials and categories first, so recipes in the same import can use them
+    for path, rows in files["materials"]:
+        _plan_materials(plan, path, rows, materials, skus)
+    for path, rows in files["categories"]:
+        _plan_categories(plan, path, rows, categories)
+    for path, rows in files["recipes"]:
+        _plan_recipes(plan, cursor, path, rows, materials, categories)
+    return plan
+
+
+def apply_import(conn, plan):
+    """Write a plan without errors in a single transaction.
+
+    Returns (material_ids, category_ids, recipe_ids) of the rows added or changed.
+    """
+    if plan.errors:
+        raise ValueError("Import has errors")
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("INSERT INTO materials (name, price_per_gram, sku) VALUES (?, ?, ?)", plan.new_materials)
+        cursor.executemany("UPDATE materials SET price_per_gram = ?, sku = ? WHERE name = ?", plan.updated_materials)
+        cursor.executemany("INSERT INTO categories (name) VALUES (?)", plan.new_categories)
+
+        category_ids = dict(cursor.execute("SELECT name, id FROM categories"))
+        material_ids = dict(cursor.execute("SELECT name, id FROM materials"))
+        cursor.executemany(
+            "INSERT INTO recipes (name, category_id, price_factor) VALUES (?, ?, ?)",
+            [(name, category_ids.get(category), price_factor)
+             for name, (category, price_factor, _, exists) in plan.recipes.items() if not exists])
+        cursor.executemany(
+            "UPDATE recipes SET category_id = ?, price_factor = ? WHERE name = ?",
+            [(category_ids.get(category), price_factor, name)
+             for name, (category, price_factor, _, exists) in plan.recipes.items() if exists])
+
+        recipe_ids = dict(cursor.execute("SELECT name, id FROM recipes"))
+        cursor.executemany("DELETE FROM recipe_details WHERE recipe_id = ?",
+                           [(recipe_ids[name],) for name in plan.recipes])
+        cursor.executemany(
+            "INSERT INTO recipe_details (recipe_id, material_id, quantity) VALUES (?, ?, ?)",
+            [(recipe_ids[name], material_ids[material], quantity)
+             for name, (_, _, ingredients, _) in plan.recipes.items()
+             for material, quantity in ingredients])
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    material_names = [row[0] for row in plan.new_materials] + [row[2] for row in plan.updated_materials]
+    return (
+        [material_ids[name] for name in material_names],
+        [category_ids[name] for name, in plan.new_categories],
+        [recipe_ids[name] for name in plan.recipes],
+    )
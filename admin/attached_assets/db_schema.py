@@ -0,0 +1,195 @@
+"""Versioned schema migrations for coffee_shop.db.
+
+Each migration runs once, in order, and records its number in db_version.
+Both the till application and the order service call migrate() on startup.
+"""
+import sqlite3
+
+import jalali_calendar
+import rollups
+import stock
+
+
+def _open_tickets(cursor):
+    """Open tickets and the kitchen queue.
+
+    Orders saved before tickets existed were settled on the spot, so they are
+    marked paid and served instead of flooding the live queue.
+    """
+    cursor.execute("""
+        UPDATE orders SET order_status = 'served', payment_status = 'paid'
+        WHERE order_status = 'pending'
+    """)
+    # Only live orders are in these indexes, so their size does not grow with history
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_live ON orders(id)
+        WHERE order_status IN ('pending', 'preparing', 'ready')
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_open_tickets ON orders(table_number)
+        WHERE payment_status = 'pending'
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)")
+
+
+def _sales_rollups(cursor):
+    """Daily sales rollups, filled from the existing order history."""
+    rollups.rebuild(cursor)
+
+
+def _day_keys(cursor):
+    """Integer Jalali day keys on orders and the calendar dimension table."""
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(orders)")]
+    if "day_key" not in columns:
+        cursor.execute("ALTER TABLE orders ADD COLUMN day_key INTEGER")
+    cursor.execute("UPDATE orders SET day_key = CAST(replace(jalali_date, '/', '') AS INTEGER)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_day_key ON orders(day_key)")
+    jalali_calendar.fill(cursor)
+
+
+def _line_costs(cursor):
+    """Unit cost snapshot on order lines.
+
+    Lines sold before the snapshot existed get today's recipe cost, the best
+    estimate left for them.
+    """
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(order_items)")]
+    if "unit_cost" not in columns:
+        cursor.execute("ALTER TABLE order_items ADD COLUMN unit_cost INTEGER")
+    cursor.execute("""
+        UPDATE order_items SET unit_cost = COALESCE((
+            SELECT CAST(ROUND(SUM(rd.quantity * m.price_per_gram)) AS INTEGER)
+            FROM recipe_details rd
+            JOIN materials m ON rd.material_id = m.id
+            WHERE rd.recipe_id = order_items.recipe_id
+        ), 0)
+        WHERE unit_cost IS NULL
+    """)
+
+
+def _stock_ledger(cursor):
+    """Stock balances and ledger; balances start at zero until the first count."""
+    stock.create_tables(cursor)
+
+
+def _material_skus(cursor):
+    """Supplier SKUs on materials for matching price feeds."""
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(materials)")]
+    if "sku" not in columns:
+        cursor.execute("ALTER TABLE materials ADD COLUMN sku TEXT")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_materials_sku ON materials(sku) WHERE sku IS NOT NULL")
+
+
+def track_changes(cursor, tables):
+    """Count every insert, update and delete on tables in table_versions.
+
+    Readers compare the counters to notice changes without re-reading the
+    tables themselves.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    for table in tables:
+        cursor.execute("INSERT OR IGNORE INTO table_versions (name) VALUES (?)", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            """)
+
+
+def _catalog_versions(cursor):
+    """Change counters on the catalog tables, read by the menu API."""
+    track_changes(cursor, CATALOG_TABLES)
+
+
+def _order_versions(cursor):
+    """Change counters on orders and settings, read by the tills' change watcher."""
+    track_changes(cursor, ORDER_TABLES + ("settings",))
+
+
+def _row_versions(cursor):
+    """Row versions on materials and recipes for compare-and-set edits.
+
+    Triggers bump them on every change, whoever makes it, and a recipe's
+    version also moves when its ingredients do.
+    """
+    for table in ("materials", "recipes"):
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if "version" not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_row_version AFTER UPDATE ON {table}
+            WHEN NEW.version = OLD.version
+            BEGIN
+                UPDATE {table} SET version = version + 1 WHERE id = NEW.id;
+            END
+        """)
+    for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_recipe_details_{event.lower()}_row_version
+            AFTER {event} ON recipe_details
+            BEGIN
+                UPDATE recipes SET version = version + 1 WHERE id = {row}.recipe_id;
+            END
+        """)
+
+
+CATALOG_TABLES = ("materials", "categories", "recipes", "recipe_details")
+ORDER_TABLES = ("orders", "order_items")
+WATCHED_TABLES = CATALOG_TABLES + ORDER_TABLES + ("settings",)
+
+MIGRATIONS = [
+    (2, _open_tickets),
+    (3, _sales_rollups),
+    (4, _day_keys),
+    (5, _line_costs),
+    (6, _stock_ledger),
+    (7, _material_skus),
+    (8, _catalog_versions),
+    (9, _order_versions),
+    (10, _row_versions),
+]
+
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def stored_version(cursor):
+    """Schema version recorded in the database, read without writing anything."""
+    try:
+        row = cursor.execute("SELECT MAX(version) FROM db_version").fetchone()
+    except sqlite3.OperationalError:
+        # No db_version table yet
+        return 1
+    return row[0] or 1
+
+
+def current_version(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS db_version (version INTEGER PRIMARY KEY)")
+    row = cursor.execute("SELECT MAX(version) FROM db_version").fetchone()
+    return row[0] or 1
+
+
+def migrate(conn):
+    """Apply every migration newer than the database, each in its own transaction."""
+    cursor = conn.cursor()
+    version = current_version(cursor)
+    for number, step in MIGRATIONS:
+        if number <= version:
+            continue
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            step(cursor)
+            cursor.execute("INSERT INTO db_version (version) VALUES (?)", (number,))
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        version = number
+    return version
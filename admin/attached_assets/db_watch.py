@@ -0,0 +1,123 @@
+"""Notice which tables other processes changed in coffee_shop.db.
+
+Another till, the order service, a restore or a hand edit in a database
+browser all write through their own connections. PRAGMA data_version on a
+connection kept open moves only when some other connection commits, so
+polling it costs one pragma while nothing happens; when it moves, the
+trigger-maintained table_versions counters (db_schema.track_changes) tell
+which tables changed.
+
+This process writes through connections of its own too, and its windows
+already updated the rows it wrote. Connections opened with connect() count
+their own changes to the tracked tables in a temporary table, through
+temporary triggers only they see; the counts roll back with the transaction
+that made them. TableWatcher subtracts the committed ones, so a table is
+reported only when its counter moved further than this process moved it.
+"""
+import sqlite3
+import threading
+import weakref
+
+
+DB_PATH = "coffee_shop.db"
+
+# Changes committed through this process's connections, per table
+_own_changes = {}
+_own_lock = threading.Lock()
+_open_connections = weakref.WeakSet()
+
+
+class Connection(sqlite3.Connection):
+    """A connection that counts its own changes to the tracked tables."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counted = {}
+        tables = [row[0] for row in self.execute("""
+            SELECT name FROM table_versions
+            WHERE name IN (SELECT name FROM sqlite_master WHERE type = 'table')
+        """)] if self.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'table_versions'").fetchone() else []
+        self.execute("CREATE TEMP TABLE own_changes (name TEXT PRIMARY KEY, changes INTEGER NOT NULL DEFAULT 0)")
+        for table in tables:
+            self.execute("INSERT INTO temp.own_changes (name) VALUES (?)", (table,))
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                self.execute(f"""
+                    CREATE TEMP TRIGGER own_{table}_{event.lower()} AFTER {event} ON {table}
+                    BEGIN
+                        UPDATE own_changes SET changes = changes + 1 WHERE name = '{table}';
+                    END
+                """)
+        if self.in_transaction:
+            self.commit()
+        _open_connections.add(self)
+
+    def count_changes(self):
+        """Add the changes committed since the last count to the process totals."""
+        if self.in_transaction:
+            return
+        with _own_lock:
+            for table, changes in self.execute("SELECT name, changes FROM temp.own_changes"):
+                _own_changes[table] = _own_changes.get(table, 0) + changes - self.counted.get(table, 0)
+                self.counted[table] = changes
+
+    def close(self):
+        try:
+            self.count_changes()
+        except sqlite3.Error:
+            pass
+        _open_connections.discard(self)
+        super().close()
+
+
+def connect(db_path=DB_PATH, **kwargs):
+    """Open a connection whose committed changes TableWatcher does not report."""
+    return sqlite3.connect(db_path, factory=Connection, **kwargs)
+
+
+def own_changes():
+    """Changes per table committed through connect() connections so far."""
+    for conn in list(_open_connections):
+        try:
+            conn.count_changes()
+        except sqlite3.ProgrammingError:
+            # Open in another thread; counted when it closes
+            pass
+    with _own_lock:
+        return dict(_own_changes)
+
+
+class TableWatcher:
+    """Polls data_version and the table_versions counters of tables."""
+
+    def __init__(self, tables, db_path=DB_PATH):
+        self.tables = tuple(tables)
+        self.conn = sqlite3.connect(db_path)
+        self.data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        self.versions = self._read_versions(self.tables)
+        self.own = own_changes()
+
+    def _read_versions(self, tables):
+        placeholders = ",".join("?" * len(tables))
+        versions = dict.fromkeys(tables, 0)
+        versions.update(self.conn.execute(
+            f"SELECT name, version FROM table_versions WHERE name IN ({placeholders})", tables))
+        return versions
+
+    def poll(self):
+        """Tables whose counters moved since the last poll by more than this process's changes, in watch order."""
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self.data_version:
+            return []
+        self.data_version = data_version
+        versions = self._read_versions(self.tables)
+        own = own_changes()
+        # A restore can put counters back, so any difference counts
+        changed = [table for table in self.tables
+                   if versions[table] - self.versions.get(table, 0) != own.get(table, 0) - self.own.get(table, 0)]
+        self.versions = versions
+        self.own = own
+        return changed
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,144 @@
+"""Open and close the main window's dialogs many times and check nothing piles up.
+
+    python dialog_leak_check.py --rounds 50
+
+Each dialog is opened the way its button or menu entry opens it and closed
+again from a timer. After a few warm-up rounds, which build the kept dialogs
+and fill Qt's style, font and pixmap caches, the live widget count and the number of running timers
+must stay where they were and RSS may grow by at most --rss-slack MB.
+
+The dialogs read coffee_shop.db from the working folder, so run this on a
+copy of the database. Without a display set QT_QPA_PLATFORM=offscreen.
+"""
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+
+from PySide6.QtCore import QCoreApplication, QEvent, QTimer
+from PySide6.QtWidgets import QApplication
+
+import Peony_Cafe
+import db_schema
+import order_service
+
+
+WARM_UP_ROUNDS = 10
+
+
+def rss_mb():
+    """Resident set size of this process in MB, or None where it cannot be read."""
+    try:
+        import psutil
+    except ImportError:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+        except OSError:
+            return None
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def run_modal(open_dialog, action=None):
+    """Call open_dialog(), which blocks in exec(), and close the dialog it opens.
+
+    action(dialog) runs while the dialog is up and may open nested dialogs
+    with run_modal itself.
+    """
+    def on_open():
+        dialog = QApplication.activeModalWidget()
+        if action:
+            action(dialog)
+        dialog.reject()
+
+    QTimer.singleShot(0, on_open)
+    open_dialog()
+
+
+def print_first_recipe(order_dialog):
+    """Put the first menu item on the order and open its print preview."""
+    index = order_dialog.recipes_list.model().index(0, 0)
+    if not index.isValid():
+        return
+    order_dialog.show_recipe_details(index)
+    order_dialog.add_to_order()
+    run_modal(order_dialog.print_order)
+
+
+def scenarios(window):
+    """(name, callable) for each dialog under check."""
+    window.search_box.setText("قهوه")
+    return [
+        ("manage_recipes", lambda: run_modal(window.manage_recipes)),
+        ("manage_orders", lambda: run_modal(window.manage_orders)),
+        ("show_order_reports", lambda: run_modal(window.show_order_reports)),
+        ("open_settings", lambda: run_modal(window.open_settings)),
+        ("show_search_results", lambda: run_modal(window.show_search_results)),
+        ("print_order", lambda: run_modal(window.manage_orders, print_first_recipe)),
+    ]
+
+
+def measure(app, window):
+    """(live widgets, running timers under the main window, RSS in MB) after pending deletes."""
+    # Outside app.exec() deleteLater() only runs when asked to
+    for _ in range(3):
+        app.processEvents()
+        QCoreApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+        gc.collect()
+    timers = sum(1 for timer in window.findChildren(QTimer) if timer.isActive())
+    return len(QApplication.allWidgets()), timers, rss_mb()
+
+
+def check(rounds, rss_slack):
+    conn = order_service.connect()
+    db_schema.migrate(conn)
+    conn.close()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = Peony_Cafe.ModernMainWindow()
+    window.show()
+    failures = []
+    for name, open_and_close in scenarios(window):
+        for _ in range(WARM_UP_ROUNDS):
+            open_and_close()
+        widgets, timers, rss = measure(app, window)
+        for _ in range(rounds):
+            open_and_close()
+        after_widgets, after_timers, after_rss = measure(app, window)
+
+        growth = f"widgets {widgets} -> {after_widgets}, timers {timers} -> {after_timers}"
+        if rss is not None:
+            growth += f", RSS {rss:.1f} -> {after_rss:.1f} MB"
+        print(f"{name:20} {growth}")
+        if after_widgets > widgets or after_timers > timers:
+            failures.append(name)
+        elif rss is not None and after_rss - rss > rss_slack:
+            failures.append(name)
+
+    Peony_Cafe.recipe_thumbnails.shutdown()
+    window.wait_for_workers()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peony Cafe dialog memory and timer leak check")
+    parser.add_argument("--db", help="run on a copy of this database instead of ./coffee_shop.db")
+    parser.add_argument("--rounds", type=int, default=20, help="times each dialog is opened and closed")
+    parser.add_argument("--rss-slack", type=float, default=5.0, help="allowed RSS growth per dialog in MB")
+    args = parser.parse_args()
+
+    if args.db:
+        work_dir = tempfile.mkdtemp(prefix="peony-leak-check-")
+        shutil.copy(args.db, os.path.join(work_dir, "coffee_shop.db"))
+        os.chdir(work_dir)
+    failures = check(args.rounds, args.rss_slack)
+    if failures:
+        print("Growing: " + ", ".join(failures))
+        sys.exit(1)
+    print("No growth")
+
+
+if __name__ == "__main__":
+    main()
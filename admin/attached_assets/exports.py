@@ -0,0 +1,129 @@
+"""CSV and XLSX export of orders and the catalog.
+
+Rows are streamed from the cursor in chunks and written as they arrive, so
+memory stays flat however many orders there are. XLSX files are written
+with openpyxl in write-only mode; CSV needs nothing beyond the standard
+library and is written with a BOM so Excel shows Persian text correctly.
+
+Exports open their own connection and can run on a worker thread.
+"""
+import csv
+import sqlite3
+
+
+DB_PATH = "coffee_shop.db"
+CHUNK_SIZE = 1000
+
+# name: (title, column headers, query)
+EXPORTS = {
+    "orders": ("سفارش‌ها", ["شناسه", "شماره فیش", "میز", "تاریخ", "ساعت", "مبلغ کل", "پرداخت", "وضعیت"], """
+        SELECT id, receipt_number, table_number, jalali_date, jalali_time, total_amount,
+               payment_status, order_status
+        FROM orders ORDER BY id
+    """),
+    "order_items": ("اقلام سفارش‌ها", ["شناسه سفارش", "شماره فیش", "تاریخ", "آیتم", "تعداد", "قیمت واحد",
+                                       "جمع کل", "بهای تمام‌شده واحد"], """
+        SELECT o.id, o.receipt_number, o.jalali_date, COALESCE(r.name, '#' || oi.recipe_id), oi.quantity,
+               oi.unit_price, oi.total_price, oi.unit_cost
+        FROM order_items oi
+        JOIN orders o ON oi.order_id = o.id
+        LEFT JOIN recipes r ON oi.recipe_id = r.id
+        ORDER BY oi.id
+    """),
+    "materials": ("مواد اولیه", ["شناسه", "نام", "کد کالا", "قیمت هر گرم", "موجودی (گرم)", "حد سفارش"], """
+        SELECT m.id, m.name, m.sku, m.price_per_gram, COALESCE(s.quantity, 0), COALESCE(s.reorder_level, 0)
+        FROM materials m
+        LEFT JOIN material_stock s ON s.material_id = m.id
+        ORDER BY m.name
+    """),
+    "recipes": ("دستورها", ["آیتم", "دسته‌بندی", "ضریب قیمت", "ماده اولیه", "مقدار (گرم)"], """
+        SELECT r.name, c.name, r.price_factor, m.name, rd.quantity
+        FROM recipes r
+        LEFT JOIN categories c ON r.category_id = c.id
+        JOIN recipe_details rd ON rd.recipe_id = r.id
+        JOIN materials m ON rd.material_id = m.id
+        ORDER BY r.name, m.name
+    """),
+    "prices": ("لیست قیمت", ["آیتم", "دسته‌بندی", "بهای مواد", "قیمت فروش"], """
+        SELECT r.name, c.name, CAST(ROUND(SUM(rd.quantity * m.price_per_gram)) AS INTEGER),
+               CAST(ROUND(SUM(rd.quantity * m.price_per_gram) * COALESCE(r.price_factor, 3.3) * 1.1) AS INTEGER)
+        FROM recipes r
+        JOIN recipe_details rd ON r.id = rd.recipe_id
+        JOIN materials m ON rd.material_id = m.id
+        LEFT JOIN categories c ON r.category_id = c.id
+        GROUP BY r.id
+        ORDER BY c.name, r.name
+    """),
+}
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class _CsvWriter:
+    def __init__(self, path, title):
+        self.file = open(path, "w", newline="", encoding="utf-8-sig")
+        self.writer = csv.writer(self.file)
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class _XlsxWriter:
+    def __init__(self, path, title):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise RuntimeError("XLSX export needs openpyxl (pip install openpyxl)")
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(title[:31])
+        self.sheet.sheet_view.rightToLeft = True
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.sheet.append(row)
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+WRITERS = {"csv": _CsvWriter, "xlsx": _XlsxWriter}
+
+
+def export(name, path, file_format="csv", db_path=DB_PATH, progress=None, cancelled=None):
+    """Write export name to path and return the number of rows written.
+
+    progress(done, total) is called after each chunk; if cancelled() returns
+    true the export stops with ExportCancelled and the partial file is left
+    for the caller to remove.
+    """
+    title, headers, query = EXPORTS[name]
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        total = cursor.execute(f"SELECT COUNT(*) FROM ({query})").fetchone()[0]
+        writer = WRITERS[file_format](path, title)
+        try:
+            writer.write_rows([headers])
+            done = 0
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(CHUNK_SIZE)
+                if not rows:
+                    break
+                writer.write_rows(rows)
+                done += len(rows)
+                if progress:
+                    progress(done, total)
+                if cancelled and cancelled():
+                    raise ExportCancelled()
+        finally:
+            writer.close()
+        return done
+    finally:
+        conn.close()
@@ -0,0 +1,99 @@
+"""Material demand forecast and purchase list from sales history.
+
+Each recipe's daily sales are forecast as a moving average over recent days
+scaled by a day-of-week factor, so busy Fridays are planned as busy. The
+recipe forecast times the recipe x material matrix in recipe_details gives
+the grams of each material needed over the next days. The history comes
+from the sales_daily_recipe rollups, so a year of sales is a few thousand
+rows aggregated in SQLite, not a scan of every order line.
+"""
+import jalali_calendar
+
+
+MOVING_AVERAGE_DAYS = 28
+SEASON_WEEKS = 12
+
+
+def _days_before(cursor, day_key, count):
+    """Day key count days before day_key, from the calendar table."""
+    row = cursor.execute("""
+        SELECT day_key FROM jalali_calendar WHERE day_key < ?
+        ORDER BY day_key DESC LIMIT 1 OFFSET ?
+    """, (day_key, count - 1)).fetchone()
+    if row is None:
+        raise ValueError(f"Not enough calendar days before {jalali_calendar.to_jalali_date(day_key)}")
+    return row[0]
+
+
+def _weekday_sales(cursor, first_day, last_day):
+    """{recipe_id: {weekday: quantity}} sold between two day keys."""
+    sales = {}
+    for recipe_id, weekday, quantity in cursor.execute("""
+        SELECT s.recipe_id, c.weekday, SUM(s.quantity)
+        FROM sales_daily_recipe s
+        JOIN jalali_calendar c ON c.day_key = CAST(replace(s.jalali_date, '/', '') AS INTEGER)
+        WHERE s.jalali_date BETWEEN ? AND ?
+        GROUP BY s.recipe_id, c.weekday
+    """, (jalali_calendar.to_jalali_date(first_day), jalali_calendar.to_jalali_date(last_day))):
+        sales.setdefault(recipe_id, {})[weekday] = quantity
+    return sales
+
+
+def recipe_forecast(cursor, today, days, window=MOVING_AVERAGE_DAYS, season_weeks=SEASON_WEEKS):
+    """{recipe_id: quantity} expected to sell in the days days after today.
+
+    The base rate is the average daily sales over the last window days; the
+    weekday factor is the recipe's average on that weekday over the last
+    season_weeks weeks divided by its overall daily average then.
+    """
+    yesterday = _days_before(cursor, today, 1)
+    base_sales = _weekday_sales(cursor, _days_before(cursor, today, window), yesterday)
+    season_sales = _weekday_sales(cursor, _days_before(cursor, today, season_weeks * 7), yesterday)
+
+    future_weekdays = {}
+    for (weekday,) in cursor.execute(
+            "SELECT weekday FROM jalali_calendar WHERE day_key > ? ORDER BY day_key LIMIT ?", (today, days)):
+        future_weekdays[weekday] = future_weekdays.get(weekday, 0) + 1
+
+    forecast = {}
+    for recipe_id, by_weekday in base_sales.items():
+        base_rate = sum(by_weekday.values()) / window
+        season = season_sales.get(recipe_id, {})
+        season_rate = sum(season.values()) / (season_weeks * 7)
+        expected = 0.0
+        for weekday, count in future_weekdays.items():
+            # Each weekday occurs season_weeks times in the season
+            factor = season.get(weekday, 0) / season_weeks / season_rate if season_rate else 1.0
+            expected += base_rate * factor * count
+        if expected > 0:
+            forecast[recipe_id] = expected
+    return forecast
+
+
+def purchase_list(cursor, forecast):
+    """Materials to buy for a recipe forecast.
+
+    Returns (name, needed, on_hand, reorder_level, to_buy, cost) rows where
+    to_buy keeps the reorder level in stock after the forecast is sold.
+    """
+    if not forecast:
+        return []
+    placeholders = ",".join("?" * len(forecast))
+    needed = {}
+    for recipe_id, material_id, grams in cursor.execute(f"""
+        SELECT recipe_id, material_id, quantity FROM recipe_details WHERE recipe_id IN ({placeholders})
+    """, tuple(forecast)):
+        needed[material_id] = needed.get(material_id, 0) + grams * forecast[recipe_id]
+
+    placeholders = ",".join("?" * len(needed))
+    rows = []
+    for material_id, name, price_per_gram, on_hand, reorder_level in cursor.execute(f"""
+        SELECT m.id, m.name, m.price_per_gram, COALESCE(s.quantity, 0), COALESCE(s.reorder_level, 0)
+        FROM materials m
+        LEFT JOIN material_stock s ON s.material_id = m.id
+        WHERE m.id IN ({placeholders})
+    """, tuple(needed)):
+        to_buy = max(0.0, needed[material_id] + reorder_level - on_hand)
+        rows.append((name, needed[material_id], on_hand, reorder_level, to_buy, to_buy * price_per_gram))
+    rows.sort(key=lambda row: row[5], reverse=True)
+    return rows
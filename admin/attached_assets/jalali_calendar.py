@@ -0,0 +1,149 @@
+"""Jalali calendar dimension table and integer day keys for reporting.
+
+Every day is keyed by the integer YYYYMMDD of its Jalali date, so a range of
+days is a range of integers and date filters on orders.day_key are index
+range scans. The jalali_calendar table holds one row per day with the week,
+month, quarter and fiscal year it belongs to and whether it is a holiday.
+
+Only the fixed solar holidays are filled in; lunar holidays move every year
+and are not precomputed.
+"""
+import jdatetime
+
+
+FIRST_YEAR = 1395
+LAST_YEAR = 1430
+
+FIXED_HOLIDAYS = {
+    (1, 1): "نوروز",
+    (1, 2): "نوروز",
+    (1, 3): "نوروز",
+    (1, 4): "نوروز",
+    (1, 12): "روز جمهوری اسلامی",
+    (1, 13): "روز طبیعت",
+    (3, 14): "رحلت امام خمینی",
+    (3, 15): "قیام ۱۵ خرداد",
+    (11, 22): "پیروزی انقلاب اسلامی",
+    (12, 29): "ملی شدن صنعت نفت",
+}
+# jdatetime numbers weekdays from Saturday
+FRIDAY = 6
+NOWRUZ_WEEK_DAYS = 7
+
+
+def day_key(jalali_date):
+    """Integer key of a YYYY/MM/DD Jalali date string or a jdatetime.date."""
+    if isinstance(jalali_date, str):
+        return int(jalali_date.replace("/", ""))
+    return jalali_date.year * 10000 + jalali_date.month * 100 + jalali_date.day
+
+
+def to_jalali_date(key):
+    """YYYY/MM/DD string of a day key."""
+    return f"{key // 10000:04d}/{key // 100 % 100:02d}/{key % 100:02d}"
+
+
+def create_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jalali_calendar (
+            day_key INTEGER PRIMARY KEY,
+            jalali_date TEXT NOT NULL,
+            gregorian_date TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            week_start INTEGER NOT NULL,
+            month_key INTEGER NOT NULL,
+            quarter_key INTEGER NOT NULL,
+            fiscal_year INTEGER NOT NULL,
+            is_holiday INTEGER NOT NULL DEFAULT 0,
+            holiday_name TEXT
+        )
+    """)
+    for column in ("week_start", "month_key", "quarter_key", "fiscal_year"):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_jalali_calendar_{column} ON jalali_calendar({column})")
+
+
+def _calendar_rows(first_year, last_year):
+    day = jdatetime.date(first_year, 1, 1)
+    end = jdatetime.date(last_year + 1, 1, 1)
+    while day < end:
+        weekday = day.weekday()
+        holiday_name = FIXED_HOLIDAYS.get((day.month, day.day))
+        yield (
+            day_key(day),
+            day.strftime("%Y/%m/%d"),
+            day.togregorian().isoformat(),
+            day.year,
+            day.month,
+            day.day,
+            weekday,
+            # Weeks start on Saturday and keep their key across month and year ends
+            day_key(day - jdatetime.timedelta(days=weekday)),
+            day.year * 100 + day.month,
+            day.year * 10 + (day.month - 1) // 3 + 1,
+            # The Iranian fiscal year follows the solar year
+            day.year,
+            1 if holiday_name or weekday == FRIDAY else 0,
+            holiday_name,
+        )
+        day += jdatetime.timedelta(days=1)
+
+
+def fill(cursor, first_year=FIRST_YEAR, last_year=LAST_YEAR):
+    """Add calendar rows for the given Jalali years, keeping existing ones."""
+    create_table(cursor)
+    cursor.executemany("""
+        INSERT OR IGNORE INTO jalali_calendar
+        (day_key, jalali_date, gregorian_date, year, month, day, weekday, week_start,
+         month_key, quarter_key, fiscal_year, is_holiday, holiday_name)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, _calendar_rows(first_year, last_year))
+
+
+def _range_of(cursor, column, value):
+    return cursor.execute(
+        f"SELECT MIN(day_key), MAX(day_key) FROM jalali_calendar WHERE {column} = ?", (value,)
+    ).fetchone()
+
+
+def _period_of(cursor, key, column):
+    row = cursor.execute(f"SELECT {column} FROM jalali_calendar WHERE day_key = ?", (key,)).fetchone()
+    if row is None:
+        raise ValueError(f"Day {to_jalali_date(key)} is outside the calendar table")
+    return _range_of(cursor, column, row[0])
+
+
+def _previous_period(cursor, key, column):
+    first, _ = _period_of(cursor, key, column)
+    day_before = cursor.execute(
+        "SELECT MAX(day_key) FROM jalali_calendar WHERE day_key < ?", (first,)
+    ).fetchone()[0]
+    if day_before is None:
+        raise ValueError(f"Day {to_jalali_date(first)} is the first in the calendar table")
+    return _period_of(cursor, day_before, column)
+
+
+def _nowruz_week(year):
+    return year * 10000 + 101, year * 10000 + 100 + NOWRUZ_WEEK_DAYS
+
+
+RANGE_PRESETS = [
+    ("روز", lambda cursor, key: (key, key)),
+    ("هفته", lambda cursor, key: _period_of(cursor, key, "week_start")),
+    ("هفته قبل", lambda cursor, key: _previous_period(cursor, key, "week_start")),
+    ("ماه", lambda cursor, key: _period_of(cursor, key, "month_key")),
+    ("ماه قبل", lambda cursor, key: _previous_period(cursor, key, "month_key")),
+    ("فصل", lambda cursor, key: _period_of(cursor, key, "quarter_key")),
+    ("فصل قبل", lambda cursor, key: _previous_period(cursor, key, "quarter_key")),
+    ("سال مالی", lambda cursor, key: _period_of(cursor, key, "fiscal_year")),
+    ("سال مالی قبل", lambda cursor, key: _previous_period(cursor, key, "fiscal_year")),
+    ("هفته نوروز", lambda cursor, key: _nowruz_week(key // 10000)),
+    ("هفته نوروز سال قبل", lambda cursor, key: _nowruz_week(key // 10000 - 1)),
+]
+
+
+def preset_range(cursor, index, key):
+    """(first_day_key, last_day_key) of RANGE_PRESETS[index] around the day key."""
+    return RANGE_PRESETS[index][1](cursor, key)
@@ -0,0 +1,43 @@
+"""Gross margin of sold items from the unit cost snapshotted on each order line.
+
+Costs come from order_items.unit_cost, fixed when the line was written, so a
+report on past sales does not change when material prices move.
+"""
+
+
+# Report grouping: (label column, GROUP BY expression)
+GROUPINGS = {
+    "recipe": ("COALESCE(r.name, '#' || oi.recipe_id)", "oi.recipe_id"),
+    "category": ("COALESCE(c.name, '-')", "r.category_id"),
+    "day": ("o.jalali_date", "o.day_key"),
+    "month": ("substr(o.jalali_date, 1, 7)", "o.day_key / 100"),
+}
+
+
+def margin_report(cursor, first_day, last_day, group_by="recipe"):
+    """Sales, cost and gross profit per group for a range of day keys.
+
+    Returns (label, quantity, revenue, cost, profit, margin_percent) rows,
+    most profitable first for items and categories and in date order for
+    days and months. Cancelled orders are left out.
+    """
+    label, key = GROUPINGS[group_by]
+    order = key if group_by in ("day", "month") else "profit DESC"
+    cursor.execute(f"""
+        SELECT {label},
+               SUM(oi.quantity),
+               SUM(oi.total_price),
+               SUM(oi.quantity * oi.unit_cost),
+               SUM(oi.total_price) - SUM(oi.quantity * oi.unit_cost) AS profit
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id
+        LEFT JOIN recipes r ON oi.recipe_id = r.id
+        LEFT JOIN categories c ON r.category_id = c.id
+        WHERE o.day_key BETWEEN ? AND ? AND o.order_status != 'cancelled'
+        GROUP BY {key}
+        ORDER BY {order}
+    """, (first_day, last_day))
+    return [
+        (name, quantity, revenue, cost, profit, profit * 100 / revenue if revenue else 0.0)
+        for name, quantity, revenue, cost, profit in cursor.fetchall()
+    ]
@@ -0,0 +1,162 @@
+"""Read-only JSON menu API for the storefront and the admin panel.
+
+    python menu_api.py --port 8766
+
+    GET /menu              menu by category (same document as peony.py export-menu)
+    GET /menu/{category}   one category of it
+    GET /prices            price list with every pricing step
+
+Responses are serialized and gzipped once per catalog version and kept in
+memory, with a strong ETag over their content, so a browser revalidating
+with If-None-Match gets a 304 without the body. The catalog version comes
+from the trigger-maintained table_versions counters and is checked at most
+once per CHECK_INTERVAL, and only when PRAGMA data_version shows that
+another connection wrote to the database at all.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+import catalog
+import db_schema
+import order_service
+
+
+DB_PATH = "coffee_shop.db"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8766
+# Longest time a catalog change can go unnoticed (seconds)
+CHECK_INTERVAL = 1.0
+
+
+class Payload:
+    """One pre-serialized response body in plain and gzip form."""
+
+    def __init__(self, document):
+        self.body = json.dumps(document, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.gzip_body = gzip.compress(self.body, mtime=0)
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+
+
+class MenuPayloads:
+    """Response payloads by path, rebuilt when the catalog version changes."""
+
+    def __init__(self, db_path=DB_PATH):
+        conn = order_service.connect(db_path)
+        db_schema.migrate(conn)
+        conn.close()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.payloads = None
+        self.version = None
+        self.data_version = None
+        self.checked_at = 0.0
+
+    def _current(self):
+        """Rebuild the payloads if the catalog changed since the last check."""
+        now = time.monotonic()
+        if self.payloads is not None and now - self.checked_at < CHECK_INTERVAL:
+            return self.payloads
+        self.checked_at = now
+        cursor = self.conn.cursor()
+        data_version = cursor.execute("PRAGMA data_version").fetchone()[0]
+        if self.payloads is not None and data_version == self.data_version:
+            return self.payloads
+        self.data_version = data_version
+        version = catalog.catalog_version(cursor)
+        if self.payloads is not None and version == self.version:
+            return self.payloads
+
+        menu = catalog.menu_document(cursor)
+        payloads = {"/menu": Payload(menu), "/prices": Payload(catalog.price_list_document(cursor))}
+        for category in menu["categories"]:
+            payloads[f"/menu/{category['name']}"] = Payload(category)
+        self.payloads = payloads
+        self.version = version
+        return payloads
+
+    def get(self, path):
+        """The Payload for a request path, or None."""
+        with self.lock:
+            return self._current().get(path.rstrip("/") or path)
+
+
+class MenuRequestHandler(BaseHTTPRequestHandler):
+    server_version = "PeonyMenu/1.0"
+    # Keep-alive, so a refreshing storefront reuses its connection
+    protocol_version = "HTTP/1.1"
+    payloads = None
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _respond(self, send_body):
+        payload = self.payloads.get(unquote(urlsplit(self.path).path))
+        if payload is None:
+            self.send_error(404)
+            return
+        use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        etag = payload.gzip_etag if use_gzip else payload.etag
+        if_none_match = self.headers.get("If-None-Match", "")
+        if if_none_match.strip() == "*" or payload.etag in if_none_match or payload.gzip_etag in if_none_match:
+            self.send_response(304)
+            self._common_headers(etag)
+            self.end_headers()
+            return
+
+        body = payload.gzip_body if use_gzip else payload.body
+        self.send_response(200)
+        self._common_headers(etag)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _common_headers(self, etag):
+        self.send_header("ETag", etag)
+        # Always revalidate; an unchanged menu costs a 304 and no body
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Access-Control-Allow-Origin", "*")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(db_path=DB_PATH, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    handler = type("Handler", (MenuRequestHandler,), {"payloads": MenuPayloads(db_path)})
+    server = ThreadingHTTPServer((host, port), handler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peony Cafe menu API")
+    parser.add_argument("--db", default=DB_PATH, help="path to coffee_shop.db")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    try:
+        serve(args.db, args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
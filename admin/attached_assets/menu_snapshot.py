@@ -0,0 +1,98 @@
+"""Static menu files for the storefront, named by their content hash.
+
+    python peony.py snapshot-menu [--out ../../user/static/menu]
+
+Each category is written to menu-<hash>.json and each recipe photo to a
+thumbnail images/<hash>.jpg; index.json lists the category files and is
+the only file whose name stays the same. A file whose name already exists
+has the same content, so after a price change only the changed categories
+are written, and the storefront can cache every hashed file forever and
+revalidate only the index. Files the new index no longer refers to are
+removed.
+"""
+import hashlib
+import json
+import os
+
+from PIL import Image
+
+import catalog
+
+
+SNAPSHOT_DIR = os.path.join("..", "..", "user", "static", "menu")
+IMAGE_DIR = "recipe_images"
+THUMBNAIL_SIZE = 400
+HASH_LENGTH = 16
+
+
+def _hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def _write_new(path, data):
+    """Write data to path unless it exists; returns True if written."""
+    if os.path.exists(path):
+        return False
+    with open(path + ".partial", "wb") as f:
+        f.write(data)
+    os.replace(path + ".partial", path)
+    return True
+
+
+def _thumbnail(source_path, images_dir, written):
+    """File name of the recipe photo's thumbnail, made on first use."""
+    with open(source_path, "rb") as f:
+        source = f.read()
+    name = f"{_hash(source + str(THUMBNAIL_SIZE).encode())}.jpg"
+    path = os.path.join(images_dir, name)
+    if not os.path.exists(path):
+        image = Image.open(source_path).convert("RGB")
+        image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        image.save(path + ".partial", "JPEG", quality=85, optimize=True)
+        os.replace(path + ".partial", path)
+        written.append(f"images/{name}")
+    return name
+
+
+def write_snapshot(cursor, out_dir=SNAPSHOT_DIR, image_dir=IMAGE_DIR):
+    """Write the current menu to out_dir; returns (written, removed) file names."""
+    images_dir = os.path.join(out_dir, "images")
+    os.makedirs(images_dir, exist_ok=True)
+    written = []
+    categories = []
+    images = set()
+    for category in catalog.menu_document(cursor)["categories"]:
+        for item in category["items"]:
+            source_path = os.path.join(image_dir, f"recipe-{item['id']}.jpg")
+            if os.path.exists(source_path):
+                item["image"] = f"images/{_thumbnail(source_path, images_dir, written)}"
+                images.add(item["image"][len("images/"):])
+        data = json.dumps(category, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        name = f"menu-{_hash(data)}.json"
+        if _write_new(os.path.join(out_dir, name), data):
+            written.append(name)
+        categories.append({"name": category["name"], "file": name, "items": len(category["items"])})
+
+    index = json.dumps({"categories": categories}, ensure_ascii=False, indent=2).encode("utf-8")
+    index_path = os.path.join(out_dir, "index.json")
+    old_index = None
+    if os.path.exists(index_path):
+        with open(index_path, "rb") as f:
+            old_index = f.read()
+    if old_index != index:
+        with open(index_path + ".partial", "wb") as f:
+            f.write(index)
+        os.replace(index_path + ".partial", index_path)
+        written.append("index.json")
+
+    removed = []
+    files = {category["file"] for category in categories}
+    for name in os.listdir(out_dir):
+        if name.startswith("menu-") and name.endswith(".json") and name not in files:
+            os.remove(os.path.join(out_dir, name))
+            removed.append(name)
+    for name in os.listdir(images_dir):
+        if name not in images:
+            os.remove(os.path.join(images_dir, name))
+            removed.append(f"images/{name}")
+    return written, removed
@@ -0,0 +1,189 @@
+"""Append-only order journal with group commit and crash recovery.
+
+Orders are written to the journal and fsynced before they are acknowledged,
+then applied to SQLite in groups. Each record on disk is
+
+    <uint32 length> <uint32 crc32> <JSON payload>
+
+The offset up to which records have been applied is stored in the database
+in the same transaction that applies them, so after a crash every record past
+that offset is replayed exactly once.
+
+Only one process may use a journal: each keeps its own end offset and
+pending records, and two of them would overwrite each other's applied
+offset. recover() takes an exclusive lock on <journal>.lock and raises
+JournalInUse when another process holds it.
+"""
+import json
+import os
+import struct
+import zlib
+
+
+HEADER = struct.Struct("<II")
+# Truncate the journal once everything is applied and it is larger than this
+COMPACT_SIZE = 1024 * 1024
+
+
+class JournalInUse(RuntimeError):
+    pass
+
+
+def _lock(file):
+    """Take a non-blocking exclusive lock on file; raises OSError when it is held elsewhere."""
+    if os.name == "nt":
+        import msvcrt
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def ensure_journal_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS journal_state (
+            journal TEXT PRIMARY KEY,
+            applied_offset INTEGER NOT NULL
+        )
+    """)
+
+
+def _scan(data):
+    """(end_offset, record) of every intact record in data, and the end of the last one."""
+    records = []
+    position = 0
+    while position + HEADER.size <= len(data):
+        length, checksum = HEADER.unpack_from(data, position)
+        start = position + HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+        position = start + length
+        records.append((position, json.loads(payload)))
+    return records, position
+
+
+def journal_end(path):
+    """Offset just past the last intact record of the journal at path; 0 when there is none."""
+    try:
+        with open(path, "rb") as f:
+            return _scan(f.read())[1]
+    except FileNotFoundError:
+        return 0
+
+
+class OrderJournal:
+    """Durable queue of orders waiting to be applied to the database."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.file = None
+        self.lock_file = None
+        self.size = 0
+        # (end_offset, record) pairs not yet applied to the database
+        self.pending = []
+
+    def recover(self, conn):
+        """Open the journal and load every record the database has not seen.
+
+        A torn record at the end (from a crash in the middle of a write) is
+        cut off so new records are appended after the last good one.
+        """
+        self.lock_file = open(self.path + ".lock", "a+b")
+        try:
+            _lock(self.lock_file)
+        except OSError:
+            self.lock_file.close()
+            self.lock_file = None
+            raise JournalInUse(f"{self.path} is in use by another process")
+
+        cursor = conn.cursor()
+        ensure_journal_table(cursor)
+        conn.commit()
+        row = cursor.execute(
+            "SELECT applied_offset FROM journal_state WHERE journal = ?", (self.name,)
+        ).fetchone()
+        applied_offset = row[0] if row else 0
+
+        self.file = open(self.path, "a+b")
+        self.file.seek(0)
+        data = self.file.read()
+        records, good_end = _scan(data)
+
+        if good_end < len(data):
+            self.file.truncate(good_end)
+            self._sync()
+        self.size = good_end
+
+        if applied_offset > self.size:
+            # The journal was compacted but the offset reset did not commit
+            applied_offset = 0
+            self._store_offset(conn, 0)
+
+        self.pending = [(end, record) for end, record in records if end > applied_offset]
+        return [record for _, record in self.pending]
+
+    def append(self, records):
+        """Append records and fsync once for the whole group."""
+        chunks = []
+        for record in records:
+            payload = json.dumps(record, ensure_ascii=False).encode("utf-8")
+            chunks.append(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self.size += len(chunks[-1])
+            self.pending.append((self.size, record))
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(b"".join(chunks))
+        self._sync()
+
+    def pending_records(self):
+        return [record for _, record in self.pending]
+
+    def pending_end(self):
+        """Offset just past the last pending record, or None if nothing is pending."""
+        return self.pending[-1][0] if self.pending else None
+
+    def mark_applied(self, cursor, offset):
+        """Record the applied offset inside the caller's open transaction."""
+        cursor.execute("""
+            INSERT INTO journal_state (journal, applied_offset) VALUES (?, ?)
+            ON CONFLICT(journal) DO UPDATE SET applied_offset = excluded.applied_offset
+        """, (self.name, offset))
+
+    def applied(self, offset):
+        """Forget pending records up to offset once their transaction committed."""
+        self.pending = [(end, record) for end, record in self.pending if end > offset]
+
+    def reject(self, record, error):
+        """Keep a record the database refused in a side file instead of dropping it."""
+        with open(self.path + ".rejected", "a", encoding="utf-8") as rejected:
+            rejected.write(json.dumps({"error": error, "order": record}, ensure_ascii=False) + "\n")
+
+    def compact(self, conn):
+        """Empty the journal when everything in it has been applied."""
+        if self.pending or self.size < COMPACT_SIZE:
+            return
+        # Truncate first: a crash before the offset reset is detected on recover
+        self.file.truncate(0)
+        self._sync()
+        self.size = 0
+        self._store_offset(conn, 0)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+        if self.lock_file:
+            # Closing the file releases the lock
+            self.lock_file.close()
+            self.lock_file = None
+
+    def _store_offset(self, conn, offset):
+        cursor = conn.cursor()
+        self.mark_applied(cursor, offset)
+        conn.commit()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
@@ -0,0 +1,606 @@
+"""Single-writer order service for running several tills on one coffee_shop.db.
+
+Tills send orders as newline-delimited JSON over a Unix socket or a localhost
+TCP port. The service appends each batch to the order journal with a single
+fsync, answers every till with its allocated receipt number, and then writes
+the batch to SQLite in one transaction.
+
+Run it next to the database:
+
+    python order_service.py --port 8765
+    python order_service.py --unix /tmp/peony_orders.sock
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import jdatetime
+
+import db_schema
+import db_watch
+import jalali_calendar
+import rollups
+import stock
+from order_journal import JournalInUse, OrderJournal, ensure_journal_table, journal_end
+
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "coffee_shop.db"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Largest number of orders written in one transaction
+MAX_BATCH = 64
+# How long the writer waits for more orders before committing a batch (seconds)
+BATCH_LINGER = 0.005
+# How long a connection waits for another writer before giving up (seconds)
+BUSY_TIMEOUT = 30
+
+# Kitchen/bar progress of an order; the last two are final
+ORDER_STATUSES = ("pending", "preparing", "ready", "served", "cancelled")
+LIVE_ORDER_STATUSES = ("pending", "preparing", "ready")
+PAYMENT_STATUSES = ("pending", "paid")
+
+
+def connect(path=DB_PATH):
+    """Open a connection suitable for writing orders."""
+    conn = db_watch.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def default_journal_path(db_path=DB_PATH, owner=None):
+    """Journal file kept next to the database, one per till machine or service."""
+    directory = os.path.dirname(os.path.abspath(db_path))
+    return os.path.join(directory, f"orders-{owner or socket.gethostname()}.journal")
+
+
+def skip_journaled_orders(conn, db_path=DB_PATH):
+    """Mark every order journal next to the database as applied up to its last record.
+
+    A restored database carries the applied offsets of the backup, so
+    recovery would replay every order journaled since the backup was taken
+    and bring back, with their stock and rollups, the orders the restore
+    removed.
+    """
+    directory = os.path.dirname(os.path.abspath(db_path))
+    journals = [name for name in os.listdir(directory) if name.startswith("orders-") and name.endswith(".journal")]
+    cursor = conn.cursor()
+    ensure_journal_table(cursor)
+    cursor.executemany("""
+        INSERT INTO journal_state (journal, applied_offset) VALUES (?, ?)
+        ON CONFLICT(journal) DO UPDATE SET applied_offset = excluded.applied_offset
+    """, [(name, journal_end(os.path.join(directory, name))) for name in journals])
+    conn.commit()
+
+
+def allocate_receipt_number(cursor, now, preferred=None, reserved=()):
+    """Return a receipt number that is not used yet.
+
+    The till's proposed number is kept when it is free; otherwise the number
+    is derived from the Jalali date and time with a sequence suffix.
+    Numbers in reserved (accepted but not yet applied) count as used.
+    """
+    base = preferred or jdatetime.datetime.fromgregorian(datetime=now).strftime("%Y%m%d-%H%M%S")
+    candidate = base
+    suffix = 1
+    while candidate in reserved or cursor.execute(
+            "SELECT 1 FROM orders WHERE receipt_number = ?", (candidate,)).fetchone():
+        suffix += 1
+        candidate = f"{base}-{suffix}"
+    return candidate
+
+
+def resolve_lines(cursor, lines):
+    """Return order lines with a recipe_id each.
+
+    Lines normally carry the recipe ID from the till; lines that only carry a
+    name are resolved here. Raises ValueError for unknown recipes.
+    """
+    resolved = []
+    for line in lines:
+        line = dict(line)
+        if line.get("recipe_id") is None:
+            row = cursor.execute("SELECT id FROM recipes WHERE name = ?", (line["name"],)).fetchone()
+            if row is None:
+                raise ValueError(f"Unknown recipe: {line['name']}")
+            line["recipe_id"] = row[0]
+        if int(line["quantity"]) <= 0:
+            raise ValueError(f"Invalid quantity for {line.get('name', line['recipe_id'])}")
+        int(line["unit_price"])
+        resolved.append(line)
+
+    recipe_ids = {line["recipe_id"] for line in resolved}
+    placeholders = ",".join("?" * len(recipe_ids))
+    known = {row[0] for row in cursor.execute(
+        f"SELECT id FROM recipes WHERE id IN ({placeholders})", tuple(recipe_ids))}
+    for line in resolved:
+        if line["recipe_id"] not in known:
+            raise ValueError(f"Unknown recipe: {line.get('name', line['recipe_id'])}")
+    return resolved
+
+
+def _find_order(cursor, receipt_number, reserved=()):
+    """Return (id, payment_status) of an order by receipt number.
+
+    Orders accepted but not yet applied exist only in reserved; they are
+    reported with id None and an open payment.
+    """
+    row = cursor.execute(
+        "SELECT id, payment_status FROM orders WHERE receipt_number = ?", (receipt_number,)
+    ).fetchone()
+    if row is None and receipt_number in reserved:
+        return (None, "pending")
+    if row is None:
+        raise ValueError(f"Unknown order: {receipt_number}")
+    return row
+
+
+def stamp_order(cursor, order, reserved=()):
+    """Validate an order record and fix its sale time and receipt number.
+
+    Records are new orders (the default), lines appended to an open ticket,
+    which may settle it in the same write, or status changes. Raises ValueError for records that could never be
+    written.
+    """
+    record_type = order.get("type", "order")
+    now = datetime.now()
+    jalali_datetime = jdatetime.datetime.fromgregorian(datetime=now)
+    stamp = {
+        "type": record_type,
+        "order_date": now.strftime("%Y-%m-%d %H:%M:%S"),
+        "jalali_date": jalali_datetime.strftime("%Y/%m/%d"),
+        "jalali_time": jalali_datetime.strftime("%H:%M:%S"),
+    }
+
+    if record_type == "order":
+        lines = order.get("lines") or []
+        if not lines:
+            raise ValueError("Order has no items")
+        payment_status = order.get("payment_status", "paid")
+        if payment_status not in PAYMENT_STATUSES:
+            raise ValueError(f"Invalid payment status: {payment_status}")
+        table_number = order.get("table_number")
+        stamp.update({
+            "receipt_number": allocate_receipt_number(cursor, now, order.get("receipt_number"), reserved),
+            "table_number": int(table_number) if table_number else None,
+            "payment_status": payment_status,
+            "lines": resolve_lines(cursor, lines),
+        })
+    elif record_type == "append":
+        lines = order.get("lines") or []
+        if not lines:
+            raise ValueError("Nothing to append")
+        _, payment_status = _find_order(cursor, order["receipt_number"], reserved)
+        if payment_status != "pending":
+            raise ValueError(f"Order {order['receipt_number']} is already settled")
+        payment_status = order.get("payment_status")
+        if payment_status is not None and payment_status not in PAYMENT_STATUSES:
+            raise ValueError(f"Invalid payment status: {payment_status}")
+        stamp.update({
+            "receipt_number": order["receipt_number"],
+            "payment_status": payment_status,
+            "lines": resolve_lines(cursor, lines),
+        })
+    elif record_type == "status":
+        _find_order(cursor, order["receipt_number"], reserved)
+        order_status = order.get("order_status")
+        payment_status = order.get("payment_status")
+        if order_status is None and payment_status is None:
+            raise ValueError("Nothing to change")
+        if order_status is not None and order_status not in ORDER_STATUSES:
+            raise ValueError(f"Invalid order status: {order_status}")
+        if payment_status is not None and payment_status not in PAYMENT_STATUSES:
+            raise ValueError(f"Invalid payment status: {payment_status}")
+        stamp.update({
+            "receipt_number": order["receipt_number"],
+            "order_status": order_status,
+            "payment_status": payment_status,
+        })
+    else:
+        raise ValueError(f"Unknown record type: {record_type}")
+    return stamp
+
+
+def recipe_costs(cursor, recipe_ids):
+    """Raw material cost of one unit of each recipe at current material prices."""
+    recipe_ids = tuple(set(recipe_ids))
+    placeholders = ",".join("?" * len(recipe_ids))
+    return dict(cursor.execute(f"""
+        SELECT rd.recipe_id, SUM(rd.quantity * m.price_per_gram)
+        FROM recipe_details rd
+        JOIN materials m ON rd.material_id = m.id
+        WHERE rd.recipe_id IN ({placeholders})
+        GROUP BY rd.recipe_id
+    """, recipe_ids))
+
+
+def _resolved_line_rows(cursor, order):
+    """(recipe_id, quantity, unit_price, total_price, unit_cost) rows of a record.
+
+    The unit cost is snapshotted when the line is written, so margins on past
+    sales do not move with later material prices.
+    """
+    lines = []
+    for line in order["lines"]:
+        if line.get("recipe_id") is None:
+            # Records journaled before lines carried recipe IDs
+            line = resolve_lines(cursor, [line])[0]
+        quantity = int(line["quantity"])
+        unit_price = int(line["unit_price"])
+        lines.append((line["recipe_id"], quantity, unit_price, unit_price * quantity))
+    costs = recipe_costs(cursor, [line[0] for line in lines])
+    return [line + (round(costs.get(line[0]) or 0),) for line in lines]
+
+
+def _insert_lines(cursor, order_id, lines):
+    cursor.executemany("""
+        INSERT INTO order_items
+        (order_id, recipe_id, quantity, unit_price, total_price, unit_cost)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(order_id,) + line for line in lines])
+
+
+def _insert_order(cursor, order):
+    if "order_date" not in order:
+        order = stamp_order(cursor, order)
+    lines = _resolved_line_rows(cursor, order)
+
+    # Another till may have taken the number since the order was accepted
+    now = datetime.strptime(order["order_date"], "%Y-%m-%d %H:%M:%S")
+    receipt_number = allocate_receipt_number(cursor, now, order["receipt_number"])
+    total = sum(line[3] for line in lines)
+    cursor.execute("""
+        INSERT INTO orders
+        (receipt_number, table_number, order_date, jalali_date, day_key, jalali_time, total_amount,
+         payment_status, order_status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending')
+    """, (receipt_number, order.get("table_number"), order["order_date"], order["jalali_date"],
+          jalali_calendar.day_key(order["jalali_date"]), order["jalali_time"], total,
+          order.get("payment_status", "paid")))
+    order_id = cursor.lastrowid
+    _insert_lines(cursor, order_id, lines)
+    rollups.record_lines(cursor, order["jalali_date"], order["jalali_time"],
+                         [(recipe_id, quantity, total_price) for recipe_id, quantity, _, total_price, _ in lines], 1)
+    touched = stock.consume_lines(cursor, order_id, jalali_calendar.day_key(order["jalali_date"]),
+                                  [(recipe_id, quantity) for recipe_id, quantity, _, _, _ in lines])
+
+    return {
+        "ok": True,
+        "order_id": order_id,
+        "receipt_number": receipt_number,
+        "jalali_date": order["jalali_date"],
+        "jalali_time": order["jalali_time"],
+        "total": total,
+        "low_stock": stock.low_stock(cursor, touched),
+    }
+
+
+def _append_to_order(cursor, record):
+    order_id, _ = _find_order(cursor, record["receipt_number"])
+    lines = _resolved_line_rows(cursor, record)
+    _insert_lines(cursor, order_id, lines)
+    # Appended lines count towards the day the ticket was opened
+    jalali_date, jalali_time, order_status = cursor.execute(
+        "SELECT jalali_date, jalali_time, order_status FROM orders WHERE id = ?", (order_id,)
+    ).fetchone()
+    touched = []
+    if order_status != "cancelled":
+        rollups.record_lines(cursor, jalali_date, jalali_time,
+                             [(recipe_id, quantity, total_price) for recipe_id, quantity, _, total_price, _ in lines])
+        touched = stock.consume_lines(cursor, order_id, jalali_calendar.day_key(record["jalali_date"]),
+                                      [(recipe_id, quantity) for recipe_id, quantity, _, _, _ in lines])
+    added = sum(line[3] for line in lines)
+    # New lines send the ticket back to the kitchen queue, and may settle it
+    cursor.execute("""
+        UPDATE orders
+        SET total_amount = total_amount + ?, order_status = 'pending',
+            payment_status = COALESCE(?, payment_status)
+        WHERE id = ?
+    """, (added, record.get("payment_status"), order_id))
+    total = cursor.execute("SELECT total_amount FROM orders WHERE id = ?", (order_id,)).fetchone()[0]
+    return {
+        "ok": True,
+        "order_id": order_id,
+        "receipt_number": record["receipt_number"],
+        "jalali_date": record["jalali_date"],
+        "jalali_time": record["jalali_time"],
+        "total": total,
+        "low_stock": stock.low_stock(cursor, touched),
+    }
+
+
+def _update_status(cursor, record):
+    order_id, _ = _find_order(cursor, record["receipt_number"])
+    previous_status = cursor.execute("SELECT order_status FROM orders WHERE id = ?", (order_id,)).fetchone()[0]
+    new_status = record.get("order_status") or previous_status
+    if (previous_status == "cancelled") != (new_status == "cancelled"):
+        rollups.record_order(cursor, order_id, -1 if new_status == "cancelled" else 1)
+        # Cancelling puts the materials back; reopening takes them again
+        stock.record_order(cursor, order_id, jalali_calendar.day_key(record["jalali_date"]),
+                           1 if new_status == "cancelled" else -1)
+    cursor.execute("""
+        UPDATE orders
+        SET order_status = COALESCE(?, order_status), payment_status = COALESCE(?, payment_status)
+        WHERE id = ?
+    """, (record.get("order_status"), record.get("payment_status"), order_id))
+    return {"ok": True, "order_id": order_id, "receipt_number": record["receipt_number"]}
+
+
+RECORD_WRITERS = {
+    "order": _insert_order,
+    "append": _append_to_order,
+    "status": _update_status,
+}
+
+
+def write_orders(conn, orders, journal=None, journal_offset=None):
+    """Write a batch of order records in one transaction.
+
+    Each record gets its own savepoint, so a bad record is rejected without
+    affecting the rest of the batch. When the records come from a journal,
+    its applied offset is advanced in the same transaction.
+    Returns one result dict per record.
+    """
+    cursor = conn.cursor()
+    results = []
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        for order in orders:
+            cursor.execute("SAVEPOINT order_write")
+            try:
+                writer = RECORD_WRITERS.get(order.get("type", "order"))
+                if writer is None:
+                    raise ValueError(f"Unknown record type: {order.get('type')}")
+                results.append(writer(cursor, order))
+                cursor.execute("RELEASE order_write")
+            except (ValueError, KeyError, TypeError, sqlite3.IntegrityError) as e:
+                cursor.execute("ROLLBACK TO order_write")
+                cursor.execute("RELEASE order_write")
+                results.append({"ok": False, "error": str(e)})
+        if journal is not None:
+            journal.mark_applied(cursor, journal_offset)
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    return results
+
+
+def accept_orders(conn, journal, orders):
+    """Validate, stamp and durably journal order records before they reach SQLite.
+
+    All accepted records share one fsync. Returns one acknowledgement per
+    record; the receipt numbers in it are final unless another till took
+    the same number first.
+    """
+    cursor = conn.cursor()
+    reserved = {record["receipt_number"] for record in journal.pending_records()
+                if record.get("type", "order") == "order"}
+    results = []
+    accepted = []
+    for order in orders:
+        try:
+            stamped = stamp_order(cursor, order, reserved)
+        except (ValueError, KeyError, TypeError) as e:
+            results.append({"ok": False, "error": str(e)})
+            continue
+        if stamped["type"] == "order":
+            reserved.add(stamped["receipt_number"])
+        accepted.append(stamped)
+        results.append({
+            "ok": True,
+            "receipt_number": stamped["receipt_number"],
+            "jalali_date": stamped["jalali_date"],
+            "jalali_time": stamped["jalali_time"],
+            "total": sum(int(line["unit_price"]) * int(line["quantity"])
+                         for line in stamped.get("lines", [])),
+        })
+    if accepted:
+        journal.append(accepted)
+    return results
+
+
+def live_orders(cursor):
+    """Return (id, receipt_number, table_number, jalali_time, order_status) of the kitchen queue.
+
+    The WHERE clause matches idx_orders_live, so the query reads only live
+    orders however long the order history is.
+    """
+    cursor.execute("""
+        SELECT id, receipt_number, table_number, jalali_time, order_status
+        FROM orders
+        WHERE order_status IN ('pending', 'preparing', 'ready')
+        ORDER BY id
+    """)
+    return cursor.fetchall()
+
+
+def open_tickets(cursor):
+    """Return (receipt_number, table_number, jalali_time, total_amount) of unsettled orders."""
+    cursor.execute("""
+        SELECT receipt_number, table_number, jalali_time, total_amount
+        FROM orders
+        WHERE payment_status = 'pending' AND order_status != 'cancelled'
+        ORDER BY table_number, id
+    """)
+    return cursor.fetchall()
+
+
+def apply_journal(conn, journal):
+    """Apply every pending journal record to the database in one transaction."""
+    offset = journal.pending_end()
+    if offset is None:
+        return []
+    records = journal.pending_records()
+    results = write_orders(conn, records, journal, offset)
+    journal.applied(offset)
+    for record, result in zip(records, results):
+        if not result["ok"]:
+            journal.reject(record, result["error"])
+    journal.compact(conn)
+    return results
+
+
+def recover_orders(conn, journal):
+    """Replay orders that were journaled but never reached the database."""
+    journal.recover(conn)
+    return apply_journal(conn, journal)
+
+
+class OrderService:
+    """Accept orders from many tills and write them through one connection."""
+
+    def __init__(self, db_path=DB_PATH, journal_path=None):
+        self.db_path = db_path
+        self.queue = asyncio.Queue()
+        # All SQLite and journal work happens on this single thread
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.conn = None
+        self.journal = OrderJournal(journal_path or default_journal_path(db_path, "service"))
+
+    def _open(self):
+        self.conn = connect(self.db_path)
+        db_schema.migrate(self.conn)
+        recover_orders(self.conn, self.journal)
+
+    async def writer(self):
+        """Journal each batch with one fsync, acknowledge it, then apply it."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            await asyncio.sleep(BATCH_LINGER)
+            while len(batch) < MAX_BATCH and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            orders = [order for order, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, accept_orders, self.conn, self.journal, orders)
+            except Exception as e:
+                results = [{"ok": False, "error": str(e)}] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+            try:
+                await loop.run_in_executor(self.executor, apply_journal, self.conn, self.journal)
+            except sqlite3.Error as e:
+                # Records stay in the journal and are retried with the next batch
+                logger.warning("Applying journaled orders failed: %s", e)
+
+    async def submit(self, order):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((order, future))
+        return await future
+
+    async def handle_client(self, reader, writer):
+        """Serve one till connection; each line is one JSON request."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if request.get("op") == "ping":
+                        response = {"ok": True}
+                    elif request.get("op") == "submit":
+                        response = await self.submit(request["order"])
+                    else:
+                        response = {"ok": False, "error": f"Unknown op: {request.get('op')}"}
+                except (ValueError, KeyError) as e:
+                    response = {"ok": False, "error": str(e)}
+                writer.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+        # Opened before listening, so a journal in use stops the service instead of its writer
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._open)
+        writer_task = asyncio.create_task(self.writer())
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_client, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                writer_task.cancel()
+
+
+def parse_address(address):
+    """Split an address like 'unix:/tmp/x.sock' or '127.0.0.1:8765'."""
+    if address.startswith("unix:"):
+        return ("unix", address[len("unix:"):])
+    host, _, port = address.rpartition(":")
+    return ("tcp", (host or DEFAULT_HOST, int(port)))
+
+
+class ServiceUnreachable(OSError):
+    """The order service could not be connected to, so nothing was sent."""
+
+
+def submit_order(address, order, timeout=10):
+    """Send one order to the service and return its acknowledgement.
+
+    Raises ServiceUnreachable when the service cannot be connected to. Any
+    other OSError comes after the order was sent, when it may or may not
+    have been saved, so it must not be written again elsewhere.
+    """
+    kind, target = parse_address(address)
+    try:
+        if kind == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(timeout)
+                sock.connect(target)
+            except OSError:
+                sock.close()
+                raise
+        else:
+            sock = socket.create_connection(target, timeout=timeout)
+    except OSError as e:
+        raise ServiceUnreachable(f"Order service at {address} is unreachable: {e}") from e
+    with sock:
+        request = {"op": "submit", "order": order}
+        sock.sendall(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as stream:
+            line = stream.readline()
+    if not line:
+        raise ConnectionError("Order service closed the connection")
+    return json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peony Cafe order service")
+    parser.add_argument("--db", default=DB_PATH, help="path to coffee_shop.db")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--journal", help="path of the order journal file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    service = OrderService(args.db, args.journal)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except JournalInUse as e:
+        sys.exit(f"order_service: {e}; is another order service running?")
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
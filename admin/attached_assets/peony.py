@@ -0,0 +1,148 @@
+"""Command line interface to the Peony Cafe catalog and reports; needs no display.
+
+    python peony.py prices [--json]
+    python peony.py report --from 1403/01/01 --to 1403/12/29 [--json]
+    python peony.py export-menu [-o menu.json]
+    python peony.py snapshot-menu [--out ../../user/static/menu]
+
+--db before the command points at another coffee_shop.db. Every command only
+reads it: the database is opened read-only and never migrated here, so a
+database the till or the order service has not upgraded yet is refused.
+"""
+import argparse
+import json
+import pathlib
+import re
+import sqlite3
+import sys
+
+import catalog
+import db_schema
+import jalali_calendar
+import reports
+
+
+DB_PATH = "coffee_shop.db"
+JALALI_DATE = re.compile(r"^\d{4}/\d{2}/\d{2}$")
+
+
+def _open(db_path):
+    """Read-only connection to an up-to-date database; exits with a message otherwise."""
+    path = pathlib.Path(db_path).resolve()
+    if not path.is_file():
+        sys.exit(f"peony: {db_path} does not exist")
+    try:
+        conn = sqlite3.connect(f"{path.as_uri()}?mode=ro", uri=True)
+        version = db_schema.stored_version(conn.cursor())
+    except sqlite3.Error as e:
+        sys.exit(f"peony: cannot read {db_path}: {e}")
+    if version < db_schema.LATEST_VERSION:
+        conn.close()
+        sys.exit(f"peony: {db_path} has schema version {version}, {db_schema.LATEST_VERSION} is needed; "
+                 "start the till or the order service once to upgrade it")
+    return conn
+
+
+def _print_json(data, out=sys.stdout):
+    json.dump(data, out, ensure_ascii=False, indent=2)
+    out.write("\n")
+
+
+def _day(value):
+    if not JALALI_DATE.match(value):
+        raise argparse.ArgumentTypeError(f"expected a Jalali date like 1403/01/01, got {value}")
+    return jalali_calendar.day_key(value)
+
+
+def prices(args):
+    conn = _open(args.db)
+    if args.json:
+        _print_json(catalog.price_list_document(conn.cursor()))
+        conn.close()
+        return
+    rows = catalog.price_list(conn.cursor())
+    conn.close()
+    for name, category, raw_price, secondary_price, final_price, factor in rows:
+        print(f"{name}\t{category}\t{raw_price:,}\t{secondary_price:,}\t{final_price:,}\t{factor}")
+
+
+def report(args):
+    conn = _open(args.db)
+    periods, recipes = reports.sales_summary(conn.cursor(), args.first_day, args.last_day)
+    conn.close()
+    first = jalali_calendar.to_jalali_date(args.first_day)
+    last = jalali_calendar.to_jalali_date(args.last_day)
+    total_orders = sum(period[1] for period in periods)
+    total_revenue = sum(period[3] for period in periods)
+    if args.json:
+        _print_json({
+            "from": first, "to": last, "orders": total_orders, "revenue": total_revenue,
+            "periods": [{"period": period, "orders": order_count, "items": item_count, "revenue": revenue}
+                        for period, order_count, item_count, revenue in periods],
+            "recipes": [{"name": name, "quantity": quantity, "revenue": revenue}
+                        for name, quantity, revenue in recipes],
+        })
+        return
+    print(f"{first} - {last}: {total_orders:,} orders, {total_revenue:,} revenue")
+    for period, order_count, item_count, revenue in periods:
+        print(f"{period}\t{order_count:,}\t{item_count:,}\t{revenue:,}")
+    print()
+    for name, quantity, revenue in recipes:
+        print(f"{name}\t{quantity:,}\t{revenue:,}")
+
+
+def export_menu(args):
+    conn = _open(args.db)
+    document = catalog.menu_document(conn.cursor())
+    conn.close()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            _print_json(document, f)
+    else:
+        _print_json(document)
+
+
+def snapshot_menu(args):
+    # Imported here so the other commands do not load Pillow
+    import menu_snapshot
+
+    conn = _open(args.db)
+    written, removed = menu_snapshot.write_snapshot(conn.cursor(), args.out or menu_snapshot.SNAPSHOT_DIR)
+    conn.close()
+    for name in written:
+        print(f"written  {name}")
+    for name in removed:
+        print(f"removed  {name}")
+    if not written and not removed:
+        print("Menu snapshot is up to date")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="peony", description="Peony Cafe catalog and reports")
+    parser.add_argument("--db", default=DB_PATH, help="path to coffee_shop.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    prices_parser = commands.add_parser("prices", help="price list of every recipe")
+    prices_parser.add_argument("--json", action="store_true", help="print JSON instead of tab-separated text")
+    prices_parser.set_defaults(run=prices)
+
+    report_parser = commands.add_parser("report", help="sales between two Jalali dates")
+    report_parser.add_argument("--from", dest="first_day", type=_day, required=True, metavar="YYYY/MM/DD")
+    report_parser.add_argument("--to", dest="last_day", type=_day, required=True, metavar="YYYY/MM/DD")
+    report_parser.add_argument("--json", action="store_true", help="print JSON instead of tab-separated text")
+    report_parser.set_defaults(run=report)
+
+    menu_parser = commands.add_parser("export-menu", help="menu by category as JSON")
+    menu_parser.add_argument("-o", "--output", help="write to this file instead of standard output")
+    menu_parser.set_defaults(run=export_menu)
+
+    snapshot_parser = commands.add_parser("snapshot-menu", help="content-hashed menu files for the storefront")
+    snapshot_parser.add_argument("--out", help="folder to write the files to (default ../../user/static/menu)")
+    snapshot_parser.set_defaults(run=snapshot_menu)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Supplier price files dropped into a watched folder.
+
+A price file is CSV or JSON. Each row or object has a price_per_gram (or
+price) and either a sku or a name; the Persian headers "کد کالا", "نام" and
+"قیمت هر گرم" are accepted too. JSON files hold a list of objects or an
+object with a "prices" list.
+
+Rows are matched to materials by SKU first, then by normalized name, which
+ignores case, extra spaces, zero-width non-joiners, Arabic forms of ی and ک,
+and Persian digits. Only prices that differ are written. Processed files are
+moved to processed/ (or failed/ when they cannot be read) inside the folder,
+with the time they were archived added to the name, so a weekly prices.csv
+never collides with last week's.
+"""
+import csv
+import json
+import os
+import re
+import shutil
+from datetime import datetime
+
+import catalog
+
+
+FEED_EXTENSIONS = (".csv", ".json")
+FIELD_ALIASES = {
+    "sku": "sku", "کد کالا": "sku",
+    "name": "name", "نام": "name",
+    "price_per_gram": "price", "price": "price", "قیمت هر گرم": "price", "قیمت": "price",
+}
+_CHARACTER_MAP = str.maketrans({
+    "ي": "ی", "ى": "ی", "ك": "ک", "‌": " ",
+    **{persian: str(digit) for digit, persian in enumerate("۰۱۲۳۴۵۶۷۸۹")},
+    **{arabic: str(digit) for digit, arabic in enumerate("٠١٢٣٤٥٦٧٨٩")},
+})
+
+
+def normalize_name(name):
+    return re.sub(r"\s+", " ", name.translate(_CHARACTER_MAP)).strip().casefold()
+
+
+def _parse_price(value):
+    price = float(str(value).translate(_CHARACTER_MAP).replace(",", ""))
+    if price < 0:
+        raise ValueError(f"Negative price: {value}")
+    return round(price)
+
+
+def read_feed(path):
+    """[(sku, name, price)] from a CSV or JSON price file; raises ValueError on bad content."""
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8-sig") as f:
+            data = json.load(f)
+        rows = data.get("prices", []) if isinstance(data, dict) else data
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            rows = list(csv.DictReader(f))
+
+    entries = []
+    for row in rows:
+        if not isinstance(row, dict):
+            raise ValueError(f"Price entries must be objects: {row}")
+        fields = {FIELD_ALIASES[key.strip()]: value for key, value in row.items()
+                  if key and key.strip() in FIELD_ALIASES}
+        if "price" not in fields or not (fields.get("sku") or fields.get("name")):
+            raise ValueError(f"Row needs a price and a sku or name: {row}")
+        entries.append((str(fields.get("sku") or "").strip() or None, fields.get("name") or "",
+                        _parse_price(fields["price"])))
+    return entries
+
+
+def match_prices(cursor, entries):
+    """Split feed entries into changed prices and unmatched names.
+
+    Returns ([(material_id, name, old_price, new_price)], [unmatched]).
+    """
+    by_sku = {}
+    by_name = {}
+    current = {}
+    for material_id, name, sku, price in cursor.execute("SELECT id, name, sku, price_per_gram FROM materials"):
+        if sku:
+            by_sku[sku] = material_id
+        by_name[normalize_name(name)] = material_id
+        current[material_id] = (name, price)
+
+    changes = {}
+    unmatched = []
+    for sku, name, price in entries:
+        material_id = by_sku.get(sku) if sku else None
+        if material_id is None and name:
+            material_id = by_name.get(normalize_name(name))
+        if material_id is None:
+            unmatched.append(sku or name)
+            continue
+        material_name, old_price = current[material_id]
+        if old_price != price:
+            changes[material_id] = (material_id, material_name, old_price, price)
+    return list(changes.values()), unmatched
+
+
+def apply_prices(conn, changes):
+    """Write changed prices and return the IDs of the recipes that use those materials."""
+    cursor = conn.cursor()
+    cursor.executemany("UPDATE materials SET price_per_gram = ? WHERE id = ?",
+                       [(new_price, material_id) for material_id, _, _, new_price in changes])
+    conn.commit()
+    if not changes:
+        return []
+    return catalog.recipes_using(cursor, [material_id for material_id, _, _, _ in changes])
+
+
+def pending_files(folder):
+    """Price files waiting in the folder, oldest first."""
+    if not os.path.isdir(folder):
+        return []
+    paths = [os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(FEED_EXTENSIONS)]
+    return sorted(paths, key=os.path.getmtime)
+
+
+def archive(path, failed=False):
+    """Move a processed file out of the watched folder under a new name; returns that path."""
+    target = os.path.join(os.path.dirname(path), "failed" if failed else "processed")
+    os.makedirs(target, exist_ok=True)
+    stem, extension = os.path.splitext(os.path.basename(path))
+    name = f"{stem}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    destination = os.path.join(target, name + extension)
+    counter = 1
+    while os.path.exists(destination):
+        destination = os.path.join(target, f"{name}-{counter}{extension}")
+        counter += 1
+    shutil.move(path, destination)
+    return destination
+
+
+def process_folder(conn, folder):
+    """Apply every pending price file in the folder.
+
+    Returns (changes, recipe_ids, unmatched, failed_files) over all files.
+    A file that cannot be archived is reported in failed_files and stays in
+    the folder; its prices are already applied, so reading it again later
+    changes nothing.
+    """
+    all_changes, recipe_ids, unmatched, failed = [], set(), [], []
+    for path in pending_files(folder):
+        try:
+            entries = read_feed(path)
+        except (OSError, UnicodeDecodeError, ValueError, csv.Error) as e:
+            failed.append(f"{os.path.basename(path)}: {e}")
+            entries = None
+        if entries is not None:
+            changes, file_unmatched = match_prices(conn.cursor(), entries)
+            recipe_ids.update(apply_prices(conn, changes))
+            all_changes.extend(changes)
+            unmatched.extend(file_unmatched)
+        try:
+            archive(path, failed=entries is None)
+        except OSError as e:
+            failed.append(f"{os.path.basename(path)}: {e}")
+    return all_changes, sorted(recipe_ids), unmatched, failed
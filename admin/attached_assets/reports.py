@@ -0,0 +1,59 @@
+"""Sales reports over Jalali date ranges, from the rollup tables, and a single day's orders.
+
+Ranges are given as day keys (YYYYMMDD integers, see jalali_calendar) and
+need the jalali_calendar table and the sales rollups of db_schema.
+"""
+import jalali_calendar
+
+
+def day_orders(cursor, day_key, order_ids=None):
+    """(id, jalali_date, item_count, total) of a day's orders, or of only these."""
+    query = """
+        SELECT o.id, o.jalali_date, COUNT(oi.id), o.total_amount
+        FROM orders o
+        LEFT JOIN order_items oi ON o.id = oi.order_id
+        WHERE o.day_key = ?
+    """
+    params = [day_key]
+    if order_ids is not None:
+        query += f" AND o.id IN ({','.join('?' * len(order_ids))})"
+        params += order_ids
+    return cursor.execute(query + " GROUP BY o.id", params).fetchall()
+
+
+def sales_summary(cursor, first_day, last_day):
+    """Sales between two day keys, inclusive.
+
+    Returns (periods, recipes): periods are (label, order_count,
+    item_count, revenue) per day for ranges up to a month, with holidays
+    named, and per month for longer ones; recipes are (name, quantity,
+    revenue) ordered by revenue.
+    """
+    day_count = cursor.execute(
+        "SELECT COUNT(*) FROM jalali_calendar WHERE day_key BETWEEN ? AND ?", (first_day, last_day)
+    ).fetchone()[0]
+    if day_count <= 31:
+        period_sql = "c.jalali_date || COALESCE(' - ' || c.holiday_name, '')"
+        group_by = "c.day_key"
+    else:
+        period_sql = "substr(c.jalali_date, 1, 7)"
+        group_by = "c.month_key"
+    periods = cursor.execute(f"""
+        SELECT {period_sql}, COALESCE(SUM(s.order_count), 0), COALESCE(SUM(s.item_count), 0),
+               COALESCE(SUM(s.revenue), 0)
+        FROM jalali_calendar c
+        LEFT JOIN sales_daily s ON s.jalali_date = c.jalali_date
+        WHERE c.day_key BETWEEN ? AND ?
+        GROUP BY {group_by}
+        ORDER BY {group_by}
+    """, (first_day, last_day)).fetchall()
+    recipes = cursor.execute("""
+        SELECT COALESCE(r.name, '#' || s.recipe_id), SUM(s.quantity), SUM(s.revenue)
+        FROM sales_daily_recipe s
+        LEFT JOIN recipes r ON s.recipe_id = r.id
+        WHERE s.jalali_date BETWEEN ? AND ?
+        GROUP BY s.recipe_id
+        HAVING SUM(s.quantity) != 0
+        ORDER BY SUM(s.revenue) DESC
+    """, (jalali_calendar.to_jalali_date(first_day), jalali_calendar.to_jalali_date(last_day))).fetchall()
+    return periods, recipes
@@ -0,0 +1,101 @@
+"""Check that restoring a backup keeps the orders it removed from coming back.
+
+    python restore_check.py --db coffee_shop.db
+
+Takes a backup, sells through the order journal as a till does, restores
+the backup and then recovers the journal the way the next start does. The
+order count must be the backup's both right after the restore and after
+the recovery. Runs on a copy of the database in a temporary folder.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import backups
+import db_schema
+import order_service
+from order_journal import OrderJournal
+
+
+SALES = 2
+
+
+def order_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+
+def sell(conn, journal):
+    """Journal and apply one order of the first priced recipe, as a till does without the service."""
+    recipe_id, name, price = conn.execute("""
+        SELECT r.id, r.name, SUM(rd.quantity * m.price_per_gram)
+        FROM recipes r
+        JOIN recipe_details rd ON r.id = rd.recipe_id
+        JOIN materials m ON rd.material_id = m.id
+        GROUP BY r.id
+        LIMIT 1
+    """).fetchone()
+    line = {"recipe_id": recipe_id, "name": name, "quantity": 1, "unit_price": round(price)}
+    result = order_service.accept_orders(conn, journal, [{"payment_status": "paid", "lines": [line]}])[0]
+    if not result["ok"]:
+        raise RuntimeError(result["error"])
+    order_service.apply_journal(conn, journal)
+
+
+def check(db_path):
+    """List of failure messages; empty when the restore held."""
+    conn = order_service.connect(db_path)
+    db_schema.migrate(conn)
+    journal = OrderJournal(order_service.default_journal_path(db_path))
+    order_service.recover_orders(conn, journal)
+
+    backup_path = backups.backup_database(os.path.join(os.path.dirname(db_path), "before-sales.db"), db_path)
+    expected = order_count(conn)
+    for _ in range(SALES):
+        sell(conn, journal)
+    sold = order_count(conn)
+
+    backups.restore_database(backup_path, db_path)
+    restored = order_count(conn)
+    journal.close()
+    conn.close()
+
+    # The next start of the till
+    conn = order_service.connect(db_path)
+    journal = OrderJournal(order_service.default_journal_path(db_path))
+    replayed = order_service.recover_orders(conn, journal)
+    recovered = order_count(conn)
+    journal.close()
+    conn.close()
+
+    print(f"orders: backup {expected}, after sales {sold}, after restore {restored}, "
+          f"after restart {recovered} ({len(replayed)} replayed)")
+    failures = []
+    if sold != expected + SALES:
+        failures.append(f"expected {SALES} sales to be saved")
+    if restored != expected:
+        failures.append("restore did not bring back the backup's orders")
+    if recovered != expected:
+        failures.append("recovery replayed orders the restore removed")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peony Cafe restore and journal recovery check")
+    parser.add_argument("--db", default="coffee_shop.db", help="database to copy for the check")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="peony-restore-check-")
+    db_path = os.path.join(work_dir, "coffee_shop.db")
+    shutil.copy(args.db, db_path)
+    failures = check(db_path)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    if failures:
+        print("\n".join(failures))
+        sys.exit(1)
+    print("Restore held")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Daily sales rollups maintained in the same transaction as the orders.
+
+Three tables are kept, all keyed by the order's Jalali date:
+
+    sales_daily          totals per day
+    sales_daily_hour     totals per day and hour
+    sales_daily_recipe   quantity and revenue per day and recipe
+
+Cancelled orders are not counted. Rebuild the tables from the order history
+with:
+
+    python rollups.py --rebuild
+"""
+import argparse
+import sqlite3
+
+
+DB_PATH = "coffee_shop.db"
+
+
+def create_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            jalali_date TEXT PRIMARY KEY,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            item_count INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales_daily_hour (
+            jalali_date TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (jalali_date, hour)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales_daily_recipe (
+            jalali_date TEXT NOT NULL,
+            recipe_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (jalali_date, recipe_id)
+        )
+    """)
+
+
+def record_lines(cursor, jalali_date, jalali_time, lines, order_count=0, sign=1):
+    """Add (or with sign=-1 remove) order lines to the rollups.
+
+    lines are (recipe_id, quantity, total_price) tuples; order_count is 1
+    when the lines belong to a new order and 0 when they were appended.
+    """
+    hour = int(jalali_time[:2])
+    item_count = sign * sum(quantity for _, quantity, _ in lines)
+    revenue = sign * sum(total_price for _, _, total_price in lines)
+    order_count *= sign
+
+    cursor.execute("""
+        INSERT INTO sales_daily (jalali_date, order_count, item_count, revenue) VALUES (?, ?, ?, ?)
+        ON CONFLICT(jalali_date) DO UPDATE SET
+            order_count = order_count + excluded.order_count,
+            item_count = item_count + excluded.item_count,
+            revenue = revenue + excluded.revenue
+    """, (jalali_date, order_count, item_count, revenue))
+    cursor.execute("""
+        INSERT INTO sales_daily_hour (jalali_date, hour, order_count, revenue) VALUES (?, ?, ?, ?)
+        ON CONFLICT(jalali_date, hour) DO UPDATE SET
+            order_count = order_count + excluded.order_count,
+            revenue = revenue + excluded.revenue
+    """, (jalali_date, hour, order_count, revenue))
+    cursor.executemany("""
+        INSERT INTO sales_daily_recipe (jalali_date, recipe_id, quantity, revenue) VALUES (?, ?, ?, ?)
+        ON CONFLICT(jalali_date, recipe_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            revenue = revenue + excluded.revenue
+    """, [(jalali_date, recipe_id, sign * quantity, sign * total_price)
+          for recipe_id, quantity, total_price in lines])
+
+
+def record_order(cursor, order_id, sign=1):
+    """Add or remove a whole stored order, e.g. when it is cancelled."""
+    jalali_date, jalali_time = cursor.execute(
+        "SELECT jalali_date, jalali_time FROM orders WHERE id = ?", (order_id,)
+    ).fetchone()
+    lines = cursor.execute(
+        "SELECT recipe_id, quantity, total_price FROM order_items WHERE order_id = ?", (order_id,)
+    ).fetchall()
+    record_lines(cursor, jalali_date, jalali_time, lines, 1, sign)
+
+
+def rebuild(cursor):
+    """Recompute every rollup from the orders and order_items tables."""
+    create_tables(cursor)
+    cursor.execute("DELETE FROM sales_daily")
+    cursor.execute("DELETE FROM sales_daily_hour")
+    cursor.execute("DELETE FROM sales_daily_recipe")
+    cursor.execute("""
+        INSERT INTO sales_daily (jalali_date, order_count, item_count, revenue)
+        SELECT o.jalali_date, COUNT(DISTINCT o.id), COALESCE(SUM(oi.quantity), 0),
+               COALESCE(SUM(oi.total_price), 0)
+        FROM orders o
+        LEFT JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.order_status != 'cancelled'
+        GROUP BY o.jalali_date
+    """)
+    cursor.execute("""
+        INSERT INTO sales_daily_hour (jalali_date, hour, order_count, revenue)
+        SELECT o.jalali_date, CAST(substr(o.jalali_time, 1, 2) AS INTEGER), COUNT(DISTINCT o.id),
+               COALESCE(SUM(oi.total_price), 0)
+        FROM orders o
+        LEFT JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.order_status != 'cancelled'
+        GROUP BY o.jalali_date, CAST(substr(o.jalali_time, 1, 2) AS INTEGER)
+    """)
+    cursor.execute("""
+        INSERT INTO sales_daily_recipe (jalali_date, recipe_id, quantity, revenue)
+        SELECT o.jalali_date, oi.recipe_id, SUM(oi.quantity), SUM(oi.total_price)
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.order_status != 'cancelled'
+        GROUP BY o.jalali_date, oi.recipe_id
+    """)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peony Cafe sales rollups")
+    parser.add_argument("--db", default=DB_PATH, help="path to coffee_shop.db")
+    parser.add_argument("--rebuild", action="store_true", help="recompute rollups from order history")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    conn = sqlite3.connect(args.db, timeout=30, isolation_level=None)
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        rebuild(cursor)
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    days = cursor.execute("SELECT COUNT(*) FROM sales_daily").fetchone()[0]
+    conn.close()
+    print(f"Rollups rebuilt for {days} days")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Material stock ledger kept up to date by sales and stock-in receipts.
+
+Every movement is a row in stock_ledger (grams, negative for consumption)
+and material_stock holds the running balance per material. Sales are
+expanded through recipe_details, which is already the flat recipe to
+material expansion, with one indexed query per order, so the cost of a sale
+depends on the number of materials it touches and not on history.
+
+Ledger reasons:
+
+    sale      materials consumed by order lines
+    cancel    consumption returned by a cancelled order (negative if reopened)
+    receipt   stock-in from a supplier
+    count     correction to a physical stock count
+"""
+
+
+def create_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS material_stock (
+            material_id INTEGER PRIMARY KEY,
+            quantity REAL NOT NULL DEFAULT 0,
+            reorder_level REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY(material_id) REFERENCES materials(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stock_ledger (
+            id INTEGER PRIMARY KEY,
+            material_id INTEGER NOT NULL,
+            change REAL NOT NULL,
+            reason TEXT NOT NULL,
+            order_id INTEGER,
+            day_key INTEGER NOT NULL,
+            note TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(material_id) REFERENCES materials(id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_ledger_material_day ON stock_ledger(material_id, day_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_recipe_details_recipe ON recipe_details(recipe_id)")
+
+
+def _post(cursor, changes, reason, day_key, order_id=None, note=None):
+    """Write {material_id: grams} changes to the ledger and the balances."""
+    rows = [(material_id, change) for material_id, change in changes.items() if change]
+    cursor.executemany("""
+        INSERT INTO stock_ledger (material_id, change, reason, order_id, day_key, note)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(material_id, change, reason, order_id, day_key, note) for material_id, change in rows])
+    cursor.executemany("""
+        INSERT INTO material_stock (material_id, quantity) VALUES (?, ?)
+        ON CONFLICT(material_id) DO UPDATE SET quantity = quantity + excluded.quantity
+    """, rows)
+    return [material_id for material_id, _ in rows]
+
+
+def consume_lines(cursor, order_id, day_key, lines, reason="sale", sign=-1):
+    """Post the materials used by (recipe_id, quantity) lines.
+
+    sign=-1 takes them out of stock, sign=1 puts them back. Returns the IDs
+    of the materials that moved.
+    """
+    sold = {}
+    for recipe_id, quantity in lines:
+        sold[recipe_id] = sold.get(recipe_id, 0) + quantity
+    if not sold:
+        return []
+    placeholders = ",".join("?" * len(sold))
+    changes = {}
+    for recipe_id, material_id, grams in cursor.execute(f"""
+        SELECT recipe_id, material_id, quantity FROM recipe_details WHERE recipe_id IN ({placeholders})
+    """, tuple(sold)):
+        changes[material_id] = changes.get(material_id, 0) + sign * grams * sold[recipe_id]
+    return _post(cursor, changes, reason, day_key, order_id)
+
+
+def record_order(cursor, order_id, day_key, sign):
+    """Return a whole order's materials to stock (sign=1) or take them again (sign=-1)."""
+    lines = cursor.execute(
+        "SELECT recipe_id, quantity FROM order_items WHERE order_id = ?", (order_id,)
+    ).fetchall()
+    return consume_lines(cursor, order_id, day_key, lines, "cancel", sign)
+
+
+def low_stock(cursor, material_ids):
+    """(name, quantity, reorder_level) of the given materials at or below their reorder level."""
+    if not material_ids:
+        return []
+    placeholders = ",".join("?" * len(material_ids))
+    return cursor.execute(f"""
+        SELECT m.name, s.quantity, s.reorder_level
+        FROM material_stock s
+        JOIN materials m ON s.material_id = m.id
+        WHERE s.material_id IN ({placeholders}) AND s.reorder_level > 0 AND s.quantity <= s.reorder_level
+        ORDER BY m.name
+    """, tuple(material_ids)).fetchall()
+
+
+def receive(cursor, material_id, quantity, day_key, note=None):
+    """Record a stock-in receipt of quantity grams."""
+    if quantity <= 0:
+        raise ValueError("Received quantity must be positive")
+    _post(cursor, {material_id: quantity}, "receipt", day_key, note=note)
+
+
+def count(cursor, material_id, counted, day_key, note=None):
+    """Set a material's balance to a physical count, keeping the difference in the ledger."""
+    if counted < 0:
+        raise ValueError("Counted quantity cannot be negative")
+    row = cursor.execute("SELECT quantity FROM material_stock WHERE material_id = ?", (material_id,)).fetchone()
+    _post(cursor, {material_id: counted - (row[0] if row else 0)}, "count", day_key, note=note)
+
+
+def set_reorder_level(cursor, material_id, level):
+    cursor.execute("""
+        INSERT INTO material_stock (material_id, reorder_level) VALUES (?, ?)
+        ON CONFLICT(material_id) DO UPDATE SET reorder_level = excluded.reorder_level
+    """, (material_id, level))
+
+
+def stock_levels(cursor):
+    """(material_id, name, quantity, reorder_level) for every material."""
+    return cursor.execute("""
+        SELECT m.id, m.name, COALESCE(s.quantity, 0), COALESCE(s.reorder_level, 0)
+        FROM materials m
+        LEFT JOIN material_stock s ON s.material_id = m.id
+        ORDER BY m.name
+    """).fetchall()
+
+
+def reconciliation(cursor, first_day, last_day):
+    """Stock movements per material over a range of day keys.
+
+    Returns (name, opening, received, consumed, counted, closing, on_hand,
+    difference) rows. closing is the ledger balance at the end of the range;
+    difference compares the stored balance with the whole ledger and is
+    zero unless the two have drifted apart.
+    """
+    return cursor.execute("""
+        SELECT m.name,
+               COALESCE(SUM(CASE WHEN l.day_key < ? THEN l.change END), 0),
+               COALESCE(SUM(CASE WHEN l.day_key BETWEEN ? AND ? AND l.reason = 'receipt' THEN l.change END), 0),
+               COALESCE(SUM(CASE WHEN l.day_key BETWEEN ? AND ? AND l.reason IN ('sale', 'cancel')
+                            THEN l.change END), 0),
+               COALESCE(SUM(CASE WHEN l.day_key BETWEEN ? AND ? AND l.reason = 'count' THEN l.change END), 0),
+               COALESCE(SUM(CASE WHEN l.day_key <= ? THEN l.change END), 0),
+               COALESCE(s.quantity, 0),
+               COALESCE(s.quantity, 0) - COALESCE(SUM(l.change), 0)
+        FROM materials m
+        LEFT JOIN stock_ledger l ON l.material_id = m.id
+        LEFT JOIN material_stock s ON s.material_id = m.id
+        GROUP BY m.id
+        ORDER BY m.name
+    """, (first_day, first_day, last_day, first_day, last_day, first_day, last_day, last_day)).fetchall()
@@ -0,0 +1,81 @@
+"""Recipe photo thumbnails in a content-addressed disk cache.
+
+Photos are recipe_images/recipe-<id>.jpg (or .png). A thumbnail is stored
+as <sha256 of the photo>-<size>.jpg in the cache folder, so it is made once
+per photo content and size, however often the photo is renamed or copied.
+Hashing a full-size photo is not free either, so the digest of each file
+is remembered in index.json by (path, mtime, size).
+
+thumbnail() decodes and scales with Pillow and is meant to run in a worker
+process; JPEGs are decoded at reduced scale, so a camera photo costs a
+fraction of a full decode.
+"""
+import hashlib
+import json
+import os
+import re
+
+from PIL import Image
+
+
+IMAGE_DIR = "recipe_images"
+CACHE_DIR = "thumbnail_cache"
+RECIPE_IMAGE = re.compile(r"^recipe-(\d+)\.(jpe?g|png)$", re.IGNORECASE)
+
+# path|mtime_ns|size -> sha256, per cache folder, loaded on first use
+_indexes = {}
+
+
+def recipe_images(image_dir=IMAGE_DIR):
+    """{recipe_id: photo path} of the photos in image_dir."""
+    if not os.path.isdir(image_dir):
+        return {}
+    images = {}
+    for name in os.listdir(image_dir):
+        match = RECIPE_IMAGE.match(name)
+        if match:
+            images[int(match.group(1))] = os.path.join(image_dir, name)
+    return images
+
+
+def _index(cache_dir):
+    if cache_dir not in _indexes:
+        try:
+            with open(os.path.join(cache_dir, "index.json"), encoding="utf-8") as f:
+                _indexes[cache_dir] = json.load(f)
+        except (OSError, ValueError):
+            _indexes[cache_dir] = {}
+    return _indexes[cache_dir]
+
+
+def _digest(source_path, cache_dir):
+    """SHA-256 of the photo, hashed only when the file changed."""
+    stat = os.stat(source_path)
+    key = f"{os.path.abspath(source_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+    index = _index(cache_dir)
+    if key not in index:
+        sha = hashlib.sha256()
+        with open(source_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(block)
+        index[key] = sha.hexdigest()
+        index_path = os.path.join(cache_dir, "index.json")
+        with open(index_path + ".partial", "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(index_path + ".partial", index_path)
+    return index[key]
+
+
+def thumbnail(source_path, size, cache_dir=CACHE_DIR):
+    """Path of a thumbnail of source_path fitting size x size, made if missing."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{_digest(source_path, cache_dir)}-{size}.jpg")
+    if not os.path.exists(path):
+        with Image.open(source_path) as image:
+            # JPEG only: decode at the smallest scale that still covers size
+            image.draft("RGB", (size, size))
+            image = image.convert("RGB")
+            image.thumbnail((size, size))
+            image.save(path + ".partial", "JPEG", quality=85)
+        os.replace(path + ".partial", path)
+    return path